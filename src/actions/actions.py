@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+
+_path = os.path.dirname(os.path.realpath(__file__))
+_parent = os.path.abspath(os.path.join(_path, '..'))
+_lib = os.path.abspath(os.path.join(_parent, 'lib'))
+
+
+def _add_path(path):
+    if path not in sys.path:
+        sys.path.insert(1, path)
+
+
+_add_path(_parent)
+_add_path(_lib)
+
+from charms.layer import basic
+basic.bootstrap_charm_deps()
+
+from charmhelpers.core import hookenv, unitdata
+from charms.reactive import is_flag_set, set_flag
+from trilio import trilio_benchmark
+from trilio import trilio_data_mover_utils as utils
+from trilio import trilio_log_metrics
+from trilio import trilio_nfs_tune
+from trilio import trilio_timing
+
+
+def profile_install(args):
+    """
+    Shows the recorded per step timings of the last runs.
+    """
+    runs = trilio_timing.get_runs(
+        count=hookenv.action_get('runs'),
+        name=hookenv.action_get('handler') or None)
+    hookenv.action_set({
+        'output': trilio_timing.format_runs(runs) or 'No runs recorded',
+        'json': json.dumps(runs),
+    })
+
+
+def nfs_autotune(args):
+    """
+    Benchmarks an NFS share under candidate mount options, optionally
+    applying the fastest ones.
+    """
+    utils.load_unit_state()
+    apply = hookenv.action_get('apply')
+    results = utils.autotune_nfs_options(
+        share=hookenv.action_get('share') or None,
+        size_mb=hookenv.action_get('size-mb'),
+        files=hookenv.action_get('metadata-files'),
+        apply=apply)
+    output = {'output': trilio_nfs_tune.format_results(results),
+              'json': json.dumps(results)}
+    if apply:
+        utils.save_unit_state()
+        output['options'] = utils.effective_nfs_options()
+        if is_flag_set('tvault-contego.installed'):
+            restart = utils.restart_if_conf_changed()
+            if restart == 'requested':
+                set_flag('tvault-contego.restart-pending')
+            output['restart'] = restart or 'unchanged'
+        unitdata.kv().flush()
+    hookenv.action_set(output)
+
+
+def benchmark(args):
+    """
+    Benchmarks the backup target and compares the result with the previous
+    run of the same workload.
+    """
+    phases = [p.strip() for p in hookenv.action_get('phases').split(',')
+              if p.strip()]
+    unknown = set(phases) - set(trilio_benchmark.PHASES)
+    if unknown or not phases:
+        raise ValueError('phases must be some of {}'.format(
+            ', '.join(trilio_benchmark.PHASES)))
+    record = utils.benchmark_backup_target(
+        share=hookenv.action_get('share') or None,
+        phases=phases,
+        size_mb=hookenv.action_get('size-mb'),
+        block_size=hookenv.action_get('block-size'),
+        files=hookenv.action_get('files'),
+        threads=hookenv.action_get('threads'),
+        direct=hookenv.action_get('direct'))
+    unitdata.kv().flush()
+    history = trilio_benchmark.get_benchmarks(share=record['share'])
+    hookenv.action_set({
+        'output': trilio_benchmark.format_benchmarks([record], history),
+        'json': json.dumps(record),
+    })
+
+
+def benchmark_history(args):
+    """
+    Shows the recorded benchmark runs, newest first.
+    """
+    history = trilio_benchmark.get_benchmarks(
+        share=hookenv.action_get('share') or None)
+    runs = history[:hookenv.action_get('runs')]
+    output = trilio_benchmark.format_benchmarks(runs, history)
+    hookenv.action_set({
+        'output': output or 'No benchmarks recorded',
+        'json': json.dumps(runs),
+    })
+
+
+def log_metrics(args):
+    """
+    Parses the datamover log up to now and shows the transfer totals and
+    the recent snapshots.
+    """
+    state = utils.export_log_metrics()
+    unitdata.kv().flush()
+    hookenv.action_set({
+        'output': trilio_log_metrics.format_metrics(state),
+        'json': json.dumps({'totals': state['totals'],
+                            'recent': state['recent']}),
+    })
+
+
+def rollback(args):
+    """
+    Switches the datamover back to the previously active virtual env.
+    """
+    if not is_flag_set('tvault-contego.installed'):
+        raise ValueError('The datamover is not installed')
+    name = utils.rollback_datamover()
+    hookenv.action_set({'output': 'Rolled back to {}'.format(name)})
+
+
+ACTIONS = {
+    'profile-install': profile_install,
+    'nfs-autotune': nfs_autotune,
+    'benchmark': benchmark,
+    'benchmark-history': benchmark_history,
+    'log-metrics': log_metrics,
+    'rollback': rollback,
+}
+
+
+def main(args):
+    action_name = os.path.basename(args[0])
+    try:
+        action = ACTIONS[action_name]
+    except KeyError:
+        return 'Action {} undefined'.format(action_name)
+    else:
+        try:
+            action(args)
+        except Exception as e:
+            hookenv.action_fail(str(e))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
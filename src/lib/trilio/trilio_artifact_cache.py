@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+
+
+ARTIFACT_CACHE_DIR = '/var/cache/trilio-data-mover'
+META_FILE = 'meta.json'
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """
+    Returns the hex sha256 digest of the file at path.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    On disk cache of downloaded artifacts.
+
+    Entries are keyed by artifact name and version and record the sha256
+    and size of their content, they live in <root>/<name>/<version>/.
+    The content of an entry is checked against its sha256 the first time
+    the entry is used by a cache instance, so once per hook. Once the
+    cache grows over max_bytes the least recently used entries are
+    evicted.
+    """
+
+    def __init__(self, root=ARTIFACT_CACHE_DIR, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Entries whose content was checked against their sha256
+        self._verified = set()
+
+    def _entry_dir(self, name, version):
+        return os.path.join(self.root, name, version)
+
+    def _read_meta(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, META_FILE)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def staging_dir(self):
+        """
+        Returns a new temporary directory on the cache filesystem, so
+        that downloads can be moved into the cache without a copy.
+        """
+        staging = os.path.join(self.root, '.staging')
+        if not os.path.isdir(staging):
+            os.makedirs(staging)
+        return tempfile.mkdtemp(dir=staging)
+
+    def get(self, name, version, sha256=None):
+        """
+        Returns the path of the cached artifact or None if it is not
+        cached, is incomplete, does not match sha256 or its content does
+        not match its recorded sha256.
+        """
+        entry_dir = self._entry_dir(name, version)
+        meta = self._read_meta(entry_dir)
+        if not meta:
+            return None
+        path = os.path.join(entry_dir, meta['filename'])
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        if size != meta['size'] or (sha256 and sha256 != meta['sha256']):
+            log("Discarding stale cache entry {} {}".format(name, version))
+            self.remove(name, version)
+            return None
+        if (name, version) not in self._verified:
+            try:
+                digest = file_sha256(path)
+            except (IOError, OSError):
+                digest = None
+            if digest != meta['sha256']:
+                log("Discarding corrupt cache entry {} {}".format(
+                    name, version))
+                self.remove(name, version)
+                return None
+            with self._lock:
+                self._verified.add((name, version))
+        # Mark as recently used for eviction
+        os.utime(os.path.join(entry_dir, META_FILE), None)
+        return path
+
+    def sha256(self, name, version):
+        """
+        Returns the recorded sha256 of a cached artifact, or None.
+        """
+        meta = self.info(name, version)
+        return meta['sha256'] if meta else None
+
+    def info(self, name, version):
+        """
+        Returns the recorded filename, sha256 and size of a cached
+        artifact, or None.
+        """
+        return self._read_meta(self._entry_dir(name, version))
+
+    def add(self, name, version, src, sha256=None, move=True, verify=True):
+        """
+        Stores the file src as the artifact name at version.
+
+        If sha256 is given the content has to match it, unless verify is
+        False in which case sha256 is trusted to be the checksum of src,
+        e.g. because it was computed while downloading. The file is moved
+        into the cache unless move is False.
+
+        :returns: path of the cached artifact
+        """
+        if sha256 and not verify:
+            digest = sha256
+        else:
+            digest = file_sha256(src)
+        if sha256 and sha256 != digest:
+            raise ValueError('Checksum mismatch for {} {}: {} != {}'.format(
+                name, version, digest, sha256))
+
+        entry_dir = self._entry_dir(name, version)
+        filename = os.path.basename(src)
+        with self._lock:
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.makedirs(entry_dir)
+            path = os.path.join(entry_dir, filename)
+            if move:
+                shutil.move(src, path)
+            else:
+                shutil.copy(src, path)
+            meta = {
+                'filename': filename,
+                'sha256': digest,
+                'size': os.path.getsize(path),
+            }
+            # Write the metadata last, an entry without it is incomplete
+            fd, tmp = tempfile.mkstemp(dir=entry_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(meta, f)
+            os.rename(tmp, os.path.join(entry_dir, META_FILE))
+            self._verified.add((name, version))
+        self.evict(keep=(name, version))
+        return path
+
+    def remove(self, name, version):
+        with self._lock:
+            self._verified.discard((name, version))
+            shutil.rmtree(self._entry_dir(name, version), ignore_errors=True)
+
+    def entries(self):
+        """
+        Returns a list of (last_used, size, name, version) tuples.
+        """
+        result = []
+        if not os.path.isdir(self.root):
+            return result
+        for name in os.listdir(self.root):
+            name_dir = os.path.join(self.root, name)
+            if name.startswith('.') or not os.path.isdir(name_dir):
+                continue
+            for version in os.listdir(name_dir):
+                entry_dir = os.path.join(name_dir, version)
+                meta = self._read_meta(entry_dir)
+                if not meta:
+                    continue
+                last_used = os.path.getmtime(
+                    os.path.join(entry_dir, META_FILE))
+                result.append((last_used, meta['size'], name, version))
+        return result
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits in
+        max_bytes. The entry keep, a (name, version) tuple, is never
+        removed.
+        """
+        if not self.max_bytes:
+            return
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        for last_used, size, name, version in entries:
+            if total <= self.max_bytes:
+                break
+            if (name, version) == keep:
+                continue
+            log("Evicting {} {} from artifact cache".format(name, version))
+            self.remove(name, version)
+            total -= size
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Serves the artifact cache of a seeding unit to its peers.
+
+GET /artifacts/<name>/<version>/<filename> returns the cached file with
+its sha256 in the X-Checksum-Sha256 header. Open ranges are supported so
+that peers can resume interrupted downloads. At most max-clients downloads
+are served at a time, further requests are answered with 503 so that peers
+move on to another seeder or retry later.
+
+This runs as a service outside of hooks and only uses the standard
+library.
+"""
+import argparse
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import threading
+
+
+ARTIFACT_SERVER_PORT = 8089
+MAX_CLIENTS = 4
+META_FILE = 'meta.json'
+
+
+class ArtifactRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    server_version = 'trilio-artifact-server'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _artifact(self):
+        """
+        Returns (path, meta) of the requested artifact or (None, None).
+        """
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 4 or parts[0] != 'artifacts' or \
+                any(p in ('', '.', '..') or p.startswith('.')
+                    for p in parts[1:]):
+            return None, None
+        entry_dir = os.path.join(self.server.root, parts[1], parts[2])
+        try:
+            with open(os.path.join(entry_dir, META_FILE)) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None, None
+        path = os.path.join(entry_dir, meta['filename'])
+        if parts[3] != meta['filename'] or not os.path.isfile(path):
+            return None, None
+        return path, meta
+
+    def _range_start(self, size):
+        rng = self.headers.get('Range', '')
+        if not rng.startswith('bytes=') or not rng.endswith('-'):
+            return 0
+        try:
+            start = int(rng[len('bytes='):-1])
+        except ValueError:
+            return 0
+        return start if 0 < start < size else 0
+
+    def _send(self, body):
+        path, meta = self._artifact()
+        if path is None:
+            self.send_error(404)
+            return
+        if not self.server.slots.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header('Retry-After', '5')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            size = os.path.getsize(path)
+            start = self._range_start(size)
+            if start:
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, size - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(size - start))
+            self.send_header('ETag', '"{}"'.format(meta['sha256']))
+            self.send_header('X-Checksum-Sha256', meta['sha256'])
+            self.end_headers()
+            if body:
+                with open(path, 'rb') as f:
+                    f.seek(start)
+                    shutil.copyfileobj(f, self.wfile)
+        finally:
+            self.server.slots.release()
+
+    def do_GET(self):
+        self._send(body=True)
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+
+class ArtifactServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root, max_clients=MAX_CLIENTS):
+        http.server.HTTPServer.__init__(self, address, ArtifactRequestHandler)
+        self.root = root
+        self.slots = threading.BoundedSemaphore(max_clients)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve the artifact cache')
+    parser.add_argument('--root', required=True)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=ARTIFACT_SERVER_PORT)
+    parser.add_argument('--max-clients', type=int, default=MAX_CLIENTS)
+    args = parser.parse_args(args)
+    server = ArtifactServer((args.address, args.port), args.root,
+                            args.max_clients)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import collections
+import concurrent.futures
+import mmap
+import os
+import random
+import shutil
+import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    log,
+)
+from trilio.trilio_nfs import (
+    MountError,
+    temp_mount,
+)
+
+
+BENCHMARK_HISTORY_KEY = 'trilio.benchmark.history'
+BENCHMARK_HISTORY_SIZE = 20
+
+# Phases in the order they run, writes create the files read afterwards
+PHASES = ('seq-write', 'rand-write', 'seq-read', 'rand-read')
+
+Workload = collections.namedtuple(
+    'Workload', ['size_mb', 'block_size', 'files', 'threads', 'direct'])
+
+
+def parse_size(size):
+    """
+    Parses a size like 4096, 64K or 1M into bytes.
+    """
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if size and size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def make_workload(size_mb=256, block_size='1M', files=4, threads=4,
+                  direct=False):
+    """
+    Returns a validated Workload.
+
+    :raises: ValueError
+    """
+    block_size = parse_size(block_size)
+    if block_size < mmap.PAGESIZE or block_size % mmap.PAGESIZE:
+        raise ValueError('block size must be a multiple of {}'.format(
+            mmap.PAGESIZE))
+    if size_mb < 1 or files < 1 or threads < 1:
+        raise ValueError('size, files and threads must be positive')
+    if size_mb * 1024 ** 2 // files < block_size:
+        raise ValueError('files must hold at least one block each')
+    return Workload(size_mb, block_size, files, threads, bool(direct))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def _open(path, flags, direct):
+    if direct:
+        flags |= os.O_DIRECT
+    return os.open(path, flags, 0o600)
+
+
+def _file_blocks(workload):
+    return workload.size_mb * 1024 ** 2 // workload.files // \
+        workload.block_size
+
+
+def _run_thread(paths, phase, workload):
+    """
+    Runs a block sized operation of phase for every block of the files at
+    paths, sequentially through each file or at random aligned offsets.
+    Every write is of fresh random data, so that it can neither be
+    compressed nor deduplicated by the share.
+
+    :returns: list of per operation latencies in seconds
+    """
+    write = phase.endswith('write')
+    sequential = phase.startswith('seq')
+    blocks = _file_blocks(workload)
+    # mmap buffers are page aligned as O_DIRECT requires
+    buf = mmap.mmap(-1, workload.block_size)
+    flags = os.O_WRONLY | os.O_CREAT if write else os.O_RDONLY
+    fds = [_open(path, flags, workload.direct) for path in paths]
+    latencies = []
+    try:
+        for i in range(blocks * len(fds)):
+            if sequential:
+                fd = fds[i // blocks]
+                offset = (i % blocks) * workload.block_size
+            else:
+                fd = random.choice(fds)
+                offset = random.randrange(blocks) * workload.block_size
+            if write:
+                buf.seek(0)
+                buf.write(os.urandom(workload.block_size))
+            start = time.monotonic()
+            if write:
+                os.pwrite(fd, buf, offset)
+            else:
+                os.lseek(fd, offset, os.SEEK_SET)
+                os.readv(fd, [buf])
+            latencies.append(time.monotonic() - start)
+        if write:
+            for fd in fds:
+                os.fsync(fd)
+    finally:
+        for fd in fds:
+            os.close(fd)
+        buf.close()
+    return latencies
+
+
+def run_phase(directory, phase, workload):
+    """
+    Runs one phase of workload against the files in directory, the files
+    are spread over the threads.
+
+    :returns: dict with MB/s, IOPS and latency percentiles in ms
+    """
+    paths = [os.path.join(directory, 'bench-{}'.format(i))
+             for i in range(workload.files)]
+    threads = min(workload.threads, workload.files)
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(_run_thread, paths[i::threads], phase,
+                                   workload)
+                   for i in range(threads)]
+        latencies = sorted(lat for f in futures for lat in f.result())
+    elapsed = max(time.monotonic() - start, 1e-6)
+    ops = len(latencies)
+    return {
+        'phase': phase,
+        'mbps': round(ops * workload.block_size / 1024 ** 2 / elapsed, 1),
+        'iops': round(ops / elapsed, 1),
+        'lat_ms': dict(
+            (name, round(percentile(latencies, pct) * 1000, 3))
+            for name, pct in (('p50', 50), ('p95', 95), ('p99', 99),
+                              ('max', 100))),
+    }
+
+
+def run_benchmark(share, parent, workload, options=None, timeout=60,
+                  phases=PHASES):
+    """
+    Mounts share below parent and runs the phases of workload against it.
+    Reads run on a fresh mount so they are not served from the client
+    page cache of the writes.
+
+    :raises: MountError
+    :returns: benchmark record for the history
+    """
+    record = {
+        'started': time.time(),
+        'share': share,
+        'options': options,
+        'workload': workload._asdict(),
+        'results': [],
+    }
+    workdir = '.trilio-benchmark-{}'.format(os.getpid())
+    writes = [p for p in phases if p.endswith('write')]
+    reads = [p for p in phases if p.endswith('read')]
+    created = False
+    try:
+        with temp_mount(share, parent, options, timeout) as mountpoint:
+            directory = os.path.join(mountpoint, workdir)
+            os.mkdir(directory)
+            created = True
+            # Random writes and reads need the files, lay them out in full
+            # first unless a sequential write does
+            if 'seq-write' not in writes:
+                writes.insert(0, 'seq-write')
+            for phase in writes:
+                result = run_phase(directory, phase, workload)
+                if phase in phases:
+                    record['results'].append(result)
+        if reads:
+            with temp_mount(share, parent, options, timeout) as mountpoint:
+                directory = os.path.join(mountpoint, workdir)
+                for phase in reads:
+                    record['results'].append(
+                        run_phase(directory, phase, workload))
+    finally:
+        if created:
+            # Failing to clean up must not hide why the benchmark failed
+            try:
+                with temp_mount(share, parent, options, timeout) as \
+                        mountpoint:
+                    shutil.rmtree(os.path.join(mountpoint, workdir),
+                                  ignore_errors=True)
+            except (MountError, OSError) as e:
+                log("Unable to remove {} from {}: {}".format(
+                    workdir, share, e))
+    return record
+
+
+def save_benchmark(record):
+    """
+    Appends record to the benchmark history, keeping the newest
+    BENCHMARK_HISTORY_SIZE runs.
+    """
+    kv = unitdata.kv()
+    history = kv.get(BENCHMARK_HISTORY_KEY) or []
+    history.append(record)
+    kv.set(BENCHMARK_HISTORY_KEY, history[-BENCHMARK_HISTORY_SIZE:])
+
+
+def get_benchmarks(count=None, share=None):
+    """
+    Returns the newest count recorded benchmarks, newest first, optionally
+    only those of share.
+    """
+    history = unitdata.kv().get(BENCHMARK_HISTORY_KEY) or []
+    runs = [r for r in reversed(history)
+            if share is None or r['share'] == share]
+    return runs[:count] if count else runs
+
+
+def _previous(record, history):
+    """
+    Returns the newest run of history before record against the same
+    share with the same workload.
+    """
+    for run in history:
+        if run['started'] < record['started'] and \
+                run['share'] == record['share'] and \
+                run['workload'] == record['workload']:
+            return run
+    return None
+
+
+def format_benchmarks(runs, history=None):
+    """
+    Formats runs as a plain text table. Throughput is compared against the
+    previous comparable run in history, newest first, if there is one.
+    """
+    lines = []
+    for run in runs:
+        w = run['workload']
+        lines.append('{} at {}: {}MB, bs={}, files={}, threads={}, {}'.format(
+            run['share'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(run['started'])),
+            w['size_mb'], w['block_size'], w['files'], w['threads'],
+            'direct' if w['direct'] else 'buffered'))
+        previous = _previous(run, history or [])
+        before = dict((r['phase'], r['mbps'])
+                      for r in (previous or {}).get('results', []))
+        for r in run['results']:
+            change = ''
+            if before.get(r['phase']):
+                change = ' {:+.0f}%'.format(
+                    (r['mbps'] / before[r['phase']] - 1) * 100)
+            lines.append(
+                '  {:<10} {:>8.1f}MB/s {:>9.1f}IOPS  p50 {:.2f}ms '
+                'p95 {:.2f}ms p99 {:.2f}ms{}'.format(
+                    r['phase'], r['mbps'], r['iops'], r['lat_ms']['p50'],
+                    r['lat_ms']['p95'], r['lat_ms']['p99'], change))
+    return '\n'.join(lines)
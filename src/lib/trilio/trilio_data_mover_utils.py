@@ -1,110 +1,588 @@
+import concurrent.futures
 import configparser
+import glob
+import hashlib
+import io
+import json
 import netaddr
 import os
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
 import time
 
 from charmhelpers.core.host import (
+    service_restart,
+    service_start,
     service_stop,
     service_running,
     write_file,
-    mount,
-    umount,
     mounts,
     add_user_to_group,
     symlink,
     mkdir,
-    chownr,
 )
 from charmhelpers.core.hookenv import (
-    status_set,
+    charm_dir,
     config,
+    local_unit,
     log,
+    network_get_primary_address,
+    resource_get,
+    status_get,
+    unit_private_ip,
 )
+from charmhelpers.core import unitdata
 from charmhelpers.fetch import (
-    add_source,
     apt_install,
-    apt_update,
     apt_purge,
     filter_missing_packages,
-    archiveurl,
+)
+from trilio.trilio_artifact_cache import (
+    ARTIFACT_CACHE_DIR,
+    ArtifactCache,
+    file_sha256,
+)
+from trilio.trilio_benchmark import (
+    PHASES,
+    make_workload,
+    run_benchmark,
+    save_benchmark,
+)
+from trilio.trilio_fetch import (
+    extract_tarball,
+    fetch,
+    stream_extract,
+)
+from trilio.trilio_log_metrics import (
+    format_textfile,
+    load_metrics,
+    save_metrics,
+    update_metrics,
+    write_textfile,
+)
+from trilio import trilio_health
+from trilio import trilio_mountstats
+from trilio.trilio_nfs import (
+    MountError,
+    temp_mount,
+    umount_all,
+)
+from trilio.trilio_nfs_tune import (
+    tune_share,
+)
+from trilio.trilio_nova_conf import (
+    fingerprint,
+    resolve as resolve_nova_conf,
+)
+from trilio.trilio_ownership import (
+    ensure_ownership,
+)
+from trilio.trilio_package_index import (
+    PACKAGE_INDEX_KEY,
+    PackageIndex,
+)
+from trilio.trilio_peers import (
+    advertise_artifacts,
+    is_seeder,
+    PEER_RELATION,
+    peer_offers,
+    peer_units,
+    publish_restart,
+    update_restart_batch,
+)
+from trilio.trilio_probes import (
+    PathProbe,
+    ProbeResult,
+    ServiceProbe,
+    StatfsProbe,
+    appliance_probe,
+    appliance_probes,
+    describe_failures,
+    run_probe,
+    run_probes,
+)
+from trilio.trilio_pylibs import (
+    DATAMOVER_LIBRARIES,
+    interpreter_id,
+    interpreter_search_path,
+    resolve_libraries,
+)
+from trilio.trilio_resources import (
+    nova_config_files,
+    nova_pinned_cpus,
+    online_cpus,
+    resource_controls,
+)
+from trilio.trilio_steps import (
+    Step,
+    run_steps,
+    status_set,
+)
+from trilio.trilio_timing import (
+    span,
+)
+from trilio.trilio_tuning import (
+    DEFAULT_SETTINGS,
+    derive_settings,
+    measure_host,
+)
+from trilio.trilio_virtenv import (
+    VIRTENV_STAMP,
+    activate,
+    active_version,
+    adopt,
+    find_version,
+    prune,
+    previous_version,
+    read_stamp,
+    version_name,
 )
 
 
 TVAULT_VIRTENV_PATH = '/home/tvault/.virtenv'
 TVAULT_HOME = '/home/tvault'
+# The virtual env path is a symlink to the active version in here
+TVAULT_VIRTENV_VERSIONS = '/home/tvault/.virtenv-versions'
 DATAMOVER_CONF = '/etc/tvault-contego/tvault-contego.conf'
 TV_DATA_DIR = '/var/triliovault-mounts'
 TV_DATA_DIR_OLD = '/var/triliovault'
 DM_EXT_USR = 'nova'
 DM_EXT_GRP = 'nova'
+VIRTENV_ARTIFACT = 'tvault-contego-virtenv'
+DEB_ARTIFACT = 'tvault-contego-deb'
+# Juju resources which replace the downloads from the appliance
+VIRTENV_RESOURCE = 'tvault-contego-virtenv'
+DEB_RESOURCE = 'tvault-contego-deb'
+TRILIO_SOURCE_LIST = '/etc/apt/sources.list.d/trilio.list'
+APT_ARCHIVES = '/var/cache/apt/archives'
+HOST_FACTS_KEY = 'trilio.host-facts'
+NFS_TUNING_KEY = 'trilio.nfs-tuning'
+NOVA_CONF_KEY = 'trilio.nova-conf'
+PYTHON_LIBRARIES_KEY = 'trilio.python-libraries'
+INSTALL_CHECKPOINTS_KEY = 'trilio.install-checkpoints'
+SYSTEM_PYTHON = '/usr/bin/python'
+# Seconds to wait for tvault-object-store to stop on uninstall
+OBJECT_STORE_STOP_TIMEOUT = 15
+# Peer downloads are retried this often while all seeders are busy
+PEER_FETCH_ROUNDS = 4
+PEER_FETCH_BACKOFF = 5
+PEER_WAIT_KEY = 'trilio.peer-wait-since'
+RESTART_PENDING_KEY = 'trilio.restart-pending'
+RESTART_WAITING_STATUS = 'Waiting for its turn to restart'
+NFS_LATENCY_STATUS = 'NFS latency high'
+UNHEALTHY_STATUS = 'Unhealthy'
+ARTIFACT_SERVER_SERVICE = '/etc/systemd/system/trilio-artifact-server.service'
+# Config options which affect the datamover
+DATAMOVER_CONFIG_KEYS = ('triliovault-ip', 'nfs-shares', 'nfs-options',
+                         'max-uploads-pending', 'max-commit-pending',
+                         'qemu-agent-ping-timeout')
+# Config options which affect the datamover service unit
+SERVICE_CONFIG_KEYS = ('service-cpu-affinity', 'service-cpu-quota',
+                       'service-cpu-weight', 'service-nice',
+                       'service-io-scheduling-class', 'service-io-weight',
+                       'service-memory-max')
+DATAMOVER_SERVICE = '/etc/systemd/system/tvault-contego.service'
+
+# Install steps may run concurrently, apt and dpkg must not.
+APT_LOCK = threading.Lock()
+
+
+_package_index = None
+_resources = {}
+_host_facts = None
+_nfs_tuning = None
+_nova_conf = None
+_python_libraries = None
+_install_checkpoints = None
+
+
+def _in_main_thread():
+    return threading.current_thread() is threading.main_thread()
+
+
+def load_unit_state():
+    """
+    Loads the state cached in unitdata. Has to be called from the main
+    thread before any install steps are run, see save_unit_state.
+    """
+    global _nova_conf, _python_libraries, _install_checkpoints
+    get_package_index()
+    _load_host_facts()
+    _load_nfs_tuning()
+    if _nova_conf is None:
+        _nova_conf = unitdata.kv().get(NOVA_CONF_KEY)
+    if _python_libraries is None:
+        _python_libraries = unitdata.kv().get(PYTHON_LIBRARIES_KEY) or {}
+    if _install_checkpoints is None:
+        _install_checkpoints = unitdata.kv().get(INSTALL_CHECKPOINTS_KEY) or {}
+
+
+def save_unit_state():
+    """
+    Persists the state cached by install steps in unitdata.
+    """
+    save_package_index()
+    save_host_facts()
+    if _nfs_tuning is not None:
+        unitdata.kv().set(NFS_TUNING_KEY, _nfs_tuning)
+    if _nova_conf is not None:
+        unitdata.kv().set(NOVA_CONF_KEY, _nova_conf)
+    if _python_libraries:
+        unitdata.kv().set(PYTHON_LIBRARIES_KEY, _python_libraries)
+    if _install_checkpoints is not None:
+        unitdata.kv().set(INSTALL_CHECKPOINTS_KEY, _install_checkpoints)
+
+
+def install_checkpoints():
+    """
+    Returns the checkpoints of the install steps which completed in earlier
+    hooks, see run_steps. They are loaded by load_unit_state and persisted
+    by save_unit_state.
+    """
+    global _install_checkpoints
+    if _install_checkpoints is None:
+        _install_checkpoints = {}
+    return _install_checkpoints
+
+
+def clear_install_checkpoints():
+    """
+    Forgets the completed install steps, so that a new install starts from
+    scratch.
+    """
+    global _install_checkpoints
+    _install_checkpoints = {}
+    unitdata.kv().unset(INSTALL_CHECKPOINTS_KEY)
+
+
+def plugin_inputs():
+    """
+    Returns what the install_plugin step depends on.
+    """
+    deb = get_resource(DEB_RESOURCE, verify=False)
+    return {
+        'triliovault-ip': config('triliovault-ip'),
+        'version': get_new_version('tvault-contego'),
+        'resource': deb[1] if deb else None,
+    }
+
+
+def virt_env_inputs():
+    """
+    Returns what the create_virt_env step depends on.
+    """
+    virtenv = get_resource(VIRTENV_RESOURCE, verify=False)
+    return {
+        'version': get_new_version('tvault-contego'),
+        'resource': virtenv[1] if virtenv else None,
+    }
+
+
+def config_inputs(keys):
+    """
+    Returns a function returning the values of the config options keys,
+    for steps which only depend on those.
+    """
+    return lambda: dict((key, config(key)) for key in keys)
+
+
+def get_package_index():
+    """
+    Returns the package index of the configured TrilioVault appliance.
+
+    The index is shared by all version lookups of a hook. Its cached state
+    is loaded from unitdata on first use, which like save_package_index
+    has to happen in the main thread as unitdata is not thread safe.
+    """
+    global _package_index
+    url = 'http://{}:8081/packages/'.format(config('triliovault-ip'))
+    if _package_index is None or _package_index.url != url:
+        state = None
+        if _in_main_thread():
+            state = unitdata.kv().get(PACKAGE_INDEX_KEY)
+        _package_index = PackageIndex(url, state=state)
+    return _package_index
+
+
+def save_package_index():
+    """
+    Persists the package index state so that following hooks can reuse
+    or revalidate it.
+    """
+    if _package_index is not None and _package_index.state:
+        unitdata.kv().set(PACKAGE_INDEX_KEY, _package_index.state)
+
+
+def get_resource(name, verify=True):
+    """
+    Returns (path, sha256) of the juju resource name, or None if it is not
+    attached. Empty files stand for no resource, charm stores require one
+    to be uploaded. With verify the checksum has to match the
+    <name>-sha256 config option, if set.
+
+    :raises: ValueError if the checksum does not match
+    """
+    if name not in _resources:
+        path = resource_get(name)
+        if path and os.path.getsize(path):
+            with span('hash_resource'):
+                _resources[name] = (path, file_sha256(path))
+        else:
+            _resources[name] = None
+    resource = _resources[name]
+    expected = (config('{}-sha256'.format(name)) or '').strip().lower()
+    if verify and resource and expected and resource[1] != expected:
+        raise ValueError('{} resource checksum mismatch'.format(name))
+    return resource
+
+
+def deb_version(path):
+    """
+    Returns the version of the package in the .deb at path.
+    """
+    return subprocess.check_output(
+        ['dpkg-deb', '--field', path, 'Version']).decode('utf-8').strip()
 
 
 def get_new_version(pkg):
     """
-    Get the latest version available on the TrilioVault node.
+    Get the latest version available on the TrilioVault node, or that of
+    the attached tvault-contego-deb resource.
     """
-    tv_ip = config('triliovault-ip')
-    tv_port = 8081
+    if pkg == 'tvault-contego':
+        deb = get_resource(DEB_RESOURCE, verify=False)
+        if deb:
+            return deb_version(deb[0])
+    return get_package_index().version(pkg)
+
+
+def _load_host_facts():
+    global _host_facts
+    if _host_facts is None and _in_main_thread():
+        _host_facts = unitdata.kv().get(HOST_FACTS_KEY)
+
+
+def get_host_facts():
+    """
+    Returns the host facts used for autotuning. They are measured once
+    and only measured again when the NFS shares change, so that the
+    rendered config stays stable between hooks.
+    """
+    global _host_facts
+    _load_host_facts()
+    shares = sorted(get_nfs_shares())
+    if _host_facts is None or _host_facts['shares'] != shares:
+        with span('measure_host'):
+            _host_facts = measure_host(shares)
+        log("Measured host facts: {}".format(_host_facts))
+    return _host_facts
+
+
+def save_host_facts():
+    if _host_facts is not None:
+        unitdata.kv().set(HOST_FACTS_KEY, _host_facts)
+
+
+def datamover_settings():
+    """
+    Returns the datamover concurrency settings. Options set to 'auto' are
+    derived from the host facts.
+    """
+    settings = {}
+    auto = None
+    for key in sorted(DEFAULT_SETTINGS):
+        option = key.replace('_', '-')
+        value = str(config(option) or 'auto').strip().lower()
+        if value != 'auto':
+            try:
+                settings[key] = int(value)
+                continue
+            except ValueError:
+                log("Invalid value {!r} for {}, using auto".format(
+                    value, option))
+        if auto is None:
+            auto = derive_settings(get_host_facts())
+        settings[key] = auto[key]
+    return settings
+
+
+def _load_nfs_tuning():
+    global _nfs_tuning
+    if _nfs_tuning is None and _in_main_thread():
+        _nfs_tuning = unitdata.kv().get(NFS_TUNING_KEY)
+
+
+def effective_nfs_options():
+    """
+    Returns the NFS mount options for the datamover: the autotuned ones
+    if they were derived from the currently configured nfs-options,
+    otherwise nfs-options as configured. The autotuned options are loaded
+    from unitdata on first use, so every hook rendering the config keeps
+    them.
+    """
+    _load_nfs_tuning()
+    nfs_options = config('nfs-options')
+    if _nfs_tuning and _nfs_tuning.get('base') == nfs_options:
+        return _nfs_tuning['options']
+    return nfs_options
 
-    curl_cmd = 'curl -s http://{}:{}/packages/'.format(tv_ip, tv_port).split()
-    pkgs = subprocess.check_output(curl_cmd)
-    new_ver = re.search(
-        r'packages/{}-\s*([\d.]+)'.format(pkg),
-        pkgs.decode('utf-8')).group(1)[:-1]
 
-    return new_ver
+def autotune_nfs_options(share=None, size_mb=64, files=100, apply=True):
+    """
+    Benchmarks the NFS share, by default the first configured one, under
+    candidate mount option sets. If apply is set the fastest option set is
+    used by render_conf from now on.
+
+    :returns: ranked list of benchmark results
+    """
+    global _nfs_tuning
+    share = share or get_nfs_shares()[0]
+    base = config('nfs-options')
+    mkdir(TV_DATA_DIR, owner=DM_EXT_USR, group=DM_EXT_GRP, perms=501,
+          force=True)
+    with span('autotune_nfs'):
+        results = tune_share(share, base, TV_DATA_DIR, size_mb=size_mb,
+                             files=files,
+                             timeout=config('nfs-mount-timeout'))
+    best = results[0] if results and results[0]['ok'] else None
+    if best is None:
+        log("No NFS mount options could be benchmarked on {}".format(share))
+    elif apply:
+        log("Using NFS mount options {}".format(best['options']))
+        _nfs_tuning = {
+            'base': base,
+            'share': share,
+            'options': best['options'],
+            'results': results,
+        }
+    return results
+
+
+def autotune_nfs():
+    """
+    Install step autotuning the NFS mount options if nfs-options-autotune
+    is set. Failing to autotune does not fail the install, the configured
+    options are used instead.
+    """
+    if not config('nfs-options-autotune'):
+        return True
+    _load_nfs_tuning()
+    if _nfs_tuning and _nfs_tuning.get('base') == config('nfs-options') \
+            and _nfs_tuning.get('share') in get_nfs_shares():
+        log("NFS mount options already autotuned")
+        return True
+    autotune_nfs_options()
+    return True
+
+
+def benchmark_backup_target(share=None, phases=PHASES, **workload):
+    """
+    Mounts the NFS share, by default the first configured one, with the
+    datamover mount options and runs a throughput benchmark against it.
+    The result is appended to the benchmark history.
+
+    :raises: MountError, ValueError
+    :returns: benchmark record
+    """
+    workload = make_workload(**workload)
+    share = share or get_nfs_shares()[0]
+    mkdir(TV_DATA_DIR, owner=DM_EXT_USR, group=DM_EXT_GRP, perms=501,
+          force=True)
+    with span('benchmark'):
+        record = run_benchmark(share, TV_DATA_DIR, workload,
+                               options=effective_nfs_options(),
+                               timeout=config('nfs-mount-timeout'),
+                               phases=phases)
+    save_benchmark(record)
+    return record
 
 
 def check_presence(tv_file):
     """
-    Just a wrpper of 'ls' command
+    Checks that tv_file exists, without hanging on unresponsive mounts.
+    """
+    return run_probe(
+        PathProbe(tv_file, timeout=config('probe-timeout'))).ok
+
+
+def parse_nfs_shares(value):
+    """
+    Splits a comma or whitespace separated list of NFS exports.
+    """
+    return [share for share in re.split(r'[\s,]+', value or '') if share]
+
+
+def get_nfs_shares():
+    """
+    Returns the list of NFS exports configured in nfs-shares.
+    """
+    return parse_nfs_shares(config('nfs-shares'))
+
+
+def validate_nfs_share(share, timeout):
+    """
+    Test mounts a single NFS export on a temporary mount point below
+    TV_DATA_DIR, giving up after timeout seconds.
     """
     try:
-        subprocess.check_output(['ls', tv_file])
-        return True
-    except subprocess.CalledProcessError:
+        with span('mount {}'.format(share)), \
+                temp_mount(share, TV_DATA_DIR, timeout=timeout):
+            log("Device {} mounted successfully".format(share))
+    except MountError as e:
+        log(str(e))
         return False
-    return False
+    log("Device {} unmounted successfully".format(share))
+    return True
 
 
-def validate_nfs():
+def validate_nfs(shares=None):
     """
-    Validate the nfs mount device
+    Validate the nfs mount devices
+
+    All configured exports, or only shares if given, are test mounted
+    concurrently.
     """
     usr = DM_EXT_USR
     grp = DM_EXT_GRP
     data_dir = TV_DATA_DIR
-    device = config('nfs-shares')
+    devices = get_nfs_shares()
+    timeout = config('nfs-mount-timeout')
 
     # install nfs-common package
-    if not filter_missing_packages(['nfs-common']):
-        log("'nfs-common' package not found, installing the package...")
-        apt_install(['nfs-common'], fatal=True)
+    with APT_LOCK, span('install_nfs_common'):
+        if filter_missing_packages(['nfs-common']):
+            log("'nfs-common' package not found, installing the package...")
+            apt_install(['nfs-common'], fatal=True)
 
-    if not device:
+    if not devices:
         log("NFS shares can not be empty."
             "Check 'nfs-shares' value in config")
         status_set(
             'blocked',
             'No valid nfs-shares configuration found, please recheck')
         return False
+    if shares is not None:
+        devices = shares
 
     # Ensure mount directory exists
     mkdir(data_dir, owner=usr, group=grp, perms=501, force=True)
 
-    # check for mountable device
-    if not mount(device, data_dir, filesystem='nfs'):
-        log("Unable to mount, please enter valid mount device")
+    # check for mountable devices
+    with concurrent.futures.ThreadPoolExecutor(
+            max(len(devices), 1)) as executor:
+        results = list(executor.map(
+            lambda device: validate_nfs_share(device, timeout), devices))
+    failed = [d for d, ok in zip(devices, results) if not ok]
+    if failed:
+        log("Unable to mount {}, please enter valid mount devices".format(
+            ', '.join(failed)))
         status_set(
             'blocked',
             'Failed while validating NFS mount, please recheck configuration')
         return False
-    log("Device mounted successfully")
-    umount(data_dir)
-    log("Device unmounted successfully")
     return True
 
 
@@ -134,75 +612,401 @@ def add_users():
     return True
 
 
-def create_virt_env():
+def get_artifact_cache():
     """
-    Checks if latest version is installed or else imports the new virtual env
-    And installs the Datamover package.
+    Returns the artifact cache bounded by the configured size.
+    """
+    return ArtifactCache(
+        max_bytes=int(config('artifact-cache-size')) * 1024 * 1024)
+
+
+def cached_artifacts(cache):
+    """
+    Returns the cached artifacts as offered to peers, a
+    {name: {version: [sha256, filename]}} dict.
+    """
+    artifacts = {}
+    for _, _, name, version in cache.entries():
+        meta = cache.info(name, version)
+        if meta:
+            artifacts.setdefault(name, {})[version] = [
+                meta['sha256'], meta['filename']]
+    return artifacts
+
+
+def _clear_dir(path):
+    for entry in os.listdir(path):
+        entry = os.path.join(path, entry)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            shutil.rmtree(entry)
+        else:
+            os.remove(entry)
+
+
+def fetch_from_peers(cache, name, version, extract_to=None, owner=None):
+    """
+    Downloads the artifact name at version from a peer offering it into
+    the cache, verifying the checksum the peer advertised. Seeders which
+    are busy serving other peers are retried with a backoff.
+
+    :returns: path of the cached artifact, or None if no peer could
+              provide it
+    """
+    offers = peer_offers(name, version)
+    for attempt in range(PEER_FETCH_ROUNDS):
+        busy = False
+        for url, sha256 in offers:
+            staging = cache.staging_dir()
+            try:
+                dest = os.path.join(staging, os.path.basename(url))
+                with span('peer_fetch'):
+                    if extract_to:
+                        with open(dest, 'wb') as tee:
+                            stream_extract(url, extract_to, sha256=sha256,
+                                           tee=tee, owner=owner)
+                    else:
+                        fetch(url, dest, sha256=sha256)
+                log("Fetched {} {} from {}".format(name, version, url))
+                return cache.add(name, version, dest, sha256=sha256,
+                                 verify=False)
+            except Exception as e:
+                busy = busy or getattr(e, 'status', None) == 503
+                log("Unable to fetch {} {} from {}: {}".format(
+                    name, version, url, e))
+                if extract_to:
+                    _clear_dir(extract_to)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+        if not busy:
+            break
+        time.sleep(PEER_FETCH_BACKOFF * 2 ** attempt)
+    return None
+
+
+def download_artifact(cache, name, version, url, extract_to=None,
+                      owner=None):
+    """
+    Downloads url into the artifact cache as name at version, from a peer
+    if one offers it.
+
+    If extract_to is given the url is a gzipped tarball which is extracted
+    there while it is downloaded, owned by owner if given.
+
+    :returns: path of the cached artifact
+    """
+    path = fetch_from_peers(cache, name, version, extract_to=extract_to,
+                            owner=owner)
+    if path:
+        return path
+    staging = cache.staging_dir()
+    try:
+        dest = os.path.join(staging, os.path.basename(url))
+        if extract_to:
+            with open(dest, 'wb') as tee:
+                sha256 = stream_extract(url, extract_to, tee=tee,
+                                        owner=owner)
+        else:
+            sha256 = fetch(url, dest)
+        return cache.add(name, version, dest, sha256=sha256, verify=False)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def legacy_python_libraries(interpreter):
+    """
+    Locates the datamover libraries by importing them with interpreter.
+    """
+    cmd = [interpreter, 'files/trilio/get_pkgs.py']
+    with span('get_pkgs'):
+        output = subprocess.check_output(cmd).decode('utf-8')
+    return dict(zip(DATAMOVER_LIBRARIES, output.strip().split('\n')))
+
+
+def get_python_libraries(interpreter=SYSTEM_PYTHON):
+    """
+    Returns a {name: path} mapping of the system libraries the virtual env
+    links to. They are looked up on the path of the given interpreter
+    without importing them and cached until the interpreter changes or
+    one of them goes away. Importing them with get_pkgs.py is the fallback.
+    """
+    global _python_libraries
+    if _python_libraries is None:
+        _python_libraries = {}
+    key = interpreter_id(interpreter)
+    cached = _python_libraries.get(interpreter)
+    if cached and cached['id'] == key and \
+            all(os.path.exists(p) for p in cached['libraries'].values()):
+        return cached['libraries']
+    try:
+        search_path = interpreter_search_path(interpreter)
+        if search_path is None:
+            raise LookupError('Unable to derive the path of {}'.format(
+                interpreter))
+        libraries = dict(resolve_libraries(search_path=search_path))
+    except LookupError as e:
+        log("{}, importing the libraries instead".format(e))
+        libraries = legacy_python_libraries(interpreter)
+    _python_libraries[interpreter] = {'id': key, 'libraries': libraries}
+    return libraries
+
+
+def installed_virtenv():
+    """
+    Returns the version and tarball checksum recorded for the installed
+    virtual env, or an empty dict if there is no virtual env or it was not
+    installed by this charm.
+    """
+    return read_stamp(TVAULT_VIRTENV_PATH)
+
+
+def installed_virtenv_version():
+    """
+    Returns the version of the installed virtual env, or None if there is
+    no virtual env or it was not installed by this charm.
+    """
+    return installed_virtenv().get('version')
+
+
+def write_virtenv_stamp(venv_path, version, sha256):
+    """
+    Records the version and tarball checksum of the virtual env.
+    """
+    stamp = {'version': version, 'sha256': sha256}
+    write_file(os.path.join(venv_path, VIRTENV_STAMP),
+               json.dumps(stamp), owner=DM_EXT_USR, group=DM_EXT_GRP,
+               perms=0o644)
+
+
+def link_python_libraries(venv_path, libraries):
+    """
+    Replaces the libraries of the virtual env which have to match the
+    system python by links to or copies of the system ones.
+    """
+    usr = DM_EXT_USR
+    grp = DM_EXT_GRP
+    venv_pkg_path = '{}/lib/python2.7/site-packages/'.format(venv_path)
+    shutil.rmtree('{}/cryptography'.format(venv_pkg_path))
+    shutil.rmtree('{}/cffi'.format(venv_pkg_path))
+
+    symlink(libraries['cryptography'],
+            '{}/cryptography'.format(venv_pkg_path))
+    symlink(libraries['cffi'], '{}/cffi'.format(venv_pkg_path))
+
+    shutil.copy(libraries['libvirtmod'],
+                '{}/libvirtmod.so'.format(venv_pkg_path))
+    shutil.copy(libraries['_cffi_backend'],
+                '{}/_cffi_backend.so'.format(venv_pkg_path))
+
+    # The virtual env was extracted owned by nova, only the files added to
+    # it since need fixing.
+    for name in ('cryptography', 'cffi', 'libvirtmod.so',
+                 '_cffi_backend.so'):
+        ensure_ownership(os.path.join(venv_pkg_path, name), usr, grp)
+
+
+def prepare_virt_env():
+    """
+    Prepares the virtual env of the latest datamover version in its own
+    directory below TVAULT_VIRTENV_VERSIONS, while the active one keeps
+    serving. A version which was prepared before is reused.
+
+    :returns: name of the prepared version, or None on failure
     """
     usr = DM_EXT_USR
     grp = DM_EXT_GRP
     path = TVAULT_HOME
-    venv_path = TVAULT_VIRTENV_PATH
+    versions_dir = TVAULT_VIRTENV_VERSIONS
     tv_ip = config('triliovault-ip')
-    dm_ver = None
     # create virtenv dir(/home/tvault) if it does not exist
     mkdir(path, owner=usr, group=grp, perms=501, force=True)
+    mkdir(versions_dir, owner=usr, group=grp, perms=0o755, force=True)
+    # A virtual env installed in place by an older charm becomes the
+    # first version
+    adopted = adopt(TVAULT_VIRTENV_PATH, versions_dir)
+    if adopted:
+        log("Moved the installed Virtual Environment to {}".format(adopted))
 
+    try:
+        resource = get_resource(VIRTENV_RESOURCE)
+    except ValueError as e:
+        log("Not installing the Virtual Environment: {}".format(e))
+        status_set('blocked', 'Invalid {}'.format(e))
+        return None
     latest_dm_ver = get_new_version('tvault-contego')
-    if dm_ver == latest_dm_ver:
-        log("Latest TrilioVault DataMover package is already installed,"
-            " exiting")
-        return True
+    prepared = find_version(versions_dir, latest_dm_ver,
+                            resource[1] if resource else None)
+    if prepared:
+        if prepared == active_version(TVAULT_VIRTENV_PATH):
+            log("Latest TrilioVault DataMover package is already installed,"
+                " exiting")
+        else:
+            log("Using the prepared Virtual Environment {}".format(prepared))
+        return prepared
 
-    # Create virtual environment for DataMover
-    handler = archiveurl.ArchiveUrlFetchHandler()
+    # Create virtual environment for DataMover next to the active one, it
+    # only appears below versions_dir once it is complete.
+    cache = get_artifact_cache()
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=versions_dir)
+    venv_path = os.path.join(staging, os.path.basename(TVAULT_VIRTENV_PATH))
+    downloading = False
     try:
-        # remove old venv if it exists
-        shutil.rmtree(venv_path)
-        venv_src = 'http://{}:8081/packages/queens_ubuntu'\
-                   '/tvault-contego-virtenv.tar.gz'.format(tv_ip)
-        venv_dest = path
-        handler.install(venv_src, venv_dest)
-        log("Virtual Environment installed successfully")
+        if resource:
+            log("Using the attached {} resource".format(VIRTENV_RESOURCE))
+            venv_tarball, venv_sha256 = resource
+        else:
+            venv_tarball = cache.get(VIRTENV_ARTIFACT, latest_dm_ver)
+            venv_sha256 = cache.sha256(VIRTENV_ARTIFACT, latest_dm_ver)
+            if venv_tarball:
+                log("Using cached Virtual Environment {}".format(
+                    latest_dm_ver))
+        if venv_tarball:
+            with span('extract_virtenv'), open(venv_tarball, 'rb') as f:
+                extract_tarball(f, staging, owner=(usr, grp))
+        else:
+            venv_src = 'http://{}:8081/packages/queens_ubuntu'\
+                       '/tvault-contego-virtenv.tar.gz'.format(tv_ip)
+            downloading = True
+            with span('download_virtenv'):
+                download_artifact(cache, VIRTENV_ARTIFACT, latest_dm_ver,
+                                  venv_src, extract_to=staging,
+                                  owner=(usr, grp))
+            venv_sha256 = cache.sha256(VIRTENV_ARTIFACT, latest_dm_ver)
     except Exception as e:
-        log("Failed to install Virtual Environment")
-        status_set('blocked', 'Failed while Creating Virtual Env')
-        return False
+        log("Failed to install Virtual Environment: {}".format(e))
+        message = 'Failed while Creating Virtual Env'
+        if downloading:
+            message = fetch_failure_status(message, 'packages')
+        status_set('blocked', message)
+        shutil.rmtree(staging, ignore_errors=True)
+        return None
 
-    # Get dependent libraries paths
     try:
-        cmd = ['/usr/bin/python', 'files/trilio/get_pkgs.py']
-        sym_link_paths = \
-            subprocess.check_output(cmd).decode('utf-8').strip().split('\n')
-    except Exception as e:
-        log("Failed to get the dependent packages--{}".format(e))
-        return False
+        # Get dependent libraries paths
+        try:
+            libraries = get_python_libraries()
+        except Exception as e:
+            log("Failed to get the dependent packages--{}".format(e))
+            return None
+        # Create symlinks of the dependent libraries
+        link_python_libraries(venv_path, libraries)
+        # Record what is installed so that re-runs can skip the download
+        write_virtenv_stamp(venv_path, latest_dm_ver, venv_sha256)
+        name = version_name(latest_dm_ver, venv_sha256)
+        target = os.path.join(versions_dir, name)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(venv_path, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    log("Virtual Environment {} prepared successfully".format(name))
 
-    # Install TrilioVault Datamover package
-    if not install_plugin(tv_ip, latest_dm_ver, '/usr'):
-        return False
+    # change virtenv dir(/home/tvault) users to nova, the versions are
+    # owned by nova already
+    with span('ensure_ownership'):
+        counts = ensure_ownership(path, usr, grp,
+                                  exclude=[TVAULT_VIRTENV_PATH, versions_dir])
+    log("Changed ownership of {changed} of {scanned} files".format(**counts))
+
+    # Copy Trilio sudoers and filters files
+    shutil.copy('files/trilio/trilio_sudoers', '/etc/sudoers.d/')
+    shutil.copy('files/trilio/trilio.filters', '/etc/nova/rootwrap.d/')
+    return name
 
-    # Create symlinks of the dependent libraries
-    venv_pkg_path = '{}/lib/python2.7/site-packages/'.format(venv_path)
-    shutil.rmtree('{}/cryptography'.format(venv_pkg_path))
-    shutil.rmtree('{}/cffi'.format(venv_pkg_path))
 
-    symlink(sym_link_paths[0], '{}/cryptography'.format(venv_pkg_path))
-    symlink(sym_link_paths[2], '{}/cffi'.format(venv_pkg_path))
+def activate_virt_env(name):
+    """
+    Switches the virtual env path over to the version name and removes
+    the versions beyond virtenv-retention.
 
-    shutil.copy(sym_link_paths[1], '{}/libvirtmod.so'.format(venv_pkg_path))
-    shutil.copy(sym_link_paths[3], '{}/_cffi_backend.so'.format(venv_pkg_path))
+    :returns: True if the active version changed
+    """
+    changed = activate(TVAULT_VIRTENV_PATH, TVAULT_VIRTENV_VERSIONS, name)
+    if changed:
+        log("Switched the Virtual Environment to {}".format(name))
+    removed = prune(TVAULT_VIRTENV_PATH, TVAULT_VIRTENV_VERSIONS,
+                    config('virtenv-retention'))
+    if removed:
+        log("Removed Virtual Environments {}".format(', '.join(removed)))
+    return changed
 
-    # change virtenv dir(/home/tvault) users to nova
-    chownr(path, usr, grp)
 
-    # Copy Trilio sudoers and filters files
-    shutil.copy('files/trilio/trilio_sudoers', '/etc/sudoers.d/')
-    shutil.copy('files/trilio/trilio.filters', '/etc/nova/rootwrap.d/')
+def create_virt_env():
+    """
+    Checks if latest version is installed or else imports the new virtual env
+    And installs the Datamover package.
+    """
+    name = prepare_virt_env()
+    if name is None:
+        return False
+    activate_virt_env(name)
+    return True
+
 
+def installed_package_version(package):
+    """
+    Returns the installed version of package, or None.
+    """
+    try:
+        version = subprocess.check_output(
+            ['dpkg-query', '-W', '-f=${Version}', package]).decode('utf-8')
+    except subprocess.CalledProcessError:
+        return None
+    return version.strip() or None
+
+
+def upgrade_datamover():
+    """
+    Upgrades the datamover to the latest version. The new virtual env is
+    prepared and the package installed while the datamover keeps running,
+    then the virtual env is switched over and the service restarted once.
+
+    :returns: True if the datamover is at the latest version
+    """
+    old_package = installed_package_version('tvault-contego')
+    name = prepare_virt_env()
+    if name is None:
+        return False
+    if not install_packages():
+        return False
+    changed = activate_virt_env(name)
+    if changed or installed_package_version('tvault-contego') != old_package:
+        with span('service_restart'):
+            service_restart('tvault-contego')
+        log("TrilioVault Datamover upgraded to {}".format(name))
+    else:
+        log("TrilioVault Datamover is up to date")
     return True
 
 
+def rollback_datamover():
+    """
+    Switches the datamover back to the previously active virtual env and
+    restarts it. The package of that version is reinstalled if it is still
+    in the artifact cache.
+
+    :returns: name of the version rolled back to
+    :raises: ValueError if there is no previous version
+    """
+    name = previous_version(TVAULT_VIRTENV_PATH, TVAULT_VIRTENV_VERSIONS)
+    if name is None:
+        raise ValueError('No previous Virtual Environment to roll back to')
+    version = read_stamp(
+        os.path.join(TVAULT_VIRTENV_VERSIONS, name)).get('version')
+    deb = get_artifact_cache().get(DEB_ARTIFACT, version) if version else None
+    if deb and version != installed_package_version('tvault-contego'):
+        with APT_LOCK, span('apt_install'):
+            apt_install([deb], options=['--allow-unauthenticated',
+                                        '--allow-downgrades'], fatal=True)
+    elif not deb:
+        log("tvault-contego {} is not cached, only rolling back the "
+            "Virtual Environment".format(version))
+    activate(TVAULT_VIRTENV_PATH, TVAULT_VIRTENV_VERSIONS, name)
+    with span('service_restart'):
+        service_restart('tvault-contego')
+    log("TrilioVault Datamover rolled back to {}".format(name))
+    return name
+
+
 def ensure_files():
     """
     Ensures all the required files or directories
@@ -230,12 +1034,14 @@ def ensure_files():
     return True
 
 
-def create_conf():
+def render_conf():
     """
-    Creates datamover config file.
+    Renders the datamover config file.
+
+    :returns: the content of the config file
     """
-    nfs_share = config('nfs-shares')
-    nfs_options = config('nfs-options')
+    nfs_share = ','.join(get_nfs_shares())
+    nfs_options = effective_nfs_options()
 
     tv_config = configparser.RawConfigParser()
     tv_config.set('DEFAULT', 'vault_storage_nfs_export', nfs_share)
@@ -246,23 +1052,157 @@ def create_conf():
     tv_config.set('DEFAULT', 'log_file', '/var/log/nova/tvault-contego.log')
     tv_config.set('DEFAULT', 'debug', False)
     tv_config.set('DEFAULT', 'verbose', True)
-    tv_config.set('DEFAULT', 'max_uploads_pending', 3)
-    tv_config.set('DEFAULT', 'max_commit_pending', 3)
-    tv_config.set('DEFAULT', 'qemu_agent_ping_timeout', 600)
+    settings = datamover_settings()
+    tv_config.set('DEFAULT', 'max_uploads_pending',
+                  settings['max_uploads_pending'])
+    tv_config.set('DEFAULT', 'max_commit_pending',
+                  settings['max_commit_pending'])
+    tv_config.set('DEFAULT', 'qemu_agent_ping_timeout',
+                  settings['qemu_agent_ping_timeout'])
     tv_config.add_section('contego_sys_admin')
     tv_config.set('contego_sys_admin', 'helper_command',
                   'sudo /usr/bin/privsep-helper')
     tv_config.add_section('conductor')
     tv_config.set('conductor', 'use_local', True)
 
+    buf = io.StringIO()
+    tv_config.write(buf)
+    return buf.getvalue()
+
+
+def conf_differs(rendered):
+    """
+    Compares rendered config with the datamover config file on disk by
+    content hash.
+    """
+    rendered_sha256 = hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+    try:
+        return file_sha256(DATAMOVER_CONF) != rendered_sha256
+    except (IOError, OSError):
+        return True
+
+
+def changed_config_keys(keys=DATAMOVER_CONFIG_KEYS):
+    """
+    Returns the keys which differ from their values in the previous hook.
+    """
+    cfg = config()
+    return [key for key in keys if cfg.changed(key)]
+
+
+def create_conf(rendered=None):
+    """
+    Creates datamover config file.
+    """
+    if rendered is None:
+        rendered = render_conf()
+
     with open(DATAMOVER_CONF, 'w') as cf:
-        tv_config.write(cf)
+        cf.write(rendered)
         return True
 
     status_set('blocked', 'Failed while writing conf files')
     return False
 
 
+def restart_service(validate=()):
+    """
+    Stops the datamover, writes its config if it changed and starts it
+    again. The NFS shares in validate, those newly configured, are
+    validated first and the config is only written if they are valid.
+
+    :returns: True if the config is valid
+    """
+    rendered = render_conf()
+    save_unit_state()
+    valid = True
+    with span('service_stop'):
+        service_stop('tvault-contego')
+    if conf_differs(rendered):
+        shares = get_nfs_shares()
+        validate = sorted(set(validate) & set(shares))
+        valid = bool(shares and not validate) or \
+            validate_nfs(shares=validate)
+        if valid:
+            create_conf(rendered)
+    if valid:
+        status_set('active', 'Unit is ready')
+    with span('service_start'):
+        service_start('tvault-contego')
+    return valid
+
+
+def restarts_coordinated():
+    """
+    Returns True if restarts are rolled out over the units in batches of
+    restart-batch-size by the leader.
+    """
+    return config('restart-batch-size') > 0 and bool(peer_units())
+
+
+def request_restart(validate=()):
+    """
+    Asks the leader for a turn to restart. Requests made while waiting
+    are merged, the shares to validate of all of them are validated once
+    the unit restarts.
+    """
+    kv = unitdata.kv()
+    pending = kv.get(RESTART_PENDING_KEY) or {'validate': []}
+    pending['validate'] = sorted(set(pending['validate']) | set(validate))
+    pending['token'] = repr(time.time())
+    kv.set(RESTART_PENDING_KEY, pending)
+    publish_restart(requested=pending['token'])
+    status_set('waiting', RESTART_WAITING_STATUS)
+
+
+def restart_if_conf_changed():
+    """
+    Restarts the datamover if its rendered config changed. With
+    restart-batch-size set the restart is only requested from the leader
+    and done by the rolling-restart handler once it is this unit's turn.
+
+    :returns: 'restarted', 'requested' or None if the config is unchanged
+    """
+    if not conf_differs(render_conf()):
+        return None
+    if restarts_coordinated():
+        request_restart()
+        return 'requested'
+    restart_service()
+    return 'restarted'
+
+
+def rolling_restart():
+    """
+    Restarts the datamover for a pending restart request once the leader
+    lets this unit restart, or right away if restarts are no longer
+    coordinated. The health of the unit after the restart is reported to
+    the leader, which lets the next batch go once this one is healthy.
+
+    :returns: True if the request is done
+    """
+    kv = unitdata.kv()
+    pending = kv.get(RESTART_PENDING_KEY)
+    if not pending:
+        return True
+    if not restarts_coordinated():
+        restart_service(validate=pending['validate'])
+        kv.unset(RESTART_PENDING_KEY)
+        return True
+    size = config('restart-batch-size')
+    if local_unit() not in update_restart_batch(size):
+        status_set('waiting', RESTART_WAITING_STATUS)
+        return False
+    restart_service(validate=pending['validate'])
+    health, _ = check_health(force=True)
+    publish_restart(done=pending['token'], health=health)
+    kv.unset(RESTART_PENDING_KEY)
+    log("Restarted for request {}, {}".format(pending['token'], health))
+    # The leader may be in the batch itself
+    update_restart_batch(size)
+    return True
+
+
 def ensure_data_dir():
     """
     Ensures all the required directories are present
@@ -287,23 +1227,104 @@ def ensure_data_dir():
     return True
 
 
-def create_service_file():
+def legacy_nova_config_args():
     """
-    Creates datamover service file.
+    Returns the nova config arguments as resolved by nova itself, which
+    means importing all of nova under the virtual env python.
+    """
+    cmd = ['{}/bin/python'.format(TVAULT_VIRTENV_PATH),
+           'files/trilio/get_nova_conf.py']
+    with span('get_nova_conf'):
+        output = subprocess.check_output(cmd).decode('utf-8')
+    return output.split('\n')[0].split()
+
+
+def get_nova_config_args():
+    """
+    Returns the --config-file and --config-dir arguments nova-compute
+    runs with. They are resolved from the nova-compute systemd unit and
+    the default config locations, and only resolved again once one of
+    those files changes. get_nova_conf.py is the fallback if that finds
+    nothing. The first resolved config files are checked against those
+    of get_nova_conf.py, which wins if they differ.
+    """
+    global _nova_conf
+    if _nova_conf is not None:
+        if fingerprint(_nova_conf['paths']) == _nova_conf['fingerprint']:
+            return _nova_conf['args']
+    verified = bool(_nova_conf and _nova_conf.get('verified'))
+    with span('resolve_nova_conf'):
+        args, paths = resolve_nova_conf()
+    if args is None:
+        log("Unable to resolve the nova config files, asking nova")
+        args = legacy_nova_config_args()
+    elif not verified:
+        files = [arg for arg in args if arg.startswith('--config-file=')]
+        try:
+            legacy = legacy_nova_config_args()
+        except (subprocess.CalledProcessError, OSError) as e:
+            log("Unable to verify the nova config files: {}".format(e))
+            legacy = None
+        if legacy == files:
+            verified = True
+        elif legacy:
+            log("Resolved nova config files {} differ from nova's {}, "
+                "using nova's".format(files, legacy))
+            args = legacy + [arg for arg in args if arg not in files]
+    _nova_conf = {
+        'args': args,
+        'paths': paths,
+        'fingerprint': fingerprint(paths),
+        'verified': verified,
+    }
+    return args
+
+
+def service_resource_controls(nova_args=None):
+    """
+    Returns the resource control settings of the datamover service from
+    the service-* config options. With service-cpu-affinity auto the CPUs
+    nova pins guests to are read from the nova config.
+
+    :raises: ValueError if an option is invalid
+    """
+    settings = {key[len('service-'):]: config(key)
+                for key in SERVICE_CONFIG_KEYS}
+    online = pinned = None
+    if settings['cpu-affinity'] == 'auto':
+        if nova_args is None:
+            nova_args = get_nova_config_args()
+        online = online_cpus()
+        pinned = nova_pinned_cpus(nova_config_files(nova_args))
+        if not pinned:
+            log("No CPUs are pinned to guests, not setting CPUAffinity")
+    return resource_controls(settings, online=online, pinned=pinned)
+
+
+def render_service_file():
+    """
+    Renders the datamover service file.
+
+    :returns: the service file content, or None if the service resource
+              settings are invalid
     """
     usr = DM_EXT_USR
     grp = DM_EXT_GRP
-    venv_path = TVAULT_VIRTENV_PATH
-    cmd = ['{}/bin/python'.format(venv_path), 'files/trilio/get_nova_conf.py']
-
-    config_files = subprocess.check_output(cmd).decode('utf-8').split('\n')[0]
-    config_files = '{} --config-file={}'.format(
-        config_files, DATAMOVER_CONF)
-    if check_presence('/etc/nova/nova.conf.d'):
+    nova_args = get_nova_config_args()
+    try:
+        controls = service_resource_controls(nova_args)
+    except ValueError as e:
+        log("Invalid service resource settings: {}".format(e))
+        status_set('blocked', 'Invalid service resource settings: {}'.format(
+            e))
+        return None
+    config_files = ' '.join(
+        nova_args + ['--config-file={}'.format(DATAMOVER_CONF)])
+    if check_presence('/etc/nova/nova.conf.d') and \
+            '--config-dir=/etc/nova/nova.conf.d' not in nova_args:
         config_files = '{} --config-dir=/etc/nova/nova.conf.d'.format(
             config_files)
 
-    # create service file
     exec_start = '/usr/bin/python /usr/bin/tvault-contego {}\
                  '.format(config_files)
     tv_config = configparser.RawConfigParser()
@@ -320,15 +1341,161 @@ def create_service_file():
     tv_config.set('Service', 'TimeoutStopSec', 20)
     tv_config.set('Service', 'KillMode', 'process')
     tv_config.set('Service', 'Restart', 'always')
+    for key, value in controls.items():
+        tv_config.set('Service', key, value)
     tv_config.set('Install', 'WantedBy', 'multi-user.target')
+    rendered = io.StringIO()
+    tv_config.write(rendered)
+    return rendered.getvalue()
+
 
-    with open('/etc/systemd/system/tvault-contego.service', 'w') as cf:
-        tv_config.write(cf)
+def service_file_differs(rendered):
+    """
+    Compares rendered service file with the datamover service file on disk
+    by content hash.
+    """
+    rendered_sha256 = hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+    try:
+        return file_sha256(DATAMOVER_SERVICE) != rendered_sha256
+    except (IOError, OSError):
+        return True
+
+
+def create_service_file(rendered=None):
+    """
+    Creates datamover service file.
+    """
+    if rendered is None:
+        rendered = render_service_file()
+        if rendered is None:
+            return False
+    with open(DATAMOVER_SERVICE, 'w') as cf:
+        cf.write(rendered)
         return True
     status_set('blocked', 'Failed while creating DataMover service file')
     return False
 
 
+def update_service_file(rendered):
+    """
+    Rewrites the datamover service file with rendered and reloads systemd
+    so that the next (re)start of the service picks it up.
+    """
+    if not create_service_file(rendered):
+        return False
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    return True
+
+
+def export_log_metrics():
+    """
+    Parses what was appended to the datamover log since the last call and
+    rewrites the metrics file in metrics-textfile-dir for the node exporter
+    textfile collector, if that directory exists. Snapshots finished since
+    the last call are logged with their id, which the metrics leave out.
+    As the parser state is kept in unitdata this has to run in the main
+    thread.
+    """
+    state = load_metrics()
+    seen = set((r['snapshot'], r['started']) for r in state['recent'])
+    state = update_metrics(state)
+    save_metrics(state)
+    for record in state['recent']:
+        if (record['snapshot'], record['started']) not in seen:
+            log("Snapshot {} {}: {} bytes uploaded in {:.0f}s, {} "
+                "errors".format(record['snapshot'], record['status'],
+                                record['bytes'],
+                                record['ended'] - record['started'],
+                                record['errors']))
+    directory = config('metrics-textfile-dir')
+    if directory and os.path.isdir(directory):
+        write_textfile(format_textfile(state), directory)
+    return state
+
+
+def collect_nfs_stats(now=None):
+    """
+    Samples the NFS client statistics of the TrilioVault mounts, writes
+    their per mount and per operation statistics since the previous sample
+    to metrics-textfile-dir and reports operations slower than
+    nfs-latency-threshold-ms in the unit status. Main thread only.
+
+    :returns: the slow operations, see trilio_mountstats.slow_ops
+    """
+    stats = trilio_mountstats.sample(TV_DATA_DIR, now or time.time())
+    directory = config('metrics-textfile-dir')
+    if stats and directory and os.path.isdir(directory):
+        write_textfile(trilio_mountstats.format_textfile(stats), directory,
+                       name='trilio_nfs.prom')
+    threshold = config('nfs-latency-threshold-ms')
+    slow = trilio_mountstats.slow_ops(stats, threshold) if threshold else []
+    workload, message = status_get()
+    if slow and workload == 'active':
+        status_set('active', '{}: {}'.format(
+            NFS_LATENCY_STATUS, trilio_mountstats.describe_slow(slow)))
+    elif not slow and workload == 'active' and \
+            message.startswith(NFS_LATENCY_STATUS):
+        status_set('active', 'Unit is ready')
+    return slow
+
+
+def health_probes(timeout):
+    """
+    Returns the probes of the unit health: the appliance services, the
+    datamover service and the latency of each configured NFS share. Shares
+    which are not mounted below TV_DATA_DIR are returned as failed results
+    right away.
+
+    :returns: (probes, results)
+    """
+    probes = appliance_probes(config('triliovault-ip'), timeout=timeout)
+    probes.append(ServiceProbe('tvault-contego', timeout=timeout))
+    mounted = dict((device, mount_point) for mount_point, device in mounts()
+                   if mount_point.startswith(TV_DATA_DIR + '/'))
+    results = []
+    for share in get_nfs_shares():
+        if share in mounted:
+            probes.append(StatfsProbe(mounted[share], name=share,
+                                      timeout=timeout))
+        else:
+            results.append(ProbeResult(share, False, 0.0, 'not mounted'))
+    return probes, results
+
+
+def check_health(now=None, force=False):
+    """
+    Probes the health of the unit and reports it in the unit status. The
+    probes run at most every health-check-interval seconds, in between the
+    cached results are reported unless force is set. Statuses set for
+    other reasons, like invalid config, are left alone. Main thread only.
+
+    :returns: (health, description), see trilio_health.assess
+    """
+    now = now or time.time()
+    kv = unitdata.kv()
+    state = kv.get(trilio_health.HEALTH_KEY) or trilio_health.new_state()
+    if force or state['time'] is None or \
+            not 0 <= now - state['time'] < config('health-check-interval'):
+        probes, results = health_probes(config('probe-timeout'))
+        with span('health_probes'):
+            results = run_probes(probes) + results
+        trilio_health.record(state, results, now)
+        kv.set(trilio_health.HEALTH_KEY, state)
+    health, description = trilio_health.assess(
+        state, config('health-degraded-latency'))
+    workload, message = status_get()
+    if workload == 'active' or message.startswith(UNHEALTHY_STATUS):
+        if health == trilio_health.DOWN:
+            status_set('blocked', '{}: {}'.format(
+                UNHEALTHY_STATUS, description))
+        elif health == trilio_health.DEGRADED:
+            status_set('active', 'Unit is ready, degraded: {}'.format(
+                description))
+        else:
+            status_set('active', 'Unit is ready')
+    return health, description
+
+
 def validate_ip(ip):
     """
     Validate triliovault_ip provided by the user
@@ -339,13 +1506,16 @@ def validate_ip(ip):
     if ip and ip.strip():
         # Not blank
         if netaddr.valid_ipv4(ip):
-            try:
-                subprocess.check_call(['nc', '-vzw', '1', ip, '8781'])
-                return True
-            except subprocess.CalledProcessError:
+            # Only the API is needed at runtime, the package services are
+            # probed when a download from them fails
+            result = run_probe(appliance_probe(
+                ip, 'api', timeout=config('probe-timeout')))
+            if not result.ok:
+                failure = describe_failures([result])
+                log("TVault appliance probe failed: {}".format(failure))
                 status_set(
                     'blocked',
-                    'Unable to reach TVault appliance')
+                    'Unable to reach TVault appliance: {}'.format(failure))
                 return False
             return True
         else:
@@ -356,58 +1526,336 @@ def validate_ip(ip):
     return False
 
 
-def install_plugin(ip, ver, venv):
+def fetch_failure_status(message, service):
     """
-    Install TrilioVault DataMover package
+    Returns the status message for a failed download from the appliance
+    service, with the result of probing the service if it is unreachable.
+    """
+    result = run_probe(appliance_probe(
+        config('triliovault-ip'), service, timeout=config('probe-timeout')))
+    if result.ok:
+        return message
+    return '{}: {}'.format(message, describe_failures([result]))
+
+
+def write_trilio_source(ip):
+    """
+    Points the Trilio apt source list at the appliance deb repo.
+    """
+    write_file(TRILIO_SOURCE_LIST,
+               'deb http://{}:8085 deb-repo/\n'.format(ip), perms=0o644)
+
+
+def update_trilio_source():
+    """
+    Refreshes the package lists of the Trilio source only, the other
+    sources of the host are left alone.
+    """
+    subprocess.check_call([
+        'apt-get', 'update',
+        '-o', 'Dir::Etc::sourcelist={}'.format(TRILIO_SOURCE_LIST),
+        '-o', 'Dir::Etc::sourceparts=-',
+        '-o', 'APT::Get::List-Cleanup=0'])
+
+
+def archived_deb(package):
+    """
+    Returns the path of the .deb of the installed version of package in
+    the apt archive, or None.
+    """
+    version = installed_package_version(package)
+    if version is None:
+        return None
+    debs = glob.glob(os.path.join(APT_ARCHIVES, '{}_{}_*.deb'.format(
+        package, version.replace(':', '%3a'))))
+    return debs[0] if debs else None
+
+
+def install_plugin(ip, ver):
     """
-    add_source('deb http://{}:8085 deb-repo/'.format(ip))
+    Install TrilioVault DataMover package
 
+    nfs-common is installed in the same apt transaction. The .deb is kept
+    in the artifact cache so reinstalling the same version needs neither
+    a package list refresh nor a download. An attached tvault-contego-deb
+    resource is installed instead.
+    """
+    cache = get_artifact_cache()
+    fetching = False
     try:
-        apt_update()
-        apt_install(['tvault-contego'],
-                    options=['--allow-unauthenticated'], fatal=True)
+        resource = get_resource(DEB_RESOURCE)
+        if resource:
+            deb = resource[0]
+        else:
+            deb = cache.get(DEB_ARTIFACT, ver) or \
+                fetch_from_peers(cache, DEB_ARTIFACT, ver)
+        with APT_LOCK:
+            if not resource:
+                # Attached resources install without the appliance
+                write_trilio_source(ip)
+            if deb:
+                log("Using {} tvault-contego {}".format(
+                    'attached' if resource else 'cached', ver))
+                packages = ['nfs-common', deb]
+            else:
+                fetching = True
+                with span('apt_update'):
+                    update_trilio_source()
+                packages = ['nfs-common', 'tvault-contego']
+            with span('apt_install'):
+                apt_install(packages, options=['--allow-unauthenticated'],
+                            fatal=True)
         log("TrilioVault DataMover package installation passed")
-
-        status_set('maintenance', 'Starting')
-        return True
     except Exception as e:
         # Datamover package installation failed
         log("TrilioVault Datamover package installation failed")
         log("With exception --{}".format(e))
+        message = 'Failed while installing TrilioVault Datamover'
+        if fetching:
+            message = fetch_failure_status(message, 'deb-repo')
+        status_set('blocked', message)
         return False
 
+    if not deb:
+        archived = archived_deb('tvault-contego')
+        try:
+            if archived:
+                cache.add(DEB_ARTIFACT, ver, archived, move=False)
+        except (IOError, OSError) as e:
+            log("Unable to cache {}: {}".format(archived, e))
+    status_set('maintenance', 'Starting')
+    return True
 
-def uninstall_plugin():
+
+def install_packages():
     """
-    Uninstall TrilioVault DataMover packages
+    Install step for the datamover package.
+    """
+    return install_plugin(config('triliovault-ip'),
+                          get_new_version('tvault-contego'))
+
+
+def artifact_server_address():
+    """
+    Returns the address of this unit on the data-mover-peers relation,
+    which the artifact server binds to and is advertised at.
     """
-    retry_count = 0
     try:
-        path = TVAULT_VIRTENV_PATH
-        service_stop('tvault-contego')
+        return network_get_primary_address(PEER_RELATION)
+    except Exception as e:
+        # Juju without network-get or no binding for the relation
+        log("Using the private address for the artifact server: {}".format(
+            e))
+        return unit_private_ip()
+
+
+def render_artifact_server_unit(address):
+    server = os.path.join(charm_dir(), 'lib', 'trilio',
+                          'trilio_artifact_server.py')
+    unit = configparser.RawConfigParser()
+    unit.optionxform = str
+    unit.add_section('Unit')
+    unit.add_section('Service')
+    unit.add_section('Install')
+    unit.set('Unit', 'Description', 'TrilioVault DataMover artifact server')
+    unit.set('Unit', 'After', 'network.target')
+    unit.set('Service', 'Type', 'simple')
+    unit.set('Service', 'ExecStart',
+             '/usr/bin/python3 {} --root {} --address {} --port {} '
+             '--max-clients {}'.format(
+                 server, ARTIFACT_CACHE_DIR, address,
+                 config('artifact-server-port'),
+                 config('artifact-server-max-clients')))
+    unit.set('Service', 'Restart', 'always')
+    unit.set('Install', 'WantedBy', 'multi-user.target')
+    out = io.StringIO()
+    unit.write(out)
+    return out.getvalue()
+
+
+def ensure_artifact_server(address):
+    """
+    Installs and starts the service serving the artifact cache to peers
+    on address, restarting it if its settings changed.
+    """
+    rendered = render_artifact_server_unit(address)
+    try:
+        with open(ARTIFACT_SERVER_SERVICE) as f:
+            changed = f.read() != rendered
+    except (IOError, OSError):
+        changed = True
+    if changed:
+        with open(ARTIFACT_SERVER_SERVICE, 'w') as f:
+            f.write(rendered)
+        subprocess.check_call(['systemctl', 'daemon-reload'])
         subprocess.check_call(
-            ['sudo', 'systemctl', 'disable', 'tvault-contego'])
-        os.remove('/etc/systemd/system/tvault-contego.service')
-        subprocess.check_call('sudo systemctl daemon-reload')
-        shutil.rmtree(path)
-        os.remove('/etc/logrotate.d/tvault-contego')
-        os.remove(DATAMOVER_CONF)
-        os.remove('/var/log/nova/tvault-contego.log')
-        # Get the mount points and un-mount tvault's mount points.
-        mount_points = mounts()
-        sorted_list = [mp[0] for mp in mount_points
-                       if TV_DATA_DIR in mp[0]]
-        # stopping the tvault-object-store service may take time
-        while service_running('tvault-object-store') and retry_count < 3:
-            log('Waiting for tvault-object-store service to stop')
-            retry_count += 1
-            time.sleep(5)
-
-        for sl in sorted_list:
-            umount(sl)
-        # Uninstall tvault-contego package
+            ['systemctl', 'enable', 'trilio-artifact-server'])
+        service_restart('trilio-artifact-server')
+    elif not service_running('trilio-artifact-server'):
+        service_start('trilio-artifact-server')
+
+
+def stop_artifact_server():
+    if not os.path.exists(ARTIFACT_SERVER_SERVICE):
+        return
+    service_stop('trilio-artifact-server')
+    subprocess.check_call(['systemctl', 'disable', 'trilio-artifact-server'])
+    os.remove(ARTIFACT_SERVER_SERVICE)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+
+
+def update_artifact_sharing():
+    """
+    Serves the cached artifacts to the peers if this unit is a seeder,
+    otherwise makes sure it does not.
+    """
+    if config('artifact-seeders') and is_seeder():
+        address = artifact_server_address()
+        ensure_artifact_server(address)
+        advertise_artifacts(
+            'http://{}:{}'.format(address, config('artifact-server-port')),
+            cached_artifacts(get_artifact_cache()))
+    else:
+        stop_artifact_server()
+        advertise_artifacts(None, None)
+
+
+def stop_artifact_sharing():
+    stop_artifact_server()
+    advertise_artifacts(None, None)
+    return True
+
+
+def peer_artifacts_ready():
+    """
+    Returns True once this unit can install: it is a seeder, a peer offers
+    the current virtual env or this unit has waited artifact-peer-wait
+    seconds for one, after which it downloads from the appliance itself.
+    The wait starts over once artifacts are available without it.
+    """
+    kv = unitdata.kv()
+    if not config('artifact-seeders') or is_seeder() or \
+            get_resource(VIRTENV_RESOURCE, verify=False):
+        kv.unset(PEER_WAIT_KEY)
+        return True
+    try:
+        version = get_new_version('tvault-contego')
+    except Exception as e:
+        # Let the install steps report an unreachable appliance
+        log("Unable to look up the datamover version: {}".format(e))
+        return True
+    if peer_offers(VIRTENV_ARTIFACT, version):
+        kv.unset(PEER_WAIT_KEY)
+        return True
+    since = kv.get(PEER_WAIT_KEY)
+    if since is None:
+        since = time.time()
+        kv.set(PEER_WAIT_KEY, since)
+    if time.time() - since >= config('artifact-peer-wait'):
+        log("No peer offers the datamover {} yet, downloading it from the "
+            "appliance".format(version))
+        return True
+    return False
+
+
+def wait_for(predicate, timeout, interval=0.1, max_interval=2.0):
+    """
+    Polls predicate with exponential backoff until it returns True or
+    timeout seconds have passed.
+
+    :returns: the last result of predicate
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+    return True
+
+
+def stop_service():
+    """
+    Stops and removes the tvault-contego service.
+    """
+    service_stop('tvault-contego')
+    subprocess.check_call(['sudo', 'systemctl', 'disable', 'tvault-contego'])
+    os.remove(DATAMOVER_SERVICE)
+    subprocess.check_call(['sudo', 'systemctl', 'daemon-reload'])
+    return True
+
+
+def remove_files():
+    """
+    Removes the virtual env and its versions, config and log of the
+    datamover.
+    """
+    if os.path.islink(TVAULT_VIRTENV_PATH):
+        os.remove(TVAULT_VIRTENV_PATH)
+    elif os.path.isdir(TVAULT_VIRTENV_PATH):
+        shutil.rmtree(TVAULT_VIRTENV_PATH)
+    if os.path.isdir(TVAULT_VIRTENV_VERSIONS):
+        shutil.rmtree(TVAULT_VIRTENV_VERSIONS)
+    os.remove('/etc/logrotate.d/tvault-contego')
+    os.remove(DATAMOVER_CONF)
+    os.remove('/var/log/nova/tvault-contego.log')
+    return True
+
+
+def wait_object_store():
+    """
+    Waits for tvault-object-store, which goes away with tvault-contego, to
+    stop. Teardown carries on if it is still running after the timeout.
+    """
+    if not wait_for(lambda: not service_running('tvault-object-store'),
+                    OBJECT_STORE_STOP_TIMEOUT):
+        log('tvault-object-store service still running after {}s'.format(
+            OBJECT_STORE_STOP_TIMEOUT))
+    return True
+
+
+def umount_data_dir():
+    """
+    Unmounts everything mounted below TV_DATA_DIR, concurrently and
+    lazily if an unmount fails or hangs.
+    """
+    mount_points = [mp[0] for mp in mounts() if TV_DATA_DIR in mp[0]]
+    lazy = umount_all(mount_points, timeout=config('nfs-mount-timeout'))
+    if lazy:
+        log('Lazily unmounted {}'.format(', '.join(lazy)))
+    return True
+
+
+def purge_plugin():
+    with APT_LOCK:
         apt_purge(['tvault-contego'])
+        if os.path.exists(TRILIO_SOURCE_LIST):
+            os.remove(TRILIO_SOURCE_LIST)
+    return True
+
 
+def uninstall_plugin():
+    """
+    Uninstall TrilioVault DataMover packages
+
+    The files are removed while waiting for tvault-object-store to stop.
+    """
+    clear_install_checkpoints()
+    # A reinstall waits for the seeders anew
+    unitdata.kv().unset(PEER_WAIT_KEY)
+    steps = [
+        Step('stop_artifact_sharing', stop_artifact_sharing),
+        Step('stop_service', stop_service),
+        Step('remove_files', remove_files, requires=['stop_service']),
+        Step('wait_object_store', wait_object_store,
+             requires=['stop_service']),
+        Step('umount', umount_data_dir, requires=['wait_object_store']),
+        Step('apt_purge', purge_plugin, requires=['umount']),
+    ]
+    try:
+        if not run_steps(steps):
+            return False
         log("TrilioVault Datamover package uninstalled successfully")
         return True
     except Exception as e:
@@ -0,0 +1,211 @@
+import hashlib
+import http.client
+import os
+import tarfile
+import time
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+from trilio.trilio_http import (
+    POOL,
+    request_path,
+)
+from trilio.trilio_ownership import (
+    resolve_owner,
+)
+
+
+CHUNK_SIZE = 256 * 1024
+FETCH_RETRIES = 5
+
+
+class FetchError(Exception):
+
+    def __init__(self, message, status=None):
+        super(FetchError, self).__init__(message)
+        self.status = status
+
+
+class ResumableReader(object):
+    """
+    Read only file like object over the body of an HTTP GET.
+
+    When the connection drops the request is re-issued with a Range
+    header starting at the current offset, so consumers such as tarfile
+    streams never see the interruption. If the server ignores the Range
+    header the already read bytes are skipped instead. Everything read is
+    hashed and optionally written to tee.
+    """
+
+    def __init__(self, url, tee=None, retries=FETCH_RETRIES):
+        self.url = url
+        self.tee = tee
+        self.retries = retries
+        self.offset = 0
+        self.length = None
+        self.etag = None
+        self._digest = hashlib.sha256()
+        self._conn = None
+        self._resp = None
+
+    def _open(self):
+        self.close()
+        headers = {}
+        if self.offset:
+            headers['Range'] = 'bytes={}-'.format(self.offset)
+            if self.etag:
+                headers['If-Range'] = self.etag
+        self._conn, _ = POOL.get(self.url)
+        self._conn.request('GET', request_path(self.url), headers=headers)
+        resp = self._conn.getresponse()
+
+        if resp.status == 206 and self.offset:
+            content_range = resp.getheader('Content-Range', '')
+            if not content_range.startswith(
+                    'bytes {}-'.format(self.offset)):
+                raise FetchError('Unexpected Content-Range {!r} for {}'.format(
+                    content_range, self.url))
+        elif resp.status == 200:
+            etag = resp.getheader('ETag')
+            if self.offset and self.etag and etag != self.etag:
+                raise FetchError('{} changed during download'.format(
+                    self.url))
+            if self.length is None:
+                length = resp.getheader('Content-Length')
+                self.length = int(length) if length else None
+                self.etag = etag
+            # No range support, skip what was already consumed
+            skip = self.offset
+            while skip:
+                data = resp.read(min(skip, CHUNK_SIZE))
+                if not data:
+                    raise http.client.IncompleteRead(b'')
+                skip -= len(data)
+        else:
+            raise FetchError('Failed to fetch {}: HTTP {} {}'.format(
+                self.url, resp.status, resp.reason), status=resp.status)
+        self._resp = resp
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        attempt = 0
+        while True:
+            try:
+                if self._resp is None:
+                    self._open()
+                data = self._resp.read(size)
+                if not data and self.length is not None \
+                        and self.offset < self.length:
+                    raise http.client.IncompleteRead(
+                        b'', self.length - self.offset)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                log("Fetching {} interrupted at {} bytes ({}), "
+                    "resuming".format(self.url, self.offset, e))
+                self.close()
+                time.sleep(min(2 ** attempt, 30))
+
+        self.offset += len(data)
+        self._digest.update(data)
+        if self.tee is not None:
+            self.tee.write(data)
+        return data
+
+    def drain(self):
+        """
+        Reads the remainder of the body, e.g. after a tar stream ended
+        before the end of the file.
+        """
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def verify(self, sha256=None):
+        """
+        Raises FetchError unless the whole body was read and, if given,
+        matches sha256.
+        """
+        if self.length is not None and self.offset != self.length:
+            raise FetchError('Short read of {}: {} of {} bytes'.format(
+                self.url, self.offset, self.length))
+        if sha256 and sha256 != self.hexdigest():
+            raise FetchError('Checksum mismatch for {}: {} != {}'.format(
+                self.url, self.hexdigest(), sha256))
+
+    def close(self):
+        if self._conn is not None:
+            POOL.release(self.url, self._conn, self._resp)
+        self._conn = None
+        self._resp = None
+
+
+def extract_tarball(fileobj, dest, owner=None):
+    """
+    Extracts the gzipped tar stream fileobj into dest in a single pass.
+
+    Members which would end up outside of dest are refused. If owner, a
+    (user, group) tuple, is given the members are extracted with that
+    ownership instead of the one recorded in the archive. Ownership is
+    only applied when running as root.
+    """
+    dest = os.path.realpath(dest)
+    kwargs = {}
+    if hasattr(tarfile, 'fully_trusted_filter'):
+        # Virtual envs contain absolute symlinks to the system python
+        kwargs['filter'] = 'fully_trusted'
+    if owner:
+        uid, gid = resolve_owner(*owner)
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+        for member in tar:
+            target = os.path.realpath(os.path.join(dest, member.name))
+            if target != dest and not target.startswith(dest + os.sep):
+                raise FetchError('Refusing to extract {}'.format(member.name))
+            if owner:
+                member.uname, member.gname = owner
+                member.uid, member.gid = uid, gid
+            tar.extract(member, dest, **kwargs)
+
+
+def stream_extract(url, dest, sha256=None, tee=None, owner=None):
+    """
+    Downloads the gzipped tarball at url and extracts it into dest while
+    it is being downloaded.
+
+    The body is written to tee, if given, for caching. Integrity can only
+    be established once the download is complete, so dest should be a
+    staging directory which is discarded on failure. owner is passed on to
+    extract_tarball.
+
+    :returns: sha256 of the tarball
+    """
+    reader = ResumableReader(url, tee=tee)
+    try:
+        extract_tarball(reader, dest, owner=owner)
+        reader.drain()
+        reader.verify(sha256)
+    finally:
+        reader.close()
+    return reader.hexdigest()
+
+
+def fetch(url, dest, sha256=None):
+    """
+    Downloads url to the file dest, resuming after interruptions.
+
+    :returns: sha256 of the downloaded file
+    """
+    with open(dest, 'wb') as f:
+        reader = ResumableReader(url, tee=f)
+        try:
+            reader.drain()
+            reader.verify(sha256)
+        finally:
+            reader.close()
+    return reader.hexdigest()
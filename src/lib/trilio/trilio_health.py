@@ -0,0 +1,94 @@
+"""
+Health of a datamover unit over time.
+
+The results of the health probes are kept per probe in a sliding window
+of the most recent samples. A unit is down if a probe fails now and
+degraded if a probe failed within the window or its median latency over
+the window is above the degraded latency.
+"""
+import collections
+
+from trilio.trilio_benchmark import (
+    percentile,
+)
+from trilio.trilio_probes import (
+    ProbeResult,
+)
+
+
+HEALTH_KEY = 'trilio.health'
+HEALTH_WINDOW = 12
+
+HEALTHY = 'healthy'
+DEGRADED = 'degraded'
+DOWN = 'down'
+
+ProbeStats = collections.namedtuple(
+    'ProbeStats', ['name', 'samples', 'failures', 'p50', 'p95'])
+
+
+def new_state():
+    return {'time': None, 'results': [], 'history': {}}
+
+
+def record(state, results, now, window=HEALTH_WINDOW):
+    """
+    Stores results as the latest of state and adds them to the history of
+    their probes, keeping the newest window samples of each. The history of
+    probes which are gone, like those of removed shares, is dropped.
+    """
+    history = state['history']
+    names = set(r.name for r in results)
+    for name in list(history):
+        if name not in names:
+            del history[name]
+    for r in results:
+        samples = history.setdefault(r.name, [])
+        samples.append([now, r.ok, r.latency])
+        del samples[:-window]
+    state['time'] = now
+    state['results'] = [list(r) for r in results]
+    return state
+
+
+def latest(state):
+    return [ProbeResult(*r) for r in state['results']]
+
+
+def probe_stats(name, samples):
+    """
+    Returns the ProbeStats of the samples of a probe, latencies are only
+    those of successful samples.
+    """
+    latencies = sorted(latency for _, ok, latency in samples if ok)
+    return ProbeStats(
+        name=name,
+        samples=len(samples),
+        failures=sum(1 for _, ok, _ in samples if not ok),
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95))
+
+
+def assess(state, degraded_latency):
+    """
+    Returns the health of the unit and a description of what is wrong, if
+    anything.
+
+    :returns: (HEALTHY|DEGRADED|DOWN, description)
+    """
+    results = latest(state)
+    failed = [r for r in results if not r.ok]
+    if failed:
+        return DOWN, ', '.join('{} {}'.format(r.name, r.detail)
+                               for r in failed)
+    problems = []
+    for r in results:
+        stats = probe_stats(r.name, state['history'].get(r.name, []))
+        if stats.failures:
+            problems.append('{} failed {}/{}'.format(
+                r.name, stats.failures, stats.samples))
+        elif stats.p50 is not None and stats.p50 > degraded_latency:
+            problems.append('{} p50 {:.0f}ms'.format(r.name, stats.p50 * 1000))
+    if problems:
+        return DEGRADED, ', '.join(problems)
+    return HEALTHY, ''
@@ -0,0 +1,109 @@
+import collections
+import http.client
+import threading
+import urllib.parse
+
+
+HTTP_TIMEOUT = 30
+POOL_MAXSIZE = 4
+
+Response = collections.namedtuple('Response', ['status', 'headers', 'body'])
+
+
+def _origin(url):
+    parsed = urllib.parse.urlsplit(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    return parsed.scheme, parsed.hostname, port
+
+
+def request_path(url):
+    """
+    Returns the path and query of url as used in the request line.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path = '{}?{}'.format(path, parsed.query)
+    return path
+
+
+class ConnectionPool(object):
+    """
+    Pool of keep-alive HTTP connections, keyed by origin.
+
+    Connections are handed out with get() and have to be returned with
+    put() once the response has been read completely, or closed.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, maxsize=POOL_MAXSIZE):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Returns a connection to the origin of url, reusing an idle one
+        if there is any. The second value tells whether it was reused.
+        """
+        origin = _origin(url)
+        with self._lock:
+            if self._idle[origin]:
+                return self._idle[origin].pop(), True
+        scheme, host, port = origin
+        if scheme == 'https':
+            conn_cls = http.client.HTTPSConnection
+        else:
+            conn_cls = http.client.HTTPConnection
+        return conn_cls(host, port, timeout=self.timeout), False
+
+    def put(self, url, conn):
+        with self._lock:
+            idle = self._idle[_origin(url)]
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def release(self, url, conn, resp):
+        """
+        Returns conn to the pool if resp was read completely and the
+        server keeps the connection open, closes it otherwise.
+        """
+        if resp is not None and resp.isclosed() and not resp.will_close:
+            self.put(url, conn)
+        else:
+            conn.close()
+
+    def request(self, method, url, headers=None):
+        """
+        Performs a request and reads the whole response body. Header
+        names of the response are lower cased.
+
+        A request on a reused connection which the server has closed in
+        the meantime is retried once on a new connection.
+        """
+        while True:
+            conn, reused = self.get(url)
+            try:
+                conn.request(method, request_path(url), headers=headers or {})
+                resp = conn.getresponse()
+                body = resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            self.release(url, conn, resp)
+            headers = dict((k.lower(), v) for k, v in resp.getheaders())
+            return Response(resp.status, headers, body)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+POOL = ConnectionPool()
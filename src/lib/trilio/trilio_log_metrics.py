@@ -0,0 +1,378 @@
+"""
+Incremental parser of the datamover log exporting transfer metrics.
+
+Every run only reads the lines appended since the previous one. The byte
+offset is kept together with a hash of the first line of the log, which
+is how both renaming and copytruncate rotation are told apart from a log
+which merely grew. The lines written before a rotation are read from the
+rotated file.
+
+Lines are attributed to a snapshot by the snapshot id they mention or,
+failing that, by their request id. Transfer lines give the size and the
+duration of a disk upload, ERROR lines count as errors and a snapshot
+line saying it completed or failed finishes the snapshot.
+"""
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from charmhelpers.core import unitdata
+
+
+DATAMOVER_LOG = '/var/log/nova/tvault-contego.log'
+LOG_METRICS_KEY = 'trilio.log-metrics'
+TEXTFILE_NAME = 'trilio_datamover.prom'
+# logrotate compresses right away, older setups may not
+ROTATED_SUFFIXES = ('.1', '.1.gz')
+# Bounds on the state kept in unitdata
+RECENT_SNAPSHOTS = 20
+ACTIVE_SNAPSHOTS = 50
+TRACKED_REQUESTS = 200
+MAX_READ = 32 * 1024 ** 2
+HEAD_BYTES = 1024
+
+_LINE_RE = re.compile(
+    r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?P<fraction>\.\d+)?\s+'
+    r'\d+\s+(?P<level>[A-Z]+)\s+\S+\s+'
+    r'(?:\[(?P<request>req-[0-9a-f-]+)[^\]]*\]\s*)?(?P<message>.*)$')
+_UUID = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+_SNAPSHOT_RE = re.compile(
+    r'\bsnapshot(?:[ _]id)?\W{0,3}(?P<snapshot>' + _UUID + ')', re.I)
+_TRANSFER_RE = re.compile(
+    r'\b(?:upload(?:ed)?|transferred|copied)\b.*?'
+    r'(?P<size>\d+(?:\.\d+)?)\s*(?P<unit>bytes|[KMGT]i?B|B)\b.*?'
+    r'\b(?:in|took)\s+(?P<seconds>\d+(?:\.\d+)?)\s*(?:s|secs?|seconds)\b',
+    re.I)
+_DISK_RE = re.compile(r'\b(?:disk|dev)\W{1,3}(?P<disk>[\w./-]+)', re.I)
+_END_RE = re.compile(r'\b(?P<status>completed|finished|succeeded|failed)\b',
+                     re.I)
+_UNITS = {'B': 1, 'BYTES': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3,
+          'TB': 1000 ** 4, 'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3,
+          'TIB': 1024 ** 4}
+
+
+def new_state():
+    return {
+        'position': {'head': None, 'offset': 0},
+        'totals': {'bytes': 0, 'seconds': 0.0, 'transfers': 0, 'errors': 0,
+                   'completed': 0, 'failed': 0},
+        'outcomes': {},
+        'active': {},
+        'requests': {},
+        'recent': [],
+        'updated': None,
+    }
+
+
+def load_metrics():
+    return unitdata.kv().get(LOG_METRICS_KEY) or new_state()
+
+
+def save_metrics(state):
+    unitdata.kv().set(LOG_METRICS_KEY, state)
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _head(f):
+    """
+    Returns a hash identifying the log f, None until its first line is
+    complete.
+    """
+    f.seek(0)
+    line = f.readline(HEAD_BYTES)
+    if not line.endswith(b'\n') and len(line) < HEAD_BYTES:
+        return None
+    return hashlib.sha1(line).hexdigest()
+
+
+def _read_rotated(path, position, max_bytes):
+    for suffix in ROTATED_SUFFIXES:
+        try:
+            with _open(path + suffix) as f:
+                if _head(f) != position['head']:
+                    continue
+                f.seek(position['offset'])
+                data = f.read(max_bytes)
+        except (IOError, OSError, EOFError):
+            continue
+        if data and not data.endswith(b'\n'):
+            data += b'\n'
+        return data
+    return b''
+
+
+def read_new(path, position, max_bytes=MAX_READ):
+    """
+    Returns the complete lines appended to the log at path since position,
+    including those left in the rotated log if it was rotated since, and
+    the position to continue from.
+    """
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return b'', position
+    rotated = b''
+    with f:
+        head = _head(f)
+        size = os.fstat(f.fileno()).st_size
+        offset = position['offset']
+        if position['head'] not in (None, head) or size < offset:
+            rotated = _read_rotated(path, position, max_bytes)
+            offset = 0
+        f.seek(offset)
+        data = f.read(max_bytes)
+    end = data.rfind(b'\n') + 1
+    return rotated + data[:end], {'head': head, 'offset': offset + end}
+
+
+def parse_line(line):
+    """
+    Returns the time, level, request id and message of a log line or None
+    if it is not one, like continuation lines of tracebacks.
+    """
+    match = _LINE_RE.match(line)
+    if not match:
+        return None
+    try:
+        stamp = time.mktime(time.strptime(match.group('time'),
+                                          '%Y-%m-%d %H:%M:%S'))
+    except ValueError:
+        return None
+    return {
+        'time': stamp + float(match.group('fraction') or 0),
+        'level': match.group('level'),
+        'request': match.group('request'),
+        'message': match.group('message'),
+    }
+
+
+def _snapshot_record(snapshot, started):
+    return {'snapshot': snapshot, 'started': started, 'ended': started,
+            'bytes': 0, 'seconds': 0.0, 'errors': 0, 'status': None,
+            'disks': {}}
+
+
+def _finish(state, snapshot, status):
+    record = state['active'].pop(snapshot)
+    record['status'] = status
+    state['totals'][status] += 1
+    # Older states have no outcomes yet
+    outcome = state.setdefault('outcomes', {}).setdefault(
+        status, {'bytes': 0, 'seconds': 0.0, 'errors': 0})
+    outcome['bytes'] += record['bytes']
+    outcome['seconds'] += record['ended'] - record['started']
+    outcome['errors'] += record['errors']
+    state['recent'] = (state['recent'] + [record])[-RECENT_SNAPSHOTS:]
+    for request in [r for r, s in state['requests'].items() if s == snapshot]:
+        del state['requests'][request]
+
+
+def _trim(state):
+    active = state['active']
+    for snapshot in sorted(active, key=lambda s: active[s]['started'])[
+            :max(0, len(active) - ACTIVE_SNAPSHOTS)]:
+        del active[snapshot]
+    requests = state['requests']
+    if len(requests) > TRACKED_REQUESTS:
+        for request in [r for r, s in requests.items() if s not in active]:
+            del requests[request]
+
+
+def apply_line(state, line):
+    """
+    Updates state with a line of the log.
+    """
+    entry = parse_line(line)
+    if entry is None:
+        return
+    message = entry['message']
+    named = _SNAPSHOT_RE.search(message)
+    snapshot = named.group('snapshot') if named else None
+    if snapshot and entry['request']:
+        state['requests'][entry['request']] = snapshot
+    elif entry['request']:
+        snapshot = state['requests'].get(entry['request'])
+
+    record = None
+    if snapshot:
+        record = state['active'].get(snapshot)
+        if record is None:
+            record = state['active'][snapshot] = _snapshot_record(
+                snapshot, entry['time'])
+        record['ended'] = entry['time']
+
+    on_disk = _DISK_RE.search(message)
+    disk = None
+    if record is not None and on_disk:
+        disk = record['disks'].setdefault(
+            on_disk.group('disk'), {'bytes': 0, 'seconds': 0.0, 'errors': 0})
+
+    totals = state['totals']
+    transfer = _TRANSFER_RE.search(message)
+    if transfer:
+        unit = _UNITS[transfer.group('unit').upper()]
+        size = int(float(transfer.group('size')) * unit)
+        seconds = float(transfer.group('seconds'))
+        totals['bytes'] += size
+        totals['seconds'] += seconds
+        totals['transfers'] += 1
+        for target in (record, disk):
+            if target is not None:
+                target['bytes'] += size
+                target['seconds'] += seconds
+
+    if entry['level'] in ('ERROR', 'CRITICAL'):
+        totals['errors'] += 1
+        for target in (record, disk):
+            if target is not None:
+                target['errors'] += 1
+
+    # Only lines naming the snapshot itself finish it, not disk uploads
+    end = _END_RE.search(message)
+    if end and named and not transfer and not on_disk:
+        status = end.group('status').lower()
+        _finish(state, snapshot,
+                'failed' if status == 'failed' else 'completed')
+
+
+def update_metrics(state, path=DATAMOVER_LOG, max_bytes=MAX_READ):
+    """
+    Applies the lines appended to the log at path since the last update
+    to state.
+    """
+    data, state['position'] = read_new(path, state['position'], max_bytes)
+    for line in data.decode('utf-8', 'replace').splitlines():
+        apply_line(state, line)
+    _trim(state)
+    state['updated'] = time.time()
+    return state
+
+
+def _throughput(record):
+    return record['bytes'] / record['seconds'] if record['seconds'] else 0
+
+
+def format_textfile(state):
+    """
+    Formats state in the Prometheus text format for the node exporter
+    textfile collector.
+    """
+    totals = state['totals']
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP trilio_datamover_{} {}'.format(name, help_text))
+        lines.append('# TYPE trilio_datamover_{} {}'.format(name, kind))
+        for labels, value in samples:
+            lines.append('trilio_datamover_{}{} {}'.format(
+                name, '{' + ','.join('{}="{}"'.format(k, v)
+                                     for k, v in labels) + '}'
+                if labels else '', value))
+
+    metric('transfer_bytes_total', 'counter',
+           'Bytes uploaded by the datamover.', [((), totals['bytes'])])
+    metric('transfer_seconds_total', 'counter',
+           'Seconds spent uploading disks.', [((), totals['seconds'])])
+    metric('transfers_total', 'counter',
+           'Disk uploads by the datamover.', [((), totals['transfers'])])
+    metric('errors_total', 'counter',
+           'Errors logged by the datamover.', [((), totals['errors'])])
+    metric('snapshots_total', 'counter', 'Snapshots by outcome.',
+           [((('status', 'completed'),), totals['completed']),
+            ((('status', 'failed'),), totals['failed'])])
+    metric('snapshots_active', 'gauge', 'Snapshots in progress.',
+           [((), len(state['active']))])
+    outcomes = state.get('outcomes', {})
+    metric('snapshot_bytes_total', 'counter',
+           'Bytes uploaded by finished snapshots by outcome.',
+           [((('status', status),), outcome['bytes'])
+            for status, outcome in sorted(outcomes.items())])
+    metric('snapshot_duration_seconds_total', 'counter',
+           'Duration of finished snapshots by outcome.',
+           [((('status', status),), outcome['seconds'])
+            for status, outcome in sorted(outcomes.items())])
+    metric('snapshot_errors_total', 'counter',
+           'Errors logged for finished snapshots by outcome.',
+           [((('status', status),), outcome['errors'])
+            for status, outcome in sorted(outcomes.items())])
+    if state['recent']:
+        # Snapshot ids would make a series per snapshot, they are left to
+        # the log
+        last = state['recent'][-1]
+        label = (('status', last['status']),)
+        metric('last_snapshot_bytes', 'gauge',
+               'Bytes uploaded by the last finished snapshot.',
+               [(label, last['bytes'])])
+        metric('last_snapshot_duration_seconds', 'gauge',
+               'Duration of the last finished snapshot.',
+               [(label, last['ended'] - last['started'])])
+        metric('last_snapshot_throughput_bytes_per_second', 'gauge',
+               'Upload throughput of the last finished snapshot.',
+               [(label, _throughput(last))])
+        metric('last_snapshot_errors', 'gauge',
+               'Errors logged for the last finished snapshot.',
+               [(label, last['errors'])])
+    metric('log_parsed_timestamp_seconds', 'gauge',
+           'When the datamover log was last parsed.',
+           [((), state['updated'] or 0)])
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(text, directory, name=TEXTFILE_NAME):
+    """
+    Replaces the metrics file in directory atomically, so that the node
+    exporter never reads a partially written file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.' + name)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, os.path.join(directory, name))
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def format_metrics(state):
+    """
+    Formats the totals and the recent snapshots of state as plain text,
+    newest snapshot first.
+    """
+    totals = state['totals']
+    lines = ['{} uploaded in {} transfers, {:.1f}MB/s, {} errors, '
+             '{} completed, {} failed, {} active snapshots'.format(
+                 _format_bytes(totals['bytes']), totals['transfers'],
+                 (totals['bytes'] / totals['seconds'] / 1024 ** 2
+                  if totals['seconds'] else 0),
+                 totals['errors'], totals['completed'], totals['failed'],
+                 len(state['active']))]
+    row = '{} {} at {}: {} in {:.0f}s, {:.1f}MB/s, {} errors'
+    for record in reversed(state['recent']):
+        lines.append(row.format(
+            record['snapshot'], record['status'],
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(record['started'])),
+            _format_bytes(record['bytes']),
+            record['ended'] - record['started'],
+            _throughput(record) / 1024 ** 2, record['errors']))
+        for disk, d in sorted(record['disks'].items()):
+            lines.append('  {:<12} {} in {:.0f}s, {} errors'.format(
+                disk, _format_bytes(d['bytes']), d['seconds'], d['errors']))
+    return '\n'.join(lines)
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f}TiB'.format(size)
@@ -0,0 +1,198 @@
+"""
+Per mount NFS client statistics from /proc/self/mountstats.
+
+The kernel only keeps cumulative counters, so samples are persisted and
+the statistics of a mount are the differences to the previous sample:
+per operation the number of calls, retransmissions and average round trip
+and execute times, and the bytes read and written.
+"""
+import collections
+import os
+
+from charmhelpers.core import unitdata
+
+
+MOUNTSTATS = '/proc/self/mountstats'
+MOUNTSTATS_KEY = 'trilio.mountstats'
+# Per op counters: calls, transmissions, major timeouts, bytes sent,
+# bytes received, queue, rtt and execute milliseconds
+OP_FIELDS = ('ops', 'transmissions', 'timeouts', 'sent', 'received',
+             'queue_ms', 'rtt_ms', 'execute_ms')
+# Averages over fewer calls than this are too noisy to alert on
+MIN_OPS = 10
+
+OpStats = collections.namedtuple(
+    'OpStats', ['ops', 'retransmits', 'timeouts', 'rtt_ms', 'execute_ms'])
+MountStats = collections.namedtuple(
+    'MountStats', ['mountpoint', 'device', 'seconds', 'read_bytes',
+                   'write_bytes', 'ops'])
+
+
+def parse_mountstats(lines, prefix):
+    """
+    Returns the counters of the NFS mounts below prefix from the lines of
+    a mountstats file as {mountpoint: {'device', 'bytes', 'ops'}}. Lines
+    of other mounts are skipped without being parsed.
+    """
+    prefix = prefix.rstrip('/') + '/'
+    mounts = {}
+    current = None
+    in_ops = False
+    for line in lines:
+        if line.startswith('device '):
+            current = None
+            words = line.split()
+            # device <dev> mounted on <mountpoint> with fstype <type> ...
+            if len(words) >= 8 and words[7].startswith('nfs') and \
+                    words[4].startswith(prefix):
+                current = mounts[words[4]] = {
+                    'device': words[1], 'bytes': [0, 0], 'ops': {}}
+            in_ops = False
+            continue
+        if current is None:
+            continue
+        line = line.strip()
+        if line.startswith('bytes:'):
+            values = line.split()[1:]
+            # server side bytes, these include direct and page cache I/O
+            current['bytes'] = [int(values[4]), int(values[5])]
+        elif line == 'per-op statistics':
+            in_ops = True
+        elif in_ops and ':' in line:
+            op, _, values = line.partition(':')
+            values = [int(v) for v in values.split()[:len(OP_FIELDS)]]
+            if len(values) == len(OP_FIELDS) and values[0]:
+                current['ops'][op] = values
+    return mounts
+
+
+def read_mountstats(prefix, path=MOUNTSTATS):
+    with open(path) as f:
+        return parse_mountstats(f, prefix)
+
+
+def mount_stats(mountpoint, previous, current, seconds):
+    """
+    Returns the MountStats of a mount between two samples of its counters,
+    or None if it was remounted in between and its counters started over.
+    """
+    if current['device'] != previous['device'] or any(
+            c < p for c, p in zip(current['bytes'], previous['bytes'])):
+        return None
+    ops = {}
+    for op, values in current['ops'].items():
+        delta = [c - p for c, p in zip(
+            values, previous['ops'].get(op, [0] * len(OP_FIELDS)))]
+        if any(d < 0 for d in delta):
+            return None
+        calls = delta[0]
+        if not calls:
+            continue
+        ops[op] = OpStats(
+            ops=calls,
+            retransmits=delta[1] - calls,
+            timeouts=delta[2],
+            rtt_ms=delta[6] / float(calls),
+            execute_ms=delta[7] / float(calls))
+    return MountStats(
+        mountpoint=mountpoint,
+        device=current['device'],
+        seconds=seconds,
+        read_bytes=current['bytes'][0] - previous['bytes'][0],
+        write_bytes=current['bytes'][1] - previous['bytes'][1],
+        ops=ops)
+
+
+def compare(previous, current, seconds):
+    """
+    Returns the MountStats of the mounts present in both samples.
+    """
+    stats = []
+    for mountpoint in sorted(current):
+        if mountpoint in previous:
+            result = mount_stats(mountpoint, previous[mountpoint],
+                                 current[mountpoint], seconds)
+            if result is not None:
+                stats.append(result)
+    return stats
+
+
+def slow_ops(stats, threshold_ms, min_ops=MIN_OPS):
+    """
+    Returns (mountpoint, op, rtt_ms) of the operations whose average round
+    trip time exceeded threshold_ms, slowest first.
+    """
+    slow = [(s.mountpoint, op, o.rtt_ms)
+            for s in stats for op, o in s.ops.items()
+            if o.ops >= min_ops and o.rtt_ms > threshold_ms]
+    return sorted(slow, key=lambda s: -s[2])
+
+
+def sample(prefix, now, path=MOUNTSTATS):
+    """
+    Reads the counters of the mounts below prefix, stores them as the new
+    sample in unitdata and returns their MountStats since the previous
+    sample, an empty list on the first one.
+    """
+    kv = unitdata.kv()
+    previous = kv.get(MOUNTSTATS_KEY)
+    try:
+        mounts = read_mountstats(prefix, path)
+    except (IOError, OSError):
+        return []
+    kv.set(MOUNTSTATS_KEY, {'time': now, 'mounts': mounts})
+    if not previous or now <= previous['time']:
+        return []
+    return compare(previous['mounts'], mounts, now - previous['time'])
+
+
+def format_textfile(stats):
+    """
+    Formats stats in the Prometheus text format, the values are those of
+    the interval between the last two samples.
+    """
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append('# HELP trilio_nfs_{} {}'.format(name, help_text))
+        lines.append('# TYPE trilio_nfs_{} gauge'.format(name))
+        for labels, value in samples:
+            lines.append('trilio_nfs_{}{{{}}} {}'.format(
+                name, ','.join('{}="{}"'.format(k, v) for k, v in labels),
+                value))
+
+    def per_mount(attr):
+        return [((('mountpoint', s.mountpoint),), getattr(s, attr))
+                for s in stats]
+
+    def per_op(attr):
+        return [((('mountpoint', s.mountpoint), ('op', op)), getattr(o, attr))
+                for s in stats for op, o in sorted(s.ops.items())]
+
+    metric('interval_seconds', 'Seconds between the last two samples.',
+           per_mount('seconds'))
+    metric('read_bytes', 'Bytes read from the server in the interval.',
+           per_mount('read_bytes'))
+    metric('write_bytes', 'Bytes written to the server in the interval.',
+           per_mount('write_bytes'))
+    metric('ops', 'Calls per operation in the interval.', per_op('ops'))
+    metric('retransmits', 'Retransmissions per operation in the interval.',
+           per_op('retransmits'))
+    metric('timeouts', 'Major timeouts per operation in the interval.',
+           per_op('timeouts'))
+    metric('rtt_milliseconds', 'Average round trip time per operation.',
+           per_op('rtt_ms'))
+    metric('execute_milliseconds', 'Average execute time per operation, '
+           'including queueing.', per_op('execute_ms'))
+    return '\n'.join(lines) + '\n'
+
+
+def describe_slow(slow):
+    """
+    Describes the slowest operation for the unit status.
+    """
+    mountpoint, op, rtt_ms = slow[0]
+    text = '{} {} {:.0f}ms'.format(os.path.basename(mountpoint), op, rtt_ms)
+    if len(slow) > 1:
+        text += ' (+{} more)'.format(len(slow) - 1)
+    return text
@@ -0,0 +1,99 @@
+import collections
+import concurrent.futures
+import contextlib
+import os
+import subprocess
+import tempfile
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+
+
+class MountError(Exception):
+    pass
+
+
+def mount_nfs(share, mountpoint, options=None, timeout=None):
+    """
+    Mounts the NFS export share on mountpoint, killing the mount command
+    after timeout seconds.
+
+    :raises: MountError
+    """
+    cmd = ['mount', '-t', 'nfs']
+    if options:
+        cmd.extend(['-o', options])
+    cmd.extend([share, mountpoint])
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # The kernel may still finish the mount, make sure it goes away
+        subprocess.call(['umount', '-l', mountpoint])
+        raise MountError('Timed out mounting {} after {}s'.format(
+            share, timeout))
+    except subprocess.CalledProcessError as e:
+        raise MountError('Unable to mount {}: {}'.format(
+            share, e.output.decode('utf-8', 'replace').strip()))
+
+
+def umount_nfs(mountpoint, timeout=None):
+    """
+    Unmounts mountpoint, falling back to a lazy unmount if the unmount
+    fails or does not finish within timeout seconds.
+
+    :returns: True if mountpoint was unmounted cleanly
+    """
+    try:
+        subprocess.check_output(['umount', mountpoint],
+                                stderr=subprocess.STDOUT, timeout=timeout)
+        return True
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        log("Unmounting {} failed ({}), unmounting lazily".format(
+            mountpoint, e))
+    subprocess.call(['umount', '-l', mountpoint])
+    return False
+
+
+def umount_all(mountpoints, timeout=None):
+    """
+    Unmounts mountpoints concurrently, each bounded by timeout. Nested
+    mount points are unmounted before the ones they are mounted below.
+
+    :returns: list of mount points which had to be unmounted lazily
+    """
+    levels = collections.defaultdict(list)
+    for mountpoint in mountpoints:
+        levels[mountpoint.rstrip('/').count('/')].append(mountpoint)
+    lazy = []
+    for depth in sorted(levels, reverse=True):
+        with concurrent.futures.ThreadPoolExecutor(
+                len(levels[depth])) as executor:
+            results = executor.map(
+                lambda mp: umount_nfs(mp, timeout=timeout), levels[depth])
+            lazy.extend(mp for mp, clean in zip(levels[depth], results)
+                        if not clean)
+    return lazy
+
+
+@contextlib.contextmanager
+def temp_mount(share, parent, options=None, timeout=None):
+    """
+    Mounts share on a temporary directory below parent for the duration
+    of the block, yielding the mount point.
+
+    :raises: MountError
+    """
+    mountpoint = tempfile.mkdtemp(prefix='.mount-', dir=parent)
+    try:
+        mount_nfs(share, mountpoint, options=options, timeout=timeout)
+        try:
+            yield mountpoint
+        finally:
+            umount_nfs(mountpoint, timeout=timeout)
+    finally:
+        try:
+            os.rmdir(mountpoint)
+        except OSError as e:
+            log("Unable to remove {}: {}".format(mountpoint, e))
@@ -0,0 +1,192 @@
+import collections
+import itertools
+import os
+import shutil
+import time
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+from trilio.trilio_nfs import (
+    MountError,
+    temp_mount,
+)
+
+
+BLOCK_SIZE = 1024 * 1024
+
+# Mount options varied by the autotuning, None keeps the base options.
+# rsize/wsize is a single dimension as both are set to the same value.
+CANDIDATE_DIMENSIONS = collections.OrderedDict([
+    ('rsize/wsize', (None, '1048576')),
+    ('nconnect', (None, '4')),
+    ('vers', (None, '4.1')),
+    ('actimeo', (None, '60')),
+])
+
+
+def parse_options(options):
+    """
+    Parses comma separated mount options into an ordered dict, flags
+    without a value map to None.
+    """
+    parsed = collections.OrderedDict()
+    for option in (options or '').split(','):
+        option = option.strip()
+        if not option:
+            continue
+        key, _, value = option.partition('=')
+        parsed[key] = value or None
+    return parsed
+
+
+def format_options(parsed):
+    return ','.join(key if value is None else '{}={}'.format(key, value)
+                    for key, value in parsed.items())
+
+
+def candidate_options(base, dimensions=CANDIDATE_DIMENSIONS):
+    """
+    Returns the mount option strings to benchmark, every combination of
+    dimensions applied on top of the base options. The base options come
+    first.
+    """
+    candidates = []
+    for values in itertools.product(*dimensions.values()):
+        parsed = parse_options(base)
+        for dimension, value in zip(dimensions, values):
+            if value is None:
+                continue
+            for key in dimension.split('/'):
+                if key == 'vers':
+                    parsed.pop('nfsvers', None)
+                parsed[key] = value
+        options = format_options(parsed)
+        if options not in candidates:
+            candidates.append(options)
+    return candidates
+
+
+def _write_file(path, size_mb):
+    block = os.urandom(BLOCK_SIZE)
+    start = time.monotonic()
+    with open(path, 'wb', buffering=0) as f:
+        for _ in range(size_mb):
+            f.write(block)
+        os.fsync(f.fileno())
+    return size_mb / max(time.monotonic() - start, 1e-6)
+
+
+def _read_file(path):
+    size = 0
+    start = time.monotonic()
+    with open(path, 'rb', buffering=0) as f:
+        for chunk in iter(lambda: f.read(BLOCK_SIZE), b''):
+            size += len(chunk)
+    return size / BLOCK_SIZE / max(time.monotonic() - start, 1e-6)
+
+
+def _metadata_ms(directory, files):
+    """
+    Returns the mean time in ms to create, stat and remove a file.
+    """
+    start = time.monotonic()
+    for i in range(files):
+        path = os.path.join(directory, 'meta-{}'.format(i))
+        with open(path, 'w'):
+            pass
+        os.stat(path)
+        os.unlink(path)
+    return (time.monotonic() - start) * 1000 / max(files, 1)
+
+
+def _remove_workdir(share, options, parent, workdir, timeout):
+    try:
+        with temp_mount(share, parent, options, timeout) as mountpoint:
+            shutil.rmtree(os.path.join(mountpoint, workdir),
+                          ignore_errors=True)
+    except MountError as e:
+        log("Could not remove {} from {}: {}".format(workdir, share, e))
+
+
+def benchmark_options(share, options, parent, size_mb=64, files=100,
+                      timeout=60):
+    """
+    Mounts share with options and measures sequential write and read
+    throughput in MB/s and metadata latency. The share is remounted
+    between writing and reading so reads are not served from the page
+    cache.
+
+    :returns: dict of the measurements, ok is False if the share could
+              not be mounted with options
+    """
+    result = {'options': options, 'ok': False}
+    workdir = '.trilio-nfs-tune-{}'.format(os.getpid())
+    created = False
+    try:
+        with temp_mount(share, parent, options, timeout) as mountpoint:
+            directory = os.path.join(mountpoint, workdir)
+            os.mkdir(directory)
+            created = True
+            result['write_mbps'] = round(_write_file(
+                os.path.join(directory, 'data'), size_mb), 1)
+            result['meta_ms'] = round(_metadata_ms(directory, files), 2)
+        with temp_mount(share, parent, options, timeout) as mountpoint:
+            directory = os.path.join(mountpoint, workdir)
+            result['read_mbps'] = round(_read_file(
+                os.path.join(directory, 'data')), 1)
+        result['ok'] = True
+    except (MountError, OSError) as e:
+        log("Benchmark of {} with {} failed: {}".format(share, options, e))
+        result['error'] = str(e)
+    finally:
+        if created:
+            _remove_workdir(share, options, parent, workdir, timeout)
+    return result
+
+
+def rank_results(results):
+    """
+    Orders results best first by combined read and write throughput,
+    then by metadata latency. Failed candidates come last.
+    """
+    def key(result):
+        if not result['ok']:
+            return (1, 0, 0)
+        return (0, -(result['write_mbps'] + result['read_mbps']),
+                result['meta_ms'])
+    return sorted(results, key=key)
+
+
+def tune_share(share, base_options, parent, size_mb=64, files=100,
+               timeout=60, candidates=None):
+    """
+    Benchmarks share with every candidate option set.
+
+    :returns: ranked list of benchmark results
+    """
+    results = []
+    for options in candidates or candidate_options(base_options):
+        log("Benchmarking {} with {}".format(share, options))
+        results.append(benchmark_options(
+            share, options, parent, size_mb=size_mb, files=files,
+            timeout=timeout))
+    return rank_results(results)
+
+
+def format_results(results):
+    """
+    Formats ranked results as a plain text table.
+    """
+    lines = ['{:>4} {:>9} {:>9} {:>9}  {}'.format(
+        'rank', 'write', 'read', 'meta', 'options')]
+    for rank, result in enumerate(results, 1):
+        if result['ok']:
+            lines.append('{:>4} {:>5.1f}MB/s {:>5.1f}MB/s {:>7.2f}ms  '
+                         '{}'.format(rank, result['write_mbps'],
+                                     result['read_mbps'], result['meta_ms'],
+                                     result['options']))
+        else:
+            lines.append('{:>4} {:>9} {:>9} {:>9}  {} ({})'.format(
+                '-', '-', '-', '-', result['options'], result['error']))
+    return '\n'.join(lines)
@@ -0,0 +1,165 @@
+import glob
+import os
+import re
+import shlex
+
+
+# Unit file locations in systemd's order of precedence
+SYSTEMD_UNIT_DIRS = ('/etc/systemd/system', '/run/systemd/system',
+                     '/lib/systemd/system')
+NOVA_COMPUTE_UNIT = 'nova-compute.service'
+# Where oslo.config looks for nova.conf when no config file is given
+DEFAULT_CONFIG_DIRS = ('~/.nova', '~', '/etc/nova', '/etc')
+INIT_SCRIPT_DIR = '/etc/init.d'
+
+_CONFIG_ARG_RE = re.compile(
+    r'--(config-file|config-dir)(?:=|\s+)["\']?([^\s"\';]+)')
+_ASSIGNMENT_RE = re.compile(r'^\s*(?:export\s+)?(\w+)=(.*?)\s*$')
+_VARIABLE_RE = re.compile(r'\$\{(\w+)\}|\$(\w+)')
+
+
+def unit_paths(unit=NOVA_COMPUTE_UNIT, unit_dirs=SYSTEMD_UNIT_DIRS):
+    """
+    Returns the unit file systemd uses for unit followed by its drop-ins.
+    """
+    paths = []
+    for unit_dir in unit_dirs:
+        path = os.path.join(unit_dir, unit)
+        if os.path.exists(path):
+            paths.append(path)
+            break
+    for unit_dir in unit_dirs:
+        paths.extend(sorted(glob.glob(
+            os.path.join(unit_dir, unit + '.d', '*.conf'))))
+    return paths
+
+
+def exec_start(paths):
+    """
+    Returns the ExecStart command of the unit made up of paths, drop-ins
+    may reset it with an empty ExecStart=.
+    """
+    command = None
+    for path in paths:
+        with open(path) as f:
+            lines = f.read().replace('\\\n', ' ').splitlines()
+        for line in lines:
+            key, sep, value = line.strip().partition('=')
+            if sep and key.strip() == 'ExecStart':
+                # Prefixes like - or @ change how systemd runs the command
+                command = value.strip().lstrip('-@+!:') or None
+    return command
+
+
+def config_args(text):
+    """
+    Returns the --config-file and --config-dir arguments found in text,
+    skipping those which refer to shell variables.
+    """
+    return ['--{}={}'.format(kind, path)
+            for kind, path in _CONFIG_ARG_RE.findall(text)
+            if not path.startswith('$')]
+
+
+def expand(text, variables):
+    """
+    Expands the shell variables in text which are in variables, others are
+    left as they are.
+    """
+    return _VARIABLE_RE.sub(
+        lambda m: variables.get(m.group(1) or m.group(2), m.group(0)), text)
+
+
+def script_variables(text):
+    """
+    Returns the variables assigned in the shell script text, each value
+    expanded with the variables assigned before it. Conditions are not
+    evaluated, the last assignment wins.
+    """
+    variables = {}
+    for line in text.splitlines():
+        match = _ASSIGNMENT_RE.match(line)
+        if not match:
+            continue
+        name, value = match.groups()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        variables[name] = expand(value, variables)
+    return variables
+
+
+def script_config_args(text):
+    """
+    Returns the config arguments the init script text starts the daemon
+    with: those of DAEMON_ARGS as the script builds it, otherwise those
+    found anywhere in the script once its variables are expanded.
+    """
+    variables = script_variables(text)
+    return config_args(variables.get('DAEMON_ARGS', '')) or \
+        config_args(expand(text, variables))
+
+
+def default_config_files(project='nova', config_dirs=DEFAULT_CONFIG_DIRS):
+    """
+    Returns the config files oslo.config picks up for project without
+    any arguments, the first <project>.conf found in config_dirs.
+    """
+    for config_dir in config_dirs:
+        path = os.path.join(os.path.expanduser(config_dir),
+                            '{}.conf'.format(project))
+        if os.path.exists(path):
+            return [path]
+    return []
+
+
+def resolve(unit_dirs=SYSTEMD_UNIT_DIRS, config_dirs=DEFAULT_CONFIG_DIRS,
+            init_dir=INIT_SCRIPT_DIR):
+    """
+    Returns the config arguments nova-compute is started with, taken from
+    its systemd unit and the init script the unit runs, if any. Without
+    arguments there the default config files are used.
+
+    :returns: (args, paths) where paths are the files the result depends
+              on, args is None if nothing could be found
+    """
+    units = unit_paths(unit_dirs=unit_dirs)
+    # Units or drop-ins showing up in any of the unit dirs change the result
+    paths = [os.path.join(d, NOVA_COMPUTE_UNIT + suffix)
+             for d in unit_dirs for suffix in ('', '.d')]
+    paths.extend(p for p in units if p not in paths)
+    args = []
+    command = exec_start(units) if units else None
+    if command:
+        args = config_args(command)
+        # Ubuntu's unit hands over to the init script for the arguments
+        try:
+            script = shlex.split(command)[0]
+        except (ValueError, IndexError):
+            script = None
+        if not args and script and os.path.dirname(script) == init_dir:
+            paths.append(script)
+            try:
+                with open(script) as f:
+                    args = script_config_args(f.read())
+            except (IOError, OSError):
+                pass
+    paths.extend(os.path.join(os.path.expanduser(d), 'nova.conf')
+                 for d in config_dirs)
+    if not args:
+        args = ['--config-file={}'.format(path)
+                for path in default_config_files(config_dirs=config_dirs)]
+    return args or None, paths
+
+
+def fingerprint(paths):
+    """
+    Returns the modification times of paths, None for missing ones, to
+    tell whether a resolved result is still valid.
+    """
+    result = {}
+    for path in paths:
+        try:
+            result[path] = os.stat(path).st_mtime
+        except OSError:
+            result[path] = None
+    return result
@@ -0,0 +1,82 @@
+import concurrent.futures
+import errno
+import grp
+import os
+import pwd
+
+
+OWNERSHIP_WORKERS = 8
+
+
+def resolve_owner(owner, group):
+    """
+    Returns the (uid, gid) of the named user and group.
+    """
+    return pwd.getpwnam(owner).pw_uid, grp.getgrnam(group).gr_gid
+
+
+def _fix_dir(path, uid, gid, counts, exclude):
+    """
+    Fixes the ownership of the entries of directory path.
+
+    :returns: list of subdirectories to descend into
+    """
+    subdirs = []
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return subdirs
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_uid != uid or st.st_gid != gid:
+                os.chown(entry.path, uid, gid, follow_symlinks=False)
+                counts['changed'] += 1
+            if entry.is_dir(follow_symlinks=False) and \
+                    entry.path not in exclude:
+                subdirs.append(entry.path)
+        except OSError as e:
+            # Entries may go away while walking
+            if e.errno != errno.ENOENT:
+                raise
+        counts['scanned'] += 1
+    return subdirs
+
+
+def ensure_ownership(path, owner, group, workers=OWNERSHIP_WORKERS,
+                     exclude=()):
+    """
+    Recursively sets the ownership of path and everything below it to
+    owner and group, like chownr but only touching inodes which are owned
+    by someone else. Symlinks are not followed, the links themselves are
+    changed. Directories are scanned by a pool of workers, those in
+    exclude get their own ownership fixed but are not descended into.
+
+    :returns: dict with the number of scanned and changed inodes
+    """
+    uid, gid = resolve_owner(owner, group)
+    exclude = set(os.path.normpath(p) for p in exclude)
+    counts = {'scanned': 1, 'changed': 0}
+    st = os.lstat(path)
+    if st.st_uid != uid or st.st_gid != gid:
+        os.chown(path, uid, gid, follow_symlinks=False)
+        counts['changed'] += 1
+    if not os.path.isdir(path) or os.path.islink(path):
+        return counts
+
+    # Counts are per worker call and summed up here, so no lock is needed
+    def walk(directory):
+        local = {'scanned': 0, 'changed': 0}
+        return _fix_dir(directory, uid, gid, local, exclude), local
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = {executor.submit(walk, path)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                subdirs, local = future.result()
+                counts['scanned'] += local['scanned']
+                counts['changed'] += local['changed']
+                pending.update(executor.submit(walk, d) for d in subdirs)
+    return counts
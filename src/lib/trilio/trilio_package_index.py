@@ -0,0 +1,97 @@
+import re
+import threading
+import time
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+from trilio.trilio_http import (
+    POOL,
+)
+
+
+PACKAGE_INDEX_TTL = 300
+PACKAGE_INDEX_KEY = 'trilio.package-index'
+
+# Matches e.g. 'packages/tvault-contego-3.1.25.tar.gz', the version is the
+# first dash separated component starting with a digit.
+_PACKAGE_RE = re.compile(r'packages/([A-Za-z][\w.-]*?)-\s*(\d[\d.]*)')
+
+
+class PackageNotFound(Exception):
+    pass
+
+
+def parse_package_index(listing):
+    """
+    Parses the package listing of the TrilioVault appliance.
+
+    :returns: dict of package name to version, the first version listed
+              for a package wins
+    """
+    versions = {}
+    for name, version in _PACKAGE_RE.findall(listing):
+        versions.setdefault(name, version.rstrip('.'))
+    return versions
+
+
+class PackageIndex(object):
+    """
+    Package name to version map of a TrilioVault appliance.
+
+    The listing is fetched at most once per ttl seconds. Once stale it is
+    revalidated with a conditional request, so an unchanged listing costs
+    a 304 and no parsing. The state can be persisted between hooks with
+    the state attribute and the state argument.
+    """
+
+    def __init__(self, url, ttl=PACKAGE_INDEX_TTL, state=None):
+        self.url = url
+        self.ttl = ttl
+        self.state = None
+        if state and state.get('url') == url:
+            self.state = state
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        if self.state is None:
+            return False
+        return time.time() - self.state['fetched'] < self.ttl
+
+    def refresh(self):
+        headers = {}
+        if self.state:
+            if self.state.get('etag'):
+                headers['If-None-Match'] = self.state['etag']
+            if self.state.get('last-modified'):
+                headers['If-Modified-Since'] = self.state['last-modified']
+        resp = POOL.request('GET', self.url, headers=headers)
+
+        if resp.status == 304 and self.state:
+            log("Package index {} not modified".format(self.url))
+            self.state = dict(self.state, fetched=time.time())
+        elif resp.status == 200:
+            self.state = {
+                'url': self.url,
+                'fetched': time.time(),
+                'etag': resp.headers.get('etag'),
+                'last-modified': resp.headers.get('last-modified'),
+                'versions': parse_package_index(
+                    resp.body.decode('utf-8', 'replace')),
+            }
+        else:
+            raise IOError('Failed to fetch package index {}: HTTP {}'.format(
+                self.url, resp.status))
+
+    def versions(self):
+        with self._lock:
+            if not self._fresh():
+                self.refresh()
+            return self.state['versions']
+
+    def version(self, pkg):
+        try:
+            return self.versions()[pkg]
+        except KeyError:
+            raise PackageNotFound(
+                'Package {} not found in {}'.format(pkg, self.url))
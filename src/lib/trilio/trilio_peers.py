@@ -0,0 +1,195 @@
+import json
+import random
+import re
+
+from charmhelpers.core.hookenv import (
+    is_leader,
+    leader_get,
+    leader_set,
+    local_unit,
+    related_units,
+    relation_get,
+    relation_ids,
+    relation_set,
+)
+
+from trilio.trilio_health import (
+    DEGRADED,
+    HEALTHY,
+)
+
+
+PEER_RELATION = 'data-mover-peers'
+SEEDERS_KEY = 'artifact-seeders'
+RESTART_BATCH_KEY = 'restart-batch'
+# Restart state each unit publishes on the peer relation
+RESTART_FIELDS = ('requested', 'done', 'health')
+
+
+def _unit_number(unit):
+    match = re.search(r'/(\d+)$', unit)
+    return int(match.group(1)) if match else 0
+
+
+def choose_seeders(current, units, leader, count):
+    """
+    Returns the units which download artifacts from the appliance and serve
+    them to their peers. Current seeders which are still around are kept so
+    that their caches are not wasted, the leader is preferred and the rest
+    is filled up in unit order.
+    """
+    units = set(units) | {leader}
+    seeders = [u for u in current if u in units][:count]
+    for unit in [leader] + sorted(units, key=_unit_number):
+        if len(seeders) >= count:
+            break
+        if unit not in seeders:
+            seeders.append(unit)
+    return seeders
+
+
+def peer_units():
+    return [unit for rid in relation_ids(PEER_RELATION)
+            for unit in related_units(rid)]
+
+
+def get_seeders():
+    return json.loads(leader_get(SEEDERS_KEY) or '[]')
+
+
+def elect_seeders(count):
+    """
+    Updates the seeders in the leader settings, on the leader only.
+
+    :returns: the seeders
+    """
+    current = get_seeders()
+    if not is_leader():
+        return current
+    seeders = choose_seeders(current, peer_units(), local_unit(), count)
+    if seeders != current:
+        leader_set({SEEDERS_KEY: json.dumps(seeders)})
+    return seeders
+
+
+def is_seeder():
+    """
+    Returns True if this unit downloads from the appliance itself. The
+    leader seeds until seeders have been elected.
+    """
+    seeders = get_seeders()
+    if not seeders:
+        return is_leader()
+    return local_unit() in seeders
+
+
+def advertise_artifacts(url, artifacts):
+    """
+    Publishes the artifacts, a {name: {version: [sha256, filename]}} dict,
+    served at url to the peers. Passing None for url withdraws the offer.
+    """
+    settings = {
+        'artifact-url': url,
+        'artifacts': json.dumps(artifacts, sort_keys=True) if url else None,
+    }
+    for rid in relation_ids(PEER_RELATION):
+        relation_set(relation_id=rid, relation_settings=settings)
+
+
+def peer_offers(name, version):
+    """
+    Returns (url, sha256) tuples of the peers offering the artifact name at
+    version, in random order to spread the load over the seeders.
+    """
+    offers = []
+    for rid in relation_ids(PEER_RELATION):
+        for unit in related_units(rid):
+            data = relation_get(rid=rid, unit=unit) or {}
+            url = data.get('artifact-url')
+            try:
+                artifacts = json.loads(data.get('artifacts') or '{}')
+            except ValueError:
+                continue
+            offer = artifacts.get(name, {}).get(version)
+            if url and offer:
+                sha256, filename = offer
+                offers.append(('{}/artifacts/{}/{}/{}'.format(
+                    url, name, version, filename), sha256))
+    random.shuffle(offers)
+    return offers
+
+
+def restart_waiting(state):
+    return bool(state.get('requested')) and \
+        state.get('requested') != state.get('done')
+
+
+def restart_finished(state):
+    """
+    Returns True if a unit restarted for its last request and its health
+    probes do not fail.
+    """
+    return not restart_waiting(state) and \
+        state.get('health') in (HEALTHY, DEGRADED)
+
+
+def next_restart_batch(batch, states, size):
+    """
+    Returns the units allowed to restart, given the current batch and the
+    restart state of all units. The current batch is kept until all of its
+    units have restarted and are healthy again, then the next size units
+    waiting for a restart are let go, in unit order. Departed units are
+    dropped from the batch.
+    """
+    batch = [u for u in batch if u in states]
+    if not all(restart_finished(states[u]) for u in batch):
+        return batch
+    waiting = [u for u in states if restart_waiting(states[u])]
+    return sorted(waiting, key=_unit_number)[:size]
+
+
+def restart_states():
+    """
+    Returns the restart state of this unit and its peers as
+    {unit: {'requested', 'done', 'health'}}.
+    """
+    states = {}
+    for rid in relation_ids(PEER_RELATION):
+        for unit in related_units(rid) + [local_unit()]:
+            data = relation_get(rid=rid, unit=unit) or {}
+            states[unit] = dict(
+                (field, data.get('restart-' + field))
+                for field in RESTART_FIELDS)
+    return states
+
+
+def publish_restart(**state):
+    """
+    Publishes the restart state of this unit to the peers, any of
+    requested, the token of the restart it waits for, done, the token of
+    the last restart it did, and health, as assessed after it.
+    """
+    settings = dict(('restart-' + field, value)
+                    for field, value in state.items())
+    for rid in relation_ids(PEER_RELATION):
+        relation_set(relation_id=rid, relation_settings=settings)
+
+
+def get_restart_batch():
+    return json.loads(leader_get(RESTART_BATCH_KEY) or '[]')
+
+
+def update_restart_batch(size):
+    """
+    Moves on to the next batch of units to restart once the current one
+    is done, on the leader only.
+
+    :returns: the units allowed to restart
+    """
+    current = get_restart_batch()
+    if not is_leader():
+        return current
+    batch = next_restart_batch(current, restart_states(), size)
+    if batch != current:
+        leader_set({RESTART_BATCH_KEY: json.dumps(batch)})
+    return batch
@@ -0,0 +1,247 @@
+import asyncio
+import collections
+import subprocess
+import threading
+import time
+import urllib.parse
+
+from charmhelpers.core.host import (
+    service_running,
+)
+from trilio.trilio_http import (
+    request_path,
+)
+
+
+PROBE_TIMEOUT = 3
+
+# Ports of the TrilioVault appliance used by the datamover
+TVAULT_API_PORT = 8781
+TVAULT_PACKAGES_PORT = 8081
+TVAULT_DEB_REPO_PORT = 8085
+
+ProbeResult = collections.namedtuple(
+    'ProbeResult', ['name', 'ok', 'latency', 'detail'])
+
+
+class Probe(object):
+    """
+    Base class of probes. Subclasses implement the coroutine check which
+    returns a (ok, detail) tuple, it runs on the current event loop.
+    """
+
+    def __init__(self, name, timeout=PROBE_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+
+    async def check(self):
+        raise NotImplementedError
+
+    async def run(self):
+        start = time.monotonic()
+        try:
+            ok, detail = await asyncio.wait_for(self.check(), self.timeout)
+        except asyncio.TimeoutError:
+            ok, detail = False, 'timed out after {}s'.format(self.timeout)
+        except (OSError, ValueError) as e:
+            ok, detail = False, str(e) or e.__class__.__name__
+        return ProbeResult(self.name, ok, time.monotonic() - start, detail)
+
+
+def run_command(cmd, timeout):
+    """
+    Runs cmd and returns (returncode, stderr), or None if it did not finish
+    within timeout. A process blocked on a hung hard mounted NFS share can
+    not be killed before the server answers, so it is killed and reaped
+    by a daemon thread, neither the calling thread nor the interpreter
+    exit wait for it.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    try:
+        _, err = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        reaper = threading.Thread(target=proc.wait)
+        reaper.daemon = True
+        reaper.start()
+        return None
+    return proc.returncode, err.decode('utf-8', 'replace').strip()
+
+
+class CommandProbe(Probe):
+    """
+    Base class of probes of paths which may be on hung network
+    filesystems. The filesystem is only touched by the command, which runs
+    in a child process bounded by the probe timeout.
+    """
+
+    def __init__(self, path, name=None, timeout=PROBE_TIMEOUT):
+        super(CommandProbe, self).__init__(name or path, timeout)
+        self.path = path
+
+    def command(self):
+        raise NotImplementedError
+
+    async def run_command(self):
+        result = await asyncio.get_event_loop().run_in_executor(
+            None, run_command, self.command(), self.timeout)
+        if result is None:
+            raise asyncio.TimeoutError()
+        return result
+
+
+class PathProbe(CommandProbe):
+    """
+    Checks that a path exists.
+    """
+
+    def command(self):
+        return ['test', '-e', self.path]
+
+    async def check(self):
+        returncode, _ = await self.run_command()
+        exists = returncode == 0
+        return exists, 'present' if exists else 'not present'
+
+
+class StatfsProbe(CommandProbe):
+    """
+    Checks that the filesystem at path answers a statfs, which NFS clients
+    always send to the server, so its latency is that of the server.
+    """
+
+    def command(self):
+        return ['stat', '--file-system', '--', self.path]
+
+    async def check(self):
+        returncode, error = await self.run_command()
+        if returncode:
+            return False, error.splitlines()[-1] if error else \
+                'statfs failed'
+        return True, 'responding'
+
+
+class ServiceProbe(Probe):
+    """
+    Checks that a systemd service is running.
+    """
+
+    def __init__(self, service, name=None, timeout=PROBE_TIMEOUT):
+        super(ServiceProbe, self).__init__(name or service, timeout)
+        self.service = service
+
+    async def check(self):
+        running = await asyncio.get_event_loop().run_in_executor(
+            None, service_running, self.service)
+        return running, 'running' if running else 'not running'
+
+
+class TCPProbe(Probe):
+    """
+    Checks that a TCP connection to host and port can be established.
+    """
+
+    def __init__(self, host, port, name=None, timeout=PROBE_TIMEOUT):
+        super(TCPProbe, self).__init__(
+            name or '{}:{}'.format(host, port), timeout)
+        self.host = host
+        self.port = port
+
+    async def check(self):
+        _, writer = await asyncio.open_connection(self.host, self.port)
+        writer.close()
+        return True, 'reachable'
+
+
+class HTTPProbe(Probe):
+    """
+    Checks that a GET of url answers with one of the expected statuses.
+    Only the status line is read.
+    """
+
+    def __init__(self, url, name=None, timeout=PROBE_TIMEOUT,
+                 expect=(200,)):
+        super(HTTPProbe, self).__init__(name or url, timeout)
+        self.url = url
+        self.expect = expect
+
+    async def check(self):
+        parsed = urllib.parse.urlsplit(self.url)
+        reader, writer = await asyncio.open_connection(
+            parsed.hostname, parsed.port or 80)
+        try:
+            writer.write('GET {} HTTP/1.0\r\nHost: {}\r\n\r\n'.format(
+                request_path(self.url), parsed.netloc).encode('ascii'))
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+        parts = status_line.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            return False, 'invalid response {!r}'.format(status_line)
+        status = int(parts[1])
+        return status in self.expect, 'HTTP {}'.format(status)
+
+
+def run_probes(probes):
+    """
+    Runs probes concurrently, each bounded by its own timeout.
+
+    :returns: list of ProbeResult in the order of probes
+    """
+    if not probes:
+        return []
+
+    async def _run_all():
+        return await asyncio.gather(*[p.run() for p in probes])
+
+    # Install steps call this from worker threads, give each call its own
+    # event loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return list(loop.run_until_complete(_run_all()))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def run_probe(probe):
+    """
+    Runs a single probe.
+
+    :returns: ProbeResult
+    """
+    return run_probes([probe])[0]
+
+
+def appliance_probes(ip, timeout=PROBE_TIMEOUT):
+    """
+    Returns probes of the TrilioVault appliance services used by the
+    datamover.
+    """
+    return [
+        TCPProbe(ip, TVAULT_API_PORT, name='api', timeout=timeout),
+        HTTPProbe('http://{}:{}/packages/'.format(ip, TVAULT_PACKAGES_PORT),
+                  name='packages', timeout=timeout),
+        TCPProbe(ip, TVAULT_DEB_REPO_PORT, name='deb-repo', timeout=timeout),
+    ]
+
+
+def appliance_probe(ip, name, timeout=PROBE_TIMEOUT):
+    """
+    Returns the probe of the appliance service name, one of those of
+    appliance_probes.
+    """
+    for probe in appliance_probes(ip, timeout=timeout):
+        if probe.name == name:
+            return probe
+    raise ValueError('Unknown appliance service {}'.format(name))
+
+
+def describe_failures(results):
+    """
+    Returns a short description of the failed probes for status messages.
+    """
+    return ', '.join('{} {}'.format(r.name, r.detail)
+                     for r in results if not r.ok)
@@ -0,0 +1,86 @@
+import collections
+import os
+import re
+
+
+# sys.path of an Ubuntu python2 interpreter installed below prefix, in
+# order
+PYTHON2_PATH_TEMPLATE = (
+    '{prefix}/lib/{python}',
+    '{prefix}/lib/{python}/plat-x86_64-linux-gnu',
+    '{prefix}/lib/{python}/lib-dynload',
+    '/usr/local/lib/{python}/dist-packages',
+    '{prefix}/lib/{python}/dist-packages',
+)
+PYTHON2_PATH = tuple(p.format(prefix='/usr', python='python2.7')
+                     for p in PYTHON2_PATH_TEMPLATE)
+PYTHON2_EXTENSION_SUFFIXES = ('.x86_64-linux-gnu.so', '.so', 'module.so')
+
+# System libraries the datamover virtual env links to, packages resolve to
+# their directory and modules to their file like __path__[0] and __file__
+DATAMOVER_LIBRARIES = collections.OrderedDict([
+    ('cryptography', 'package'),
+    ('libvirtmod', 'module'),
+    ('cffi', 'package'),
+    ('_cffi_backend', 'module'),
+])
+
+
+def find_library(name, kind, search_path=PYTHON2_PATH,
+                 suffixes=PYTHON2_EXTENSION_SUFFIXES):
+    """
+    Returns the path the python2 import system would load name from,
+    without importing it, or None if it can not be found.
+    """
+    for directory in search_path:
+        base = os.path.join(directory, name)
+        if kind == 'package':
+            if os.path.isfile(os.path.join(base, '__init__.py')):
+                return base
+            continue
+        for suffix in suffixes + ('.py',):
+            if os.path.isfile(base + suffix):
+                return base + suffix
+    return None
+
+
+def interpreter_search_path(interpreter):
+    """
+    Returns the sys.path of interpreter, derived from the versioned binary
+    it resolves to and its installation prefix, e.g. /usr/bin/python2.7
+    searches /usr/lib/python2.7. Returns None if the binary is not a
+    versioned python2 one.
+    """
+    real = os.path.realpath(interpreter)
+    python = os.path.basename(real)
+    if not re.match(r'^python2\.\d+$', python):
+        return None
+    prefix = os.path.dirname(os.path.dirname(real))
+    return tuple(p.format(prefix=prefix, python=python)
+                 for p in PYTHON2_PATH_TEMPLATE)
+
+
+def resolve_libraries(libraries=DATAMOVER_LIBRARIES,
+                      search_path=PYTHON2_PATH):
+    """
+    Returns a {name: path} mapping of libraries.
+
+    :raises: LookupError if any of them can not be found
+    """
+    resolved = collections.OrderedDict()
+    for name, kind in libraries.items():
+        path = find_library(name, kind, search_path=search_path)
+        if path is None:
+            raise LookupError('Unable to find {} {}'.format(kind, name))
+        resolved[name] = path
+    return resolved
+
+
+def interpreter_id(interpreter):
+    """
+    Returns a string identifying the installed build of interpreter, it
+    changes when the interpreter is upgraded or replaced.
+    """
+    real = os.path.realpath(interpreter)
+    st = os.stat(real)
+    return '{}:{}:{}'.format(real, st.st_size, st.st_mtime)
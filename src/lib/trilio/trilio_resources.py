@@ -0,0 +1,158 @@
+import collections
+import configparser
+import glob
+import os
+import re
+
+
+IO_SCHEDULING_CLASSES = ('realtime', 'best-effort', 'idle')
+ONLINE_CPUS = '/sys/devices/system/cpu/online'
+
+_SIZE_RE = re.compile(r'^\d+[KMGT]?$|^\d+%$|^infinity$')
+_PERCENT_RE = re.compile(r'^\d+%$')
+
+
+def parse_cpu_list(spec):
+    """
+    Parses a CPU list in nova's syntax, e.g. "0-7,^3,12", into a set.
+
+    :raises: ValueError
+    """
+    cpus = set()
+    excluded = set()
+    for part in re.split(r'[,\s]+', (spec or '').strip()):
+        if not part:
+            continue
+        target = cpus
+        if part.startswith('^'):
+            target = excluded
+            part = part[1:]
+        low, _, high = part.partition('-')
+        low, high = int(low), int(high or low)
+        if low > high:
+            raise ValueError('Invalid CPU range {}'.format(part))
+        target.update(range(low, high + 1))
+    return cpus - excluded
+
+
+def format_cpu_list(cpus):
+    """
+    Formats a set of CPUs as space separated ranges, e.g. "0-2 5".
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ' '.join(str(low) if low == high else '{}-{}'.format(low, high)
+                    for low, high in ranges)
+
+
+def online_cpus(path=ONLINE_CPUS):
+    try:
+        with open(path) as f:
+            return parse_cpu_list(f.read())
+    except (IOError, OSError):
+        return set(range(os.cpu_count() or 1))
+
+
+def nova_config_files(nova_args):
+    """
+    Returns the config files nova reads given its --config-file and
+    --config-dir arguments, in the order they are applied.
+    """
+    files = []
+    for arg in nova_args:
+        kind, _, path = arg.partition('=')
+        if kind == '--config-file':
+            files.append(path)
+        elif kind == '--config-dir':
+            files.extend(sorted(glob.glob(os.path.join(path, '*.conf'))))
+    return files
+
+
+def nova_pinned_cpus(config_files):
+    """
+    Returns the host CPUs nova pins guest vCPUs to, from cpu_dedicated_set
+    or the older vcpu_pin_set.
+    """
+    nova_config = configparser.RawConfigParser(strict=False)
+    for path in config_files:
+        try:
+            nova_config.read(path)
+        except configparser.Error:
+            continue
+    for section, option in (('compute', 'cpu_dedicated_set'),
+                            ('DEFAULT', 'vcpu_pin_set')):
+        if nova_config.has_option(section, option):
+            pinned = nova_config.get(section, option)
+            if pinned.strip():
+                return parse_cpu_list(pinned)
+    return set()
+
+
+def auto_cpu_affinity(online, pinned):
+    """
+    Returns the CPUs for the datamover, those not pinned to guests, or
+    None if no CPUs are pinned or none would be left.
+    """
+    available = set(online) - set(pinned)
+    if not pinned or not available:
+        return None
+    return available
+
+
+def resource_controls(settings, online=None, pinned=None):
+    """
+    Returns the systemd resource control settings of the datamover unit
+    for the charm config settings. Empty or zero settings are left out.
+    With cpu-affinity auto the datamover is kept off the CPUs pinned to
+    guests.
+
+    :raises: ValueError
+    """
+    controls = collections.OrderedDict()
+    affinity = settings.get('cpu-affinity') or ''
+    if affinity == 'auto':
+        cpus = auto_cpu_affinity(online or set(), pinned or set())
+    else:
+        cpus = parse_cpu_list(affinity)
+    if cpus:
+        controls['CPUAffinity'] = format_cpu_list(cpus)
+
+    quota = settings.get('cpu-quota') or ''
+    if quota:
+        if not _PERCENT_RE.match(quota):
+            raise ValueError('cpu-quota must be a percentage')
+        controls['CPUQuota'] = quota
+    weight = settings.get('cpu-weight') or 0
+    if weight:
+        if not 1 <= weight <= 10000:
+            raise ValueError('cpu-weight must be between 1 and 10000')
+        controls['CPUWeight'] = weight
+
+    nice = settings.get('nice') or 0
+    if nice:
+        if not -20 <= nice <= 19:
+            raise ValueError('nice must be between -20 and 19')
+        controls['Nice'] = nice
+
+    io_class = settings.get('io-scheduling-class') or ''
+    if io_class:
+        if io_class not in IO_SCHEDULING_CLASSES:
+            raise ValueError('io-scheduling-class must be one of {}'.format(
+                ', '.join(IO_SCHEDULING_CLASSES)))
+        controls['IOSchedulingClass'] = io_class
+    io_weight = settings.get('io-weight') or 0
+    if io_weight:
+        if not 1 <= io_weight <= 10000:
+            raise ValueError('io-weight must be between 1 and 10000')
+        controls['IOWeight'] = io_weight
+
+    memory_max = settings.get('memory-max') or ''
+    if memory_max:
+        if not _SIZE_RE.match(memory_max):
+            raise ValueError('memory-max must be a size like 8G')
+        controls['MemoryMax'] = memory_max
+    return controls
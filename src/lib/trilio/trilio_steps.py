@@ -0,0 +1,232 @@
+import concurrent.futures
+import hashlib
+import json
+import threading
+
+from charmhelpers.core.hookenv import (
+    log,
+)
+from charmhelpers.core import hookenv
+from trilio.trilio_timing import (
+    span,
+)
+
+
+# Per worker thread list of statuses set by the running step, or None
+# outside of run_steps.
+_local = threading.local()
+_status_lock = threading.Lock()
+
+
+class Step(object):
+    """
+    A single unit of work run by run_steps.
+
+    func is called without arguments and must return True on success.
+    requires lists the names of the steps which have to succeed before
+    this one is started, failure is logged if the step fails.
+
+    inputs makes the step checkpointed, see run_steps. It is called without
+    arguments and returns what the outcome of the step depends on besides
+    the steps it requires, e.g. config values or the package version, as
+    a JSON serialisable value.
+    """
+
+    def __init__(self, name, func, requires=(), failure=None, inputs=None):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.failure = failure
+        self.inputs = inputs
+
+    def __repr__(self):
+        return 'Step({!r})'.format(self.name)
+
+
+def status_set(workload_state, message):
+    """
+    Wrapper of hookenv.status_set which is safe to use from steps.
+
+    Outside of run_steps this is a plain status_set. Within a step,
+    'blocked' statuses are held back so that run_steps can report the
+    step which failed first rather than the one which failed last.
+    """
+    statuses = getattr(_local, 'statuses', None)
+    if statuses is not None and workload_state == 'blocked':
+        statuses.append((workload_state, message))
+        return
+    with _status_lock:
+        hookenv.status_set(workload_state, message)
+
+
+def _check_steps(steps):
+    """
+    Ensure step names are unique, all requirements exist and the
+    dependency graph has no cycles.
+    """
+    names = {}
+    for step in steps:
+        if step.name in names:
+            raise ValueError('Duplicate step {}'.format(step.name))
+        names[step.name] = step
+    for step in steps:
+        for req in step.requires:
+            if req not in names:
+                raise ValueError(
+                    'Step {} requires unknown step {}'.format(step.name, req))
+
+    done = set()
+    pending = list(steps)
+    while pending:
+        ready = [s for s in pending if set(s.requires) <= done]
+        if not ready:
+            raise ValueError('Dependency cycle between steps {}'.format(
+                ', '.join(s.name for s in pending)))
+        for step in ready:
+            done.add(step.name)
+            pending.remove(step)
+
+
+def _dependents(steps):
+    """
+    Returns {step name: names of the steps which require it, directly or
+    through other steps}.
+    """
+    required_by = dict((step.name, set()) for step in steps)
+    for step in steps:
+        for req in step.requires:
+            required_by[req].add(step.name)
+    dependents = {}
+    for name in required_by:
+        found = set()
+        todo = list(required_by[name])
+        while todo:
+            dependent = todo.pop()
+            if dependent not in found:
+                found.add(dependent)
+                todo.extend(required_by[dependent])
+        dependents[name] = found
+    return dependents
+
+
+def fingerprint(inputs):
+    """
+    Returns a digest of the inputs of a step.
+    """
+    return hashlib.sha256(json.dumps(
+        inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _step_fingerprint(step):
+    try:
+        return fingerprint(step.inputs())
+    except Exception as e:
+        log('Unable to fingerprint step {}: {}'.format(step.name, e))
+        return None
+
+
+def _run_step(step):
+    _local.statuses = []
+    try:
+        with span(step.name):
+            return bool(step.func()), _local.statuses
+    finally:
+        _local.statuses = None
+
+
+def run_steps(steps, max_workers=4, checkpoints=None):
+    """
+    Run steps, starting each one as soon as everything it requires has
+    succeeded. Independent steps run concurrently.
+
+    checkpoints is a {step name: fingerprint} dict of the checkpointed
+    steps which completed in earlier runs. Such a step is skipped if its
+    inputs are unchanged and no checkpointed step it depends on ran again.
+    A checkpointed step which runs drops the checkpoints of all the steps
+    depending on it, so that they run again even if this run fails before
+    getting to them. The dict is updated in place, the caller persists it.
+
+    Once a step fails no further steps are started, the ones already
+    running are allowed to finish. The blocked status of the first
+    failed step is then set. If that step raised, the exception is
+    re-raised so that the hook errors as it would have done before.
+
+    Steps run in worker threads, so they must not use unitdata whose
+    sqlite connection is bound to the main thread.
+
+    :returns: True if all steps succeeded
+    """
+    _check_steps(steps)
+    dependents = _dependents(steps)
+    pending = list(steps)
+    done = set()
+    # Steps which ran and whose work may differ from the last run
+    rerun = set()
+    digests = {}
+    running = {}
+    failed = None
+
+    def skip(step):
+        if checkpoints is None or step.inputs is None:
+            return False
+        digest = digests[step.name] = _step_fingerprint(step)
+        if digest is not None and checkpoints.get(step.name) == digest \
+                and not rerun.intersection(step.requires):
+            return True
+        checkpoints.pop(step.name, None)
+        return False
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        while pending or running:
+            ready = failed is None
+            while ready:
+                ready = [s for s in pending if set(s.requires) <= done]
+                for step in ready:
+                    pending.remove(step)
+                    if skip(step):
+                        log('Skipping step {}, unchanged since it '
+                            'completed'.format(step.name))
+                        done.add(step.name)
+                        continue
+                    if step.inputs is not None or \
+                            rerun.intersection(step.requires):
+                        rerun.add(step.name)
+                        for name in dependents[step.name]:
+                            if checkpoints is not None:
+                                checkpoints.pop(name, None)
+                    log('Starting step {}'.format(step.name))
+                    running[executor.submit(_run_step, step)] = step
+                # Skipped steps make the steps requiring them ready
+                ready = [s for s in ready if s.name in done]
+            if not running:
+                break
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    ok, statuses = future.result()
+                    error = None
+                except Exception as e:
+                    ok, statuses, error = False, [], e
+                if ok:
+                    done.add(step.name)
+                    if digests.get(step.name) is not None:
+                        checkpoints[step.name] = digests[step.name]
+                    continue
+                log('Step {} failed'.format(step.name))
+                if step.failure:
+                    log(step.failure)
+                if failed is None:
+                    failed = (step, statuses, error)
+
+    if failed is None:
+        return True
+
+    step, statuses, error = failed
+    if error is not None:
+        raise error
+    for workload_state, message in statuses[-1:]:
+        hookenv.status_set(workload_state, message)
+    return False
@@ -0,0 +1,185 @@
+import contextlib
+import functools
+import subprocess
+import threading
+import time
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    log,
+)
+
+
+TIMING_HISTORY_KEY = 'trilio.timing.history'
+TIMING_HISTORY_SIZE = 20
+
+# The profiler of the running hook, if any
+_active = None
+_popen = subprocess.Popen
+
+
+class _CountingPopen(_popen):
+    """
+    subprocess.Popen which counts spawned processes against the spans
+    open in the calling thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        profiler = _active
+        if profiler is not None:
+            profiler.count_subprocess()
+        super(_CountingPopen, self).__init__(*args, **kwargs)
+
+
+class Profiler(object):
+    """
+    Records the duration and number of subprocesses of named spans of a
+    hook run. Spans may be nested and opened from several threads.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.subprocesses = 0
+        self.spans = []
+        self._start = time.monotonic()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def count_subprocess(self):
+        with self._lock:
+            self.subprocesses += 1
+        for frame in self._stack():
+            frame['subprocesses'] += 1
+
+    @contextlib.contextmanager
+    def span(self, name):
+        stack = self._stack()
+        frame = {
+            'name': '/'.join([f['name'] for f in stack[-1:]] + [name]),
+            'start': round(time.monotonic() - self._start, 3),
+            'subprocesses': 0,
+            'thread': threading.current_thread().name,
+        }
+        stack.append(frame)
+        begin = time.monotonic()
+        try:
+            yield frame
+        finally:
+            frame['duration'] = round(time.monotonic() - begin, 3)
+            stack.remove(frame)
+            with self._lock:
+                self.spans.append(frame)
+
+    def record(self, ok):
+        return {
+            'name': self.name,
+            'started': self.started,
+            'duration': round(time.monotonic() - self._start, 3),
+            'ok': ok,
+            'subprocesses': self.subprocesses,
+            'spans': sorted(self.spans, key=lambda s: s['start']),
+        }
+
+
+@contextlib.contextmanager
+def span(name):
+    """
+    Times the enclosed block as a span of the running hook. Does nothing
+    outside of a profiled hook.
+    """
+    profiler = _active
+    if profiler is None:
+        yield None
+        return
+    with profiler.span(name) as frame:
+        yield frame
+
+
+def timed(name=None):
+    """
+    Decorator recording each call of the function as a span.
+    """
+    def wrap(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name or f.__name__):
+                return f(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+@contextlib.contextmanager
+def profiled(name):
+    """
+    Records the spans of the enclosed handler run and appends them to the
+    timing history in unitdata. A run which raised is recorded as not ok.
+
+    Handlers open it as a with block around their body. charms.reactive
+    tells handlers apart by their code object, so handlers decorated with
+    a shared wrapper would be merged into one.
+    """
+    global _active
+    if _active is not None:
+        # Nested handler, record into the outer run
+        with span(name):
+            yield
+        return
+
+    profiler = Profiler(name)
+    _active = profiler
+    subprocess.Popen = _CountingPopen
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        subprocess.Popen = _popen
+        _active = None
+        record = profiler.record(ok)
+        log("{} took {}s with {} subprocesses".format(
+            name, record['duration'], record['subprocesses']))
+        save_run(record)
+
+
+def save_run(record):
+    """
+    Appends record to the timing history, keeping the newest
+    TIMING_HISTORY_SIZE runs.
+    """
+    kv = unitdata.kv()
+    history = kv.get(TIMING_HISTORY_KEY) or []
+    history.append(record)
+    kv.set(TIMING_HISTORY_KEY, history[-TIMING_HISTORY_SIZE:])
+
+
+def get_runs(count=None, name=None):
+    """
+    Returns the newest count recorded runs, newest first, optionally only
+    those of handler name.
+    """
+    history = unitdata.kv().get(TIMING_HISTORY_KEY) or []
+    runs = [r for r in reversed(history) if name is None or r['name'] == name]
+    return runs[:count] if count else runs
+
+
+def format_runs(runs):
+    """
+    Formats runs as a plain text table of per span durations.
+    """
+    lines = []
+    for run in runs:
+        lines.append('{} at {}: {:.1f}s, {} subprocesses{}'.format(
+            run['name'],
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(run['started'])),
+            run['duration'], run['subprocesses'],
+            '' if run['ok'] else ' (failed)'))
+        for s in run['spans']:
+            lines.append('  {:>8.1f}s {:>8.1f}s {:>4} {}'.format(
+                s['start'], s['duration'], s['subprocesses'], s['name']))
+    return '\n'.join(lines)
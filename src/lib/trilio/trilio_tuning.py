@@ -0,0 +1,132 @@
+import os
+import statistics
+
+from trilio.trilio_probes import (
+    TCPProbe,
+    run_probes,
+)
+
+
+NFS_PORT = 2049
+
+# Datamover defaults, used for anything which can not be measured
+DEFAULT_SETTINGS = {
+    'max_uploads_pending': 3,
+    'max_commit_pending': 3,
+    'qemu_agent_ping_timeout': 600,
+}
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def mem_total_mb(meminfo='/proc/meminfo'):
+    """
+    Returns the total memory of the host in MB, or None.
+    """
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def nic_speed_mbps(sys_class_net='/sys/class/net'):
+    """
+    Returns the link speed in Mbit/s of the fastest physical NIC which has
+    a link, or None if it can not be determined.
+    """
+    speeds = []
+    try:
+        nics = os.listdir(sys_class_net)
+    except OSError:
+        return None
+    for nic in nics:
+        nic_path = os.path.join(sys_class_net, nic)
+        # Virtual devices like bridges, bonds or veths have no device link
+        if not os.path.exists(os.path.join(nic_path, 'device')):
+            continue
+        try:
+            with open(os.path.join(nic_path, 'speed')) as f:
+                speed = int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            continue
+        if speed > 0:
+            speeds.append(speed)
+    return max(speeds) if speeds else None
+
+
+def target_latency_ms(shares, samples=3, timeout=2):
+    """
+    Returns the median TCP connect time in ms to the slowest NFS server
+    of shares, or None if none of them could be reached.
+    """
+    hosts = sorted(set(share.split(':')[0]
+                       for share in shares if ':' in share))
+    if not hosts:
+        return None
+    probes = [TCPProbe(host, NFS_PORT, name=host, timeout=timeout)
+              for host in hosts for _ in range(samples)]
+    latencies = {}
+    for result in run_probes(probes):
+        if result.ok:
+            latencies.setdefault(result.name, []).append(result.latency)
+    if not latencies:
+        return None
+    slowest = max(statistics.median(v) for v in latencies.values())
+    return round(slowest * 1000, 2)
+
+
+def measure_host(shares):
+    """
+    Collects the host facts which autotuning is based on.
+    """
+    return {
+        'cpus': cpu_count(),
+        'mem_mb': mem_total_mb(),
+        'nic_mbps': nic_speed_mbps(),
+        'latency_ms': target_latency_ms(shares),
+        'shares': sorted(shares),
+    }
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def derive_settings(facts):
+    """
+    Derives datamover concurrency settings from host facts.
+
+    Every pending upload keeps a qemu-img convert process and its buffers
+    busy, so uploads are limited to one per 8 CPUs, one per 16GB of memory
+    and one per 2.5Gbit/s of link speed, whichever is lowest. Commits are
+    latency bound, on slow backup targets fewer of them are allowed to
+    pile up, and guests get longer to answer agent pings since freezes
+    take longer to complete.
+    """
+    limits = [facts['cpus'] // 8]
+    if facts.get('mem_mb'):
+        limits.append(facts['mem_mb'] // (16 * 1024))
+    if facts.get('nic_mbps'):
+        limits.append(facts['nic_mbps'] // 2500)
+    uploads = _clamp(min(limits), 1, 16)
+
+    latency = facts.get('latency_ms')
+    slow_target = latency is not None and latency >= 20
+    commits = _clamp(uploads, 1, 3 if slow_target else 8)
+    ping_timeout = 900 if slow_target else \
+        DEFAULT_SETTINGS['qemu_agent_ping_timeout']
+
+    return {
+        'max_uploads_pending': uploads,
+        'max_commit_pending': commits,
+        'qemu_agent_ping_timeout': ping_timeout,
+    }
@@ -0,0 +1,154 @@
+"""
+Side by side versions of the datamover virtual env.
+
+Every version lives in its own directory below the versions directory and
+the virtual env path is a symlink to the active one. A new version is
+prepared while the old one keeps serving and is switched to by replacing
+the symlink with a rename, which is atomic, so the virtual env path never
+points at a partial or missing virtual env. Previous versions are kept
+for rollback, the most recently activated ones first.
+"""
+import json
+import os
+import re
+import shutil
+
+
+VIRTENV_STAMP = '.tvault-contego-version'
+LEGACY_VERSION = 'legacy'
+
+
+def read_stamp(path):
+    """
+    Returns the version and tarball checksum recorded for the virtual env
+    at path, or an empty dict if there is none.
+    """
+    try:
+        with open(os.path.join(path, VIRTENV_STAMP)) as f:
+            stamp = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return stamp if isinstance(stamp, dict) else {}
+
+
+def version_name(version, sha256=None):
+    """
+    Returns the directory name of a version, the checksum tells apart
+    builds of the same version.
+    """
+    name = re.sub(r'[^\w.+~-]', '_', version or LEGACY_VERSION)
+    if sha256:
+        name = '{}-{}'.format(name, sha256[:12])
+    return name
+
+
+def active_version(link):
+    """
+    Returns the name of the version link points to, or None if it is not
+    a symlink.
+    """
+    if not os.path.islink(link):
+        return None
+    return os.path.basename(os.readlink(link).rstrip('/'))
+
+
+def versions(versions_dir):
+    """
+    Returns the names of the versions in versions_dir, the most recently
+    activated first. Directories being staged start with a dot and are
+    left out.
+    """
+    try:
+        names = os.listdir(versions_dir)
+    except (IOError, OSError):
+        return []
+    entries = []
+    for name in names:
+        path = os.path.join(versions_dir, name)
+        if name.startswith('.') or os.path.islink(path) or \
+                not os.path.isdir(path):
+            continue
+        entries.append((os.stat(path).st_mtime, name))
+    return [name for _, name in sorted(entries, reverse=True)]
+
+
+def find_version(versions_dir, version, sha256=None):
+    """
+    Returns the name of a version in versions_dir stamped with version,
+    and sha256 if given, or None.
+    """
+    for name in versions(versions_dir):
+        stamp = read_stamp(os.path.join(versions_dir, name))
+        if stamp.get('version') == version and \
+                (sha256 is None or stamp.get('sha256') == sha256):
+            return name
+    return None
+
+
+def adopt(link, versions_dir):
+    """
+    Moves a virtual env installed directly at link into versions_dir and
+    replaces it with a symlink to it.
+
+    :returns: name of the adopted version, or None if there was nothing
+              to adopt
+    """
+    if os.path.islink(link) or not os.path.isdir(link):
+        return None
+    stamp = read_stamp(link)
+    name = version_name(stamp.get('version'), stamp.get('sha256'))
+    target = os.path.join(versions_dir, name)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.rename(link, target)
+    os.symlink(target, link)
+    return name
+
+
+def activate(link, versions_dir, name):
+    """
+    Points link at the version name by renaming a new symlink over it and
+    marks the version as the most recently activated.
+
+    :returns: True if the active version changed
+    """
+    target = os.path.join(versions_dir, name)
+    if not os.path.isdir(target):
+        raise ValueError('Unknown virtual env version {}'.format(name))
+    os.utime(target)
+    if active_version(link) == name:
+        return False
+    tmp = '{}.new'.format(link)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.rename(tmp, link)
+    return True
+
+
+def previous_version(link, versions_dir):
+    """
+    Returns the name of the most recently activated version other than the
+    active one, or None.
+    """
+    active = active_version(link)
+    for name in versions(versions_dir):
+        if name != active:
+            return name
+    return None
+
+
+def prune(link, versions_dir, keep):
+    """
+    Removes all but the keep most recently activated versions, the active
+    version is always kept.
+
+    :returns: names of the removed versions
+    """
+    active = active_version(link)
+    removed = []
+    for name in versions(versions_dir)[max(keep, 1):]:
+        if name != active:
+            shutil.rmtree(os.path.join(versions_dir, name))
+            removed.append(name)
+    return removed
@@ -4,6 +4,7 @@ from charms.reactive import (
     when,
     when_not,
     set_flag,
+    clear_flag,
     hook,
     remove_state,
     set_state,
@@ -13,89 +14,276 @@ from charmhelpers.core.hookenv import (
     config,
     log,
     application_version_set,
+    hook_name,
 )
 from charmhelpers.core.host import (
-    service_start,
-    service_stop,
     service_restart,
 )
 from trilio.trilio_data_mover_utils import (
     add_users,
+    autotune_nfs,
+    DATAMOVER_CONFIG_KEYS,
+    SERVICE_CONFIG_KEYS,
+    changed_config_keys,
+    check_health,
+    collect_nfs_stats,
+    config_inputs,
+    conf_differs,
     create_conf,
     create_service_file,
     create_virt_env,
     ensure_files,
     ensure_data_dir,
+    export_log_metrics,
     get_new_version,
+    get_nfs_shares,
+    install_checkpoints,
+    install_packages,
+    load_unit_state,
+    parse_nfs_shares,
+    peer_artifacts_ready,
+    plugin_inputs,
+    render_conf,
+    render_service_file,
+    request_restart,
+    restart_service,
+    restarts_coordinated,
+    rolling_restart,
+    save_unit_state,
+    service_file_differs,
     uninstall_plugin,
+    update_artifact_sharing,
+    update_service_file,
+    upgrade_datamover,
     validate_ip,
     validate_nfs,
+    virt_env_inputs,
+)
+from trilio.trilio_peers import (
+    elect_seeders,
+    publish_restart,
+    update_restart_batch,
+)
+from trilio.trilio_steps import (
+    Step,
+    run_steps,
+)
+from trilio.trilio_timing import (
+    profiled,
+    span,
 )
 
 
 @when_not('tvault-contego.installed')
 def install_tvault_contego_plugin():
+    with profiled('install'):
+        status_set('maintenance', 'Installing...')
 
-    status_set('maintenance', 'Installing...')
+        # Read config parameters TrilioVault IP, backup target
+        tv_ip = config('triliovault-ip')
+        # Load cached state while still in the main thread
+        load_unit_state()
 
-    # Read config parameters TrilioVault IP, backup target
-    tv_ip = config('triliovault-ip')
+        # Only seeders download from the appliance, the other units wait for
+        # a seeder to offer the artifacts over the peer relation.
+        elect_seeders(config('artifact-seeders'))
+        if not peer_artifacts_ready():
+            save_unit_state()
+            status_set('waiting', 'Waiting for a peer to seed the datamover')
+            return
 
-    # Validate triliovault_ip
-    if not validate_ip(tv_ip):
-        return
+        # Validation of the backup target, user setup and the download of the
+        # virtual env are independent of each other and run concurrently.
+        # nfs-common comes with the datamover package, the NFS validation
+        # needs it.
+        # Steps with inputs are skipped when a previous hook completed them
+        # with the same inputs, so that a retry resumes where it failed. The
+        # validations always run. inputs=dict marks steps which only depend
+        # on the steps they require.
+        steps = [
+            Step('validate_ip', lambda: validate_ip(tv_ip)),
+            Step('install_plugin', install_packages,
+                 requires=['validate_ip'],
+                 failure="Failed while installing TrilioVault Datamover",
+                 inputs=plugin_inputs),
+            Step('validate_nfs', validate_nfs,
+                 requires=['install_plugin'],
+                 failure="Failed while validating NFS mount"),
+            Step('add_users', add_users,
+                 failure="Failed while adding Users",
+                 inputs=dict),
+            Step('create_virt_env', create_virt_env,
+                 requires=['validate_ip'],
+                 failure="Failed while Creating Virtual Env",
+                 inputs=virt_env_inputs),
+            Step('ensure_files', ensure_files,
+                 requires=['create_virt_env', 'install_plugin'],
+                 failure="Failed while ensuring files",
+                 inputs=dict),
+            Step('autotune_nfs', autotune_nfs,
+                 requires=['validate_nfs'],
+                 inputs=config_inputs(['nfs-shares', 'nfs-options',
+                                       'nfs-options-autotune'])),
+            Step('create_conf', create_conf,
+                 requires=['ensure_files', 'autotune_nfs'],
+                 failure="Failed while creating conf files",
+                 inputs=config_inputs(DATAMOVER_CONFIG_KEYS)),
+            Step('ensure_data_dir', ensure_data_dir,
+                 requires=['validate_nfs'],
+                 failure="Failed while ensuring datat directories",
+                 inputs=dict),
+            Step('create_service_file', create_service_file,
+                 requires=['create_virt_env', 'create_conf'],
+                 failure="Failed while creating DataMover service file",
+                 inputs=config_inputs(SERVICE_CONFIG_KEYS)),
+        ]
+        try:
+            install_ok = run_steps(steps, checkpoints=install_checkpoints())
+        finally:
+            save_unit_state()
+        if not install_ok:
+            return
 
-    # Valildate backup target
-    if not validate_nfs():
-        log("Failed while validating NFS mount")
-        return
+        with span('start_service'):
+            subprocess.check_call(['systemctl', 'daemon-reload'])
+            # Enable and start the datamover service
+            subprocess.check_call(['systemctl', 'enable', 'tvault-contego'])
+            service_restart('tvault-contego')
 
-    # Proceed as triliovault_ip Address is valid
-    if not add_users():
-        log("Failed while adding Users")
-        return
+        # Install was successful
+        status_set('active', 'Unit is ready')
+        # Add the flag "installed" since it's done
+        application_version_set(get_new_version('tvault-contego'))
+        set_flag('tvault-contego.installed')
 
-    if not create_virt_env():
-        log("Failed while Creating Virtual Env")
-        return
 
-    if not ensure_files():
-        log("Failed while ensuring files")
-        return
+@when('config.changed')
+@when('tvault-contego.installed')
+def config_changed():
+    '''
+    Render the new config and only restart the Trilio service if the
+    rendered config differs. Only newly added NFS shares are validated.
+    Changed service resource controls rewrite the service file if its
+    rendered content differs from the one on disk. With
+    restart-batch-size set the restart waits for the leader to let this
+    unit go.
+    '''
+    with profiled('config-changed'):
+        changed = changed_config_keys()
+        service_changed = False
+        if changed_config_keys(SERVICE_CONFIG_KEYS):
+            rendered_service = render_service_file()
+            if rendered_service is None:
+                return
+            # The first hook sees every key as changed, only an actual change
+            # of the service file needs a reload and restart
+            service_changed = service_file_differs(rendered_service)
+            if service_changed and not update_service_file(rendered_service):
+                return
+        if not changed and not service_changed:
+            log("No datamover related config changes")
+            return
 
-    if not create_conf():
-        log("Failed while creating conf files")
-        return
+        if 'triliovault-ip' in changed and \
+                not validate_ip(config('triliovault-ip')):
+            return
 
-    if not ensure_data_dir():
-        log("Failed while ensuring datat directories")
-        return
+        if changed and not service_changed:
+            rendered = render_conf()
+            save_unit_state()
+            if not conf_differs(rendered):
+                log("Datamover config unchanged, not restarting "
+                    "tvault-contego")
+                status_set('active', 'Unit is ready')
+                return
 
-    if not create_service_file():
-        log("Failed while creating DataMover service file")
-        return
+        # Only shares which were not configured before need validating
+        new_shares = set(get_nfs_shares()) - set(
+            parse_nfs_shares(config().previous('nfs-shares')))
+        if restarts_coordinated():
+            request_restart(validate=new_shares)
+            set_flag('tvault-contego.restart-pending')
+        else:
+            restart_service(validate=new_shares)
 
-    subprocess.check_call(['systemctl', 'daemon-reload'])
-    # Enable and start the datamover service
-    subprocess.check_call(['systemctl', 'enable', 'tvault-contego'])
-    service_restart('tvault-contego')
 
-    # Install was successful
-    status_set('active', 'Unit is ready')
-    # Add the flag "installed" since it's done
-    application_version_set(get_new_version('tvault-contego'))
-    set_flag('tvault-contego.installed')
+@when('tvault-contego.installed')
+@when_not('tvault-contego.stopping')
+def coordinate_restarts():
+    '''
+    Let the leader move on to the next batch of units to restart once the
+    current batch is healthy again.
+    '''
+    update_restart_batch(config('restart-batch-size'))
 
 
-@when('config.changed')
 @when('tvault-contego.installed')
-def config_changed():
-    ''' Stop the Trilio service, render new config, restart the service '''
-    service_stop('tvault-contego')
-    if validate_nfs():
-        create_conf()
+@when('tvault-contego.restart-pending')
+@when_not('tvault-contego.stopping')
+def restart_when_granted():
+    '''
+    Restart the Trilio service for a config change once it is this unit's
+    turn.
+    '''
+    with profiled('rolling-restart'):
+        if rolling_restart():
+            clear_flag('tvault-contego.restart-pending')
+
+
+@when('tvault-contego.installed')
+@when_not('tvault-contego.stopping')
+def share_artifacts():
+    '''
+    Keep the seeders elected and let seeders serve their artifact cache
+    to the peers.
+    '''
+    elect_seeders(config('artifact-seeders'))
+    update_artifact_sharing()
+
+
+@when('tvault-contego.installed')
+@when_not('tvault-contego.stopping')
+def update_status():
+    '''
+    Check the unit health and update the datamover throughput metrics from
+    its log and the NFS statistics of its mounts, every update-status.
+    '''
+    if hook_name() == 'update-status':
+        health, _ = check_health()
+        if restarts_coordinated():
+            # Units which are down after a restart hold up the next batch
+            # until they recover
+            publish_restart(health=health)
+        export_log_metrics()
+        collect_nfs_stats()
+
+
+@hook('upgrade-charm')
+def upgrade_charm_handler():
+    # Also runs when a new resource is attached
+    set_state('tvault-contego.upgrade')
+
+
+@when('tvault-contego.installed')
+@when('tvault-contego.upgrade')
+@when_not('tvault-contego.stopping')
+def upgrade_tvault_contego_plugin():
+    '''
+    Upgrade the datamover to the latest version with a single restart, the
+    new virtual env is prepared while the old one keeps running.
+    '''
+    with profiled('upgrade'):
+        status_set('maintenance', 'Upgrading...')
+        load_unit_state()
+        try:
+            upgraded = upgrade_datamover()
+        finally:
+            save_unit_state()
+        if not upgraded:
+            return
         status_set('active', 'Unit is ready')
-    service_start('tvault-contego')
+        application_version_set(get_new_version('tvault-contego'))
+        remove_state('tvault-contego.upgrade')
 
 
 @hook('stop')
@@ -106,10 +294,10 @@ def stop_handler():
 
 @when('tvault-contego.stopping')
 def stop_tvault_contego_plugin():
-
-    status_set('maintenance', 'Stopping Trilio service')
-    # Call the script to stop and uninstll TrilioVault Datamover
-    if uninstall_plugin():
-        # Uninstall was successful
-        # Remove the state "stopping" since it's done
-        remove_state('tvault-contego.stopping')
+    with profiled('uninstall'):
+        status_set('maintenance', 'Stopping Trilio service')
+        # Call the script to stop and uninstll TrilioVault Datamover
+        if uninstall_plugin():
+            # Uninstall was successful
+            # Remove the state "stopping" since it's done
+            remove_state('tvault-contego.stopping')
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the ownership fix-up of create_virt_env.
+
+Builds a tree shaped like the tvault-contego virtual env and times the
+recursive chown charmhelpers.core.host.chownr does against
+trilio_ownership.ensure_ownership: on a tree which is already owned
+correctly, as after extracting it with the right owner, on a tree owned by
+someone else when run as root, and the fix-up create_virt_env does now,
+which skips the freshly extracted virtual env.
+
+    python3 tools/bench_chown.py --packages 250 --runs 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'lib'))
+
+from trilio import trilio_ownership  # noqa: E402
+
+
+def build_tree(root, packages, modules):
+    """
+    Creates a virtual env like tree, returns the number of inodes.
+    """
+    count = 0
+    bin_dir = os.path.join(root, '.virtenv', 'bin')
+    site = os.path.join(root, '.virtenv', 'lib', 'python2.7', 'site-packages')
+    os.makedirs(bin_dir)
+    os.makedirs(site)
+    for name in ('python', 'python2', 'python2.7'):
+        os.symlink('/usr/bin/python2.7', os.path.join(bin_dir, name))
+        count += 1
+    for p in range(packages):
+        for sub in ('', 'tests', 'common', 'v2'):
+            d = os.path.join(site, 'package{}'.format(p), sub)
+            os.makedirs(d, exist_ok=True)
+            count += 1
+            for m in range(modules // 4):
+                for ext in ('py', 'pyc'):
+                    with open(os.path.join(d, 'mod{}.{}'.format(m, ext)),
+                              'w') as f:
+                        f.write('# module\n')
+                    count += 1
+        info = os.path.join(site, 'package{}-1.0.dist-info'.format(p))
+        os.makedirs(info)
+        for name in ('METADATA', 'RECORD', 'WHEEL', 'top_level.txt'):
+            open(os.path.join(info, name), 'w').close()
+        count += 5
+    return count + 6
+
+
+def chownr(path, uid, gid):
+    # charmhelpers.core.host.chownr with its defaults
+    for root, dirs, files in os.walk(path, followlinks=True):
+        for name in dirs + files:
+            try:
+                os.chown(os.path.join(root, name), uid, gid)
+            except OSError:
+                pass
+
+
+def timed(func, runs):
+    best = None
+    for _ in range(runs):
+        start = time.monotonic()
+        func()
+        elapsed = time.monotonic() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--packages', type=int, default=250)
+    parser.add_argument('--modules', type=int, default=24)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--workers', type=int,
+                        default=trilio_ownership.OWNERSHIP_WORKERS)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench-chown-')
+    try:
+        inodes = build_tree(root, args.packages, args.modules)
+        uid, gid = os.getuid(), os.getgid()
+        print('{} inodes, best of {} runs'.format(inodes, args.runs))
+
+        trilio_ownership.resolve_owner = lambda owner, group: (uid, gid)
+        print('{:<40} {:>8.3f}s'.format(
+            'chownr', timed(lambda: chownr(root, uid, gid), args.runs)))
+        print('{:<40} {:>8.3f}s'.format(
+            'ensure_ownership, already owned',
+            timed(lambda: trilio_ownership.ensure_ownership(
+                root, None, None, workers=args.workers), args.runs)))
+
+        venv = os.path.join(root, '.virtenv')
+        site = os.path.join(venv, 'lib', 'python2.7', 'site-packages')
+
+        def fixup():
+            trilio_ownership.ensure_ownership(
+                root, None, None, workers=args.workers, exclude=[venv])
+            for name in ('package0', 'package1'):
+                trilio_ownership.ensure_ownership(
+                    os.path.join(site, name), None, None, exclude=[
+                        os.path.join(site, name)])
+        print('{:<40} {:>8.3f}s'.format(
+            'create_virt_env fix-up', timed(fixup, args.runs)))
+
+        if os.geteuid() == 0:
+            other = (uid + 4242, gid + 4242)
+
+            def reown_and_fix():
+                chownr(root, *other)
+                start = time.monotonic()
+                trilio_ownership.ensure_ownership(
+                    root, None, None, workers=args.workers)
+                return time.monotonic() - start
+            fix = min(reown_and_fix() for _ in range(args.runs))
+            print('{:<40} {:>8.3f}s'.format(
+                'ensure_ownership, owned by others', fix))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
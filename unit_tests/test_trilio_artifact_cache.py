@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_artifact_cache as artifact_cache
+import unit_tests.test_utils
+
+
+class TestArtifactCache(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestArtifactCache, self).setUp()
+        self.obj = artifact_cache
+        self.patches = ['log']
+        self.patch_all()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _artifact(self, content, name='venv.tar.gz'):
+        src_dir = tempfile.mkdtemp(dir=self.root)
+        src = os.path.join(src_dir, name)
+        with open(src, 'wb') as f:
+            f.write(content)
+        return src
+
+    def test_add_get(self):
+        cache = artifact_cache.ArtifactCache(os.path.join(self.root, 'c'))
+        self.assertIsNone(cache.get('venv', '1.0'))
+        path = cache.add('venv', '1.0', self._artifact(b'data'))
+        self.assertEqual(cache.get('venv', '1.0'), path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'data')
+        self.assertEqual(
+            cache.sha256('venv', '1.0'), artifact_cache.file_sha256(path))
+
+    def test_get_checksum_mismatch(self):
+        cache = artifact_cache.ArtifactCache(os.path.join(self.root, 'c'))
+        cache.add('venv', '1.0', self._artifact(b'data'))
+        self.assertIsNone(cache.get('venv', '1.0', sha256='0' * 64))
+        self.assertIsNone(cache.get('venv', '1.0'))
+
+    def test_get_truncated(self):
+        cache = artifact_cache.ArtifactCache(os.path.join(self.root, 'c'))
+        path = cache.add('venv', '1.0', self._artifact(b'data'))
+        with open(path, 'wb') as f:
+            f.write(b'da')
+        self.assertIsNone(cache.get('venv', '1.0'))
+
+    def test_get_corrupt(self):
+        root = os.path.join(self.root, 'c')
+        path = artifact_cache.ArtifactCache(root).add(
+            'venv', '1.0', self._artifact(b'data'))
+        with open(path, 'wb') as f:
+            f.write(b'dat\0')
+        # The content is checked on the first use in the next hook
+        cache = artifact_cache.ArtifactCache(root)
+        self.assertIsNone(cache.get('venv', '1.0'))
+        self.assertFalse(os.path.exists(path))
+        path = cache.add('venv', '1.0', self._artifact(b'data'))
+        self.assertEqual(cache.get('venv', '1.0'), path)
+
+    def test_add_checksum_mismatch(self):
+        cache = artifact_cache.ArtifactCache(os.path.join(self.root, 'c'))
+        with self.assertRaises(ValueError):
+            cache.add('venv', '1.0', self._artifact(b'data'), sha256='0')
+
+    def test_evict_lru(self):
+        cache = artifact_cache.ArtifactCache(
+            os.path.join(self.root, 'c'), max_bytes=10)
+        cache.add('venv', '1.0', self._artifact(b'x' * 6))
+        os.utime(os.path.join(self.root, 'c', 'venv', '1.0',
+                              artifact_cache.META_FILE), (0, 0))
+        cache.add('venv', '2.0', self._artifact(b'x' * 6))
+        self.assertIsNone(cache.get('venv', '1.0'))
+        self.assertIsNotNone(cache.get('venv', '2.0'))
@@ -0,0 +1,69 @@
+import http.client
+import os
+import shutil
+import tempfile
+import threading
+
+import lib.trilio.trilio_artifact_cache as artifact_cache
+import lib.trilio.trilio_artifact_server as artifact_server
+import unit_tests.test_utils
+
+
+class TestTrilioArtifactServer(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioArtifactServer, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        src = os.path.join(self.tmp, 'venv.tar.gz')
+        self.body = os.urandom(100000)
+        with open(src, 'wb') as f:
+            f.write(self.body)
+        self.cache = artifact_cache.ArtifactCache(
+            os.path.join(self.tmp, 'cache'))
+        self.cache.add('virtenv', '1.0', src)
+        self.server = artifact_server.ArtifactServer(
+            ('127.0.0.1', 0), self.cache.root, max_clients=1)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _get(self, path, headers=None):
+        conn = http.client.HTTPConnection(
+            '127.0.0.1', self.server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        conn.request('GET', path, headers=headers or {})
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def test_get(self):
+        resp, body = self._get('/artifacts/virtenv/1.0/venv.tar.gz')
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, self.body)
+        self.assertEqual(resp.getheader('X-Checksum-Sha256'),
+                         self.cache.sha256('virtenv', '1.0'))
+
+    def test_get_range(self):
+        resp, body = self._get('/artifacts/virtenv/1.0/venv.tar.gz',
+                               {'Range': 'bytes=1000-'})
+        self.assertEqual(resp.status, 206)
+        self.assertEqual(body, self.body[1000:])
+        self.assertEqual(resp.getheader('Content-Range'),
+                         'bytes 1000-99999/100000')
+
+    def test_not_found(self):
+        for path in ('/artifacts/virtenv/1.0/other.tar.gz',
+                     '/artifacts/virtenv/2.0/venv.tar.gz',
+                     '/artifacts/../cache/1.0/venv.tar.gz',
+                     '/artifacts/.staging/x/venv.tar.gz',
+                     '/virtenv/1.0'):
+            resp, _ = self._get(path)
+            self.assertEqual(resp.status, 404, path)
+
+    def test_busy(self):
+        self.server.slots.acquire()
+        self.addCleanup(self.server.slots.release)
+        resp, _ = self._get('/artifacts/virtenv/1.0/venv.tar.gz')
+        self.assertEqual(resp.status, 503)
@@ -0,0 +1,128 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+import lib.trilio.trilio_benchmark as benchmark
+import unit_tests.test_utils
+
+
+class TestTrilioBenchmark(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioBenchmark, self).setUp()
+        self.obj = benchmark
+        self.patches = ['unitdata']
+        self.patch_all()
+        self.kv = {}
+        self.unitdata.kv.return_value.get.side_effect = self.kv.get
+        self.unitdata.kv.return_value.set.side_effect = self.kv.__setitem__
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _blocks(self):
+        blocks = []
+        for name in sorted(os.listdir(self.tmp)):
+            path = os.path.join(self.tmp, name)
+            self.assertEqual(os.path.getsize(path), 10 * 65536)
+            with open(path, 'rb') as f:
+                blocks.extend(iter(lambda: f.read(65536), b''))
+        return blocks
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size('4096'), 4096)
+        self.assertEqual(benchmark.parse_size('64k'), 65536)
+        self.assertEqual(benchmark.parse_size('1MB'), 1048576)
+
+    def test_make_workload(self):
+        workload = benchmark.make_workload(8, '64K', 2, 2)
+        self.assertEqual(workload.block_size, 65536)
+        self.assertFalse(workload.direct)
+        with self.assertRaises(ValueError):
+            benchmark.make_workload(8, '1000')
+        with self.assertRaises(ValueError):
+            benchmark.make_workload(1, '1M', files=4)
+        with self.assertRaises(ValueError):
+            benchmark.make_workload(8, '1M', threads=0)
+
+    def test_percentile(self):
+        values = list(range(101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile(values, 100), 100)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+    def test_run_phase(self):
+        workload = benchmark.make_workload(2, '64K', 3, 2)
+        result = benchmark.run_phase(self.tmp, 'seq-write', workload)
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['bench-0', 'bench-1', 'bench-2'])
+        self.assertGreater(result['mbps'], 0)
+        self.assertGreater(result['iops'], 0)
+        self.assertLessEqual(result['lat_ms']['p50'],
+                             result['lat_ms']['p99'])
+        # Every file is written in full once, with data which does not
+        # repeat, also when the files do not spread evenly over the threads
+        self.assertEqual(len(set(self._blocks())), 3 * 10)
+        result = benchmark.run_phase(self.tmp, 'rand-read', workload)
+        self.assertEqual(result['phase'], 'rand-read')
+
+    @patch.object(benchmark, 'temp_mount')
+    def test_run_benchmark(self, _temp_mount):
+        mounts = []
+
+        @contextlib.contextmanager
+        def fake_mount(share, parent, options, timeout):
+            mounts.append(share)
+            yield self.tmp
+        _temp_mount.side_effect = fake_mount
+        workload = benchmark.make_workload(1, '64K', 2, 2)
+        record = benchmark.run_benchmark('nfs:/export', '/parent', workload,
+                                         phases=['seq-read'])
+        # Files are laid out, read on a fresh mount and cleaned up
+        self.assertEqual(len(mounts), 3)
+        self.assertEqual([r['phase'] for r in record['results']],
+                         ['seq-read'])
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    @patch.object(benchmark, 'log')
+    @patch.object(benchmark, 'run_phase')
+    @patch.object(benchmark, 'temp_mount')
+    def test_run_benchmark_cleanup_failure(self, _temp_mount, _run_phase,
+                                           _log):
+        mounts = []
+
+        @contextlib.contextmanager
+        def fake_mount(share, parent, options, timeout):
+            mounts.append(share)
+            if len(mounts) > 1:
+                raise benchmark.MountError('mount timed out')
+            yield self.tmp
+        _temp_mount.side_effect = fake_mount
+        _run_phase.side_effect = OSError('no space left on device')
+        workload = benchmark.make_workload(1, '64K', 2, 2)
+        # The error of the benchmark is raised, not that of the cleanup
+        with self.assertRaisesRegex(OSError, 'no space left'):
+            benchmark.run_benchmark('nfs:/export', '/parent', workload,
+                                    phases=['rand-write'])
+        # Random writes go to files laid out in full first
+        self.assertEqual(_run_phase.call_args[0][1], 'seq-write')
+        self.assertIn('mount timed out', _log.call_args[0][0])
+
+    def test_history(self):
+        workload = benchmark.make_workload(8, '1M', 2, 2)._asdict()
+        for started, mbps in ((1, 100.0), (2, 150.0)):
+            benchmark.save_benchmark({
+                'started': started, 'share': 'nfs:/export',
+                'options': None, 'workload': workload,
+                'results': [{'phase': 'seq-write', 'mbps': mbps,
+                             'iops': mbps, 'lat_ms': {
+                                 'p50': 1, 'p95': 2, 'p99': 3, 'max': 4}}],
+            })
+        history = benchmark.get_benchmarks()
+        self.assertEqual([r['started'] for r in history], [2, 1])
+        self.assertEqual(benchmark.get_benchmarks(share='nfs:/other'), [])
+        output = benchmark.format_benchmarks(history[:1], history)
+        self.assertIn('+50%', output)
@@ -1,5 +1,10 @@
+import importlib.util
 import mock
+import os
+import unittest
 import charms.reactive
+import charms.reactive.bus
+import charms.reactive.decorators
 import unit_tests.test_utils
 
 from unittest.mock import patch
@@ -13,6 +18,13 @@ charms.reactive.when = dec_mock
 charms.reactive.when_not = dec_mock
 
 import reactive.trilio_data_mover_handlers as handlers
+import trilio.trilio_data_mover_utils as datamover_utils
+
+# The real decorators, for registering the handlers on the bus
+REAL_DECORATORS = {
+    name: getattr(charms.reactive.decorators, name)
+    for name in ('hook', 'when', 'when_not')
+}
 
 
 class TestRegisteredHooks(test_utils.TestRegisteredHooks):
@@ -26,12 +38,126 @@ class TestRegisteredHooks(test_utils.TestRegisteredHooks):
                 'config_changed': ('config.changed',
                                    'tvault-contego.installed'),
                 'stop_tvault_contego_plugin': ('tvault-contego.stopping', ),
+                'share_artifacts': ('tvault-contego.installed', ),
+                'update_status': ('tvault-contego.installed', ),
+                'upgrade_tvault_contego_plugin': (
+                    'tvault-contego.installed', 'tvault-contego.upgrade'),
+                'coordinate_restarts': ('tvault-contego.installed', ),
+                'restart_when_granted': (
+                    'tvault-contego.installed',
+                    'tvault-contego.restart-pending'),
             },
             'when_not': {
                 'install_tvault_contego_plugin': (
                     'tvault-contego.installed', ),
+                'share_artifacts': ('tvault-contego.stopping', ),
+                'update_status': ('tvault-contego.stopping', ),
+                'upgrade_tvault_contego_plugin': (
+                    'tvault-contego.stopping', ),
+                'coordinate_restarts': ('tvault-contego.stopping', ),
+                'restart_when_granted': ('tvault-contego.stopping', ),
             },
         }
         # test that the hooks were registered via the
         # reactive.trilio_data_mover_handlers
         self.registered_hooks_test_helper(handlers, hook_set, [])
+
+
+class TestConfigChanged(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestConfigChanged, self).setUp()
+        self.obj = handlers
+        self.patches = [
+            'changed_config_keys',
+            'conf_differs',
+            'config',
+            'get_nfs_shares',
+            'log',
+            'render_conf',
+            'render_service_file',
+            'request_restart',
+            'restart_service',
+            'restarts_coordinated',
+            'save_unit_state',
+            'service_file_differs',
+            'status_set',
+            'update_service_file',
+            'validate_ip',
+        ]
+        self.patch_all()
+        self.changed_config_keys.side_effect = lambda keys=None: list(
+            keys or handlers.DATAMOVER_CONFIG_KEYS)
+        self.render_service_file.return_value = 'unit'
+        self.render_conf.return_value = 'conf'
+        self.validate_ip.return_value = True
+
+    def test_config_changed_first_hook(self):
+        # Every key counts as changed in the first hook after install
+        self.service_file_differs.return_value = False
+        self.conf_differs.return_value = False
+        handlers.config_changed()
+        self.service_file_differs.assert_called_once_with('unit')
+        self.update_service_file.assert_not_called()
+        self.restart_service.assert_not_called()
+        self.request_restart.assert_not_called()
+        self.status_set.assert_called_once_with('active', 'Unit is ready')
+
+    @patch.object(datamover_utils, '_nfs_tuning', None)
+    @patch.object(datamover_utils, 'unitdata')
+    @patch.object(datamover_utils, 'config')
+    def test_config_changed_after_autotune(self, _config, _unitdata):
+        # The autotuned options persisted by the install are rendered, so
+        # an unrelated config change does not restart the datamover
+        _config.side_effect = lambda k: {'nfs-options': 'nolock'}[k]
+        _unitdata.kv.return_value.get.side_effect = {
+            datamover_utils.NFS_TUNING_KEY: {
+                'base': 'nolock', 'options': 'nolock,vers=4.1'}}.get
+        self.changed_config_keys.side_effect = lambda keys=None: (
+            [] if keys else ['max-uploads-pending'])
+        self.render_conf.side_effect = datamover_utils.effective_nfs_options
+        self.conf_differs.side_effect = lambda rendered: (
+            rendered != 'nolock,vers=4.1')
+        handlers.config_changed()
+        self.conf_differs.assert_called_once_with('nolock,vers=4.1')
+        self.restart_service.assert_not_called()
+        self.request_restart.assert_not_called()
+
+    def test_config_changed_service_file(self):
+        self.changed_config_keys.side_effect = lambda keys=None: (
+            ['service-nice'] if keys else [])
+        self.service_file_differs.return_value = True
+        self.update_service_file.return_value = True
+        self.restarts_coordinated.return_value = False
+        self.get_nfs_shares.return_value = []
+        self.config.return_value.previous.return_value = ''
+        handlers.config_changed()
+        self.update_service_file.assert_called_once_with('unit')
+        self.restart_service.assert_called_once_with(validate=set())
+        self.request_restart.assert_not_called()
+
+
+class TestHandlerRegistration(unittest.TestCase):
+
+    def test_handlers_registered_separately(self):
+        # charms.reactive tells handlers apart by their code object, the
+        # profiled handlers must not share one
+        charm_dir = os.path.abspath('src')
+        with mock.patch.dict(charms.reactive.bus.Handler._HANDLERS,
+                             clear=True), \
+                mock.patch.object(charms.reactive.bus.hookenv, 'charm_dir',
+                                  return_value=charm_dir), \
+                mock.patch.multiple(charms.reactive, **REAL_DECORATORS):
+            spec = importlib.util.spec_from_file_location(
+                'registered_handlers', handlers.__file__)
+            spec.loader.exec_module(importlib.util.module_from_spec(spec))
+            registered = {
+                h.id().split(':')[-1]: h
+                for h in charms.reactive.bus.Handler.get_handlers()}
+        for name in ('install_tvault_contego_plugin', 'config_changed',
+                     'restart_when_granted', 'upgrade_tvault_contego_plugin',
+                     'stop_tvault_contego_plugin'):
+            self.assertIn(name, registered)
+        self.assertEqual(
+            len(registered['install_tvault_contego_plugin']._predicates), 1)
+        self.assertEqual(len(registered), 10)
@@ -5,10 +5,18 @@ from unittest.mock import (
 )
 
 import lib.trilio.trilio_data_mover_utils as datamover_utils
+from lib.trilio.trilio_artifact_cache import ArtifactCache
+from lib.trilio.trilio_artifact_server import ArtifactServer
+from lib.trilio.trilio_log_metrics import new_state
+from lib.trilio.trilio_mountstats import MountStats, OpStats
+from lib.trilio.trilio_probes import ProbeResult
 import unit_tests.test_utils
 
 import charmhelpers
+import http.server
 import os
+import tempfile
+import threading
 import time
 import shutil
 import subprocess  # noqa
@@ -19,20 +27,93 @@ class TestTrilioDataMoverUtils(unit_tests.test_utils.CharmTestCase):
     def setUp(self):
         super(TestTrilioDataMoverUtils, self).setUp()
         self.obj = datamover_utils
-        self.patches = ['config', 'status_set', 'log']
+        self.patches = ['config', 'status_set', 'log', 'resource_get']
         self.patch_all()
+        self.resource_get.return_value = False
+        self.patch_object(datamover_utils, '_resources', new={})
 
-    @patch.object(charmhelpers.fetch, 'add_source')
-    @patch.object(charmhelpers.fetch, 'apt_update')
-    @patch.object(charmhelpers.fetch, 'apt_install')
+    @patch.object(datamover_utils, 'archived_deb')
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'update_trilio_source')
+    @patch.object(datamover_utils, 'write_trilio_source')
     def test_install_plugin(
             self,
-            ch_add_source,
-            ch_apt_update,
-            ch_apt_install):
-        result = datamover_utils.install_plugin('1.2.3.4', 'version', 'venv')
+            _write_trilio_source,
+            _update_trilio_source,
+            _apt_install,
+            _get_artifact_cache,
+            _archived_deb):
+        cache = _get_artifact_cache.return_value
+        cache.get.return_value = None
+        _archived_deb.return_value = '/var/cache/apt/archives/tc.deb'
+        result = datamover_utils.install_plugin('1.2.3.4', 'version')
         self.status_set.assert_called_once_with('maintenance', 'Starting')
         self.assertTrue(result)
+        _write_trilio_source.assert_called_once_with('1.2.3.4')
+        _update_trilio_source.assert_called_once_with()
+        _apt_install.assert_called_once_with(
+            ['nfs-common', 'tvault-contego'],
+            options=['--allow-unauthenticated'], fatal=True)
+        cache.add.assert_called_once_with(
+            'tvault-contego-deb', 'version',
+            '/var/cache/apt/archives/tc.deb', move=False)
+
+    @patch.object(datamover_utils, 'archived_deb')
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'update_trilio_source')
+    @patch.object(datamover_utils, 'write_trilio_source')
+    def test_install_plugin_cached(
+            self,
+            _write_trilio_source,
+            _update_trilio_source,
+            _apt_install,
+            _get_artifact_cache,
+            _archived_deb):
+        cache = _get_artifact_cache.return_value
+        cache.get.return_value = '/cache/tvault-contego_1.0_all.deb'
+        self.assertTrue(datamover_utils.install_plugin('1.2.3.4', 'version'))
+        _update_trilio_source.assert_not_called()
+        _apt_install.assert_called_once_with(
+            ['nfs-common', '/cache/tvault-contego_1.0_all.deb'],
+            options=['--allow-unauthenticated'], fatal=True)
+        cache.add.assert_not_called()
+
+    @patch.object(datamover_utils, 'fetch_failure_status')
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'update_trilio_source')
+    @patch.object(datamover_utils, 'write_trilio_source')
+    def test_install_plugin_failure(
+            self,
+            _write_trilio_source,
+            _update_trilio_source,
+            _apt_install,
+            _get_artifact_cache,
+            _fetch_failure_status):
+        _get_artifact_cache.return_value.get.return_value = None
+        _update_trilio_source.side_effect = \
+            subprocess.CalledProcessError(100, 'apt-get')
+        _fetch_failure_status.return_value = 'Failed: deb-repo refused'
+        self.assertFalse(datamover_utils.install_plugin('1.2.3.4', 'ver'))
+        _apt_install.assert_not_called()
+        _fetch_failure_status.assert_called_once_with(
+            'Failed while installing TrilioVault Datamover', 'deb-repo')
+        self.status_set.assert_called_once_with(
+            'blocked', 'Failed: deb-repo refused')
+
+    @patch.object(datamover_utils.glob, 'glob')
+    @patch.object(datamover_utils.subprocess, 'check_output')
+    def test_archived_deb(self, _check_output, _glob):
+        _check_output.return_value = b'1:3.1.58'
+        _glob.return_value = [
+            '/var/cache/apt/archives/tvault-contego_1%3a3.1.58_all.deb']
+        self.assertEqual(
+            datamover_utils.archived_deb('tvault-contego'),
+            '/var/cache/apt/archives/tvault-contego_1%3a3.1.58_all.deb')
+        _glob.assert_called_once_with(
+            '/var/cache/apt/archives/tvault-contego_1%3a3.1.58_*.deb')
 
     @patch.object(subprocess, 'check_call')
     @patch.object(os, 'remove')
@@ -70,12 +151,893 @@ class TestTrilioDataMoverUtils(unit_tests.test_utils.CharmTestCase):
             uninstall_plugin):
         pass
 
-    @patch.object(subprocess, 'check_call')
+    @patch.object(datamover_utils.time, 'sleep')
+    def test_wait_for(self, _sleep):
+        results = iter([False, False, False, True])
+        self.assertTrue(datamover_utils.wait_for(lambda: next(results), 60))
+        self.assertEqual([c[0][0] for c in _sleep.call_args_list],
+                         [0.1, 0.2, 0.4])
+
+    @patch.object(datamover_utils.time, 'monotonic')
+    @patch.object(datamover_utils.time, 'sleep')
+    def test_wait_for_timeout(self, _sleep, _monotonic):
+        clock = [0]
+        _monotonic.side_effect = lambda: clock[0]
+        _sleep.side_effect = lambda s: clock.__setitem__(0, clock[0] + s)
+        self.assertFalse(datamover_utils.wait_for(lambda: False, 5))
+        self.assertEqual(clock[0], 5)
+
+    @patch.object(datamover_utils, 'unitdata')
+    @patch.object(datamover_utils, 'clear_install_checkpoints')
+    @patch.object(datamover_utils, 'purge_plugin')
+    @patch.object(datamover_utils, 'umount_data_dir')
+    @patch.object(datamover_utils, 'wait_object_store')
+    @patch.object(datamover_utils, 'remove_files')
+    @patch.object(datamover_utils, 'stop_service')
+    def test_uninstall_plugin_steps(self, _stop_service, _remove_files,
+                                    _wait_object_store, _umount_data_dir,
+                                    _purge_plugin,
+                                    _clear_install_checkpoints, _unitdata):
+        for step in (_stop_service, _remove_files, _wait_object_store,
+                     _umount_data_dir, _purge_plugin):
+            step.return_value = True
+        self.assertTrue(datamover_utils.uninstall_plugin())
+        _purge_plugin.assert_called_once_with()
+        _clear_install_checkpoints.assert_called_once_with()
+        _unitdata.kv.return_value.unset.assert_called_once_with(
+            'trilio.peer-wait-since')
+
+        _purge_plugin.reset_mock()
+        _umount_data_dir.side_effect = OSError('busy')
+        self.assertFalse(datamover_utils.uninstall_plugin())
+        _purge_plugin.assert_not_called()
+
+    @patch.object(datamover_utils, 'run_probe')
     def test_validate_ip_valid_ipv4(
             self,
-            subprocess_check_call):
-        subprocess_check_call.return_value = True
+            _run_probe):
+        _run_probe.return_value = ProbeResult('api', True, 0.1, 'reachable')
         self.assertTrue(datamover_utils.validate_ip('1.2.3.4'))
+        # Only the API is probed, the package services are not needed to
+        # install from resources
+        probe = _run_probe.call_args[0][0]
+        self.assertEqual((probe.name, probe.port), ('api', 8781))
+
+    @patch.object(datamover_utils, 'run_probe')
+    def test_validate_ip_unreachable(
+            self,
+            _run_probe):
+        _run_probe.return_value = ProbeResult(
+            'api', False, 3, 'timed out after 3s')
+        self.assertFalse(datamover_utils.validate_ip('1.2.3.4'))
+        self.status_set.assert_called_once_with(
+            'blocked',
+            'Unable to reach TVault appliance: api timed out after 3s')
+
+    @patch.object(datamover_utils, 'run_probe')
+    def test_fetch_failure_status(self, _run_probe):
+        self.config.side_effect = lambda k: {
+            'triliovault-ip': '1.2.3.4', 'probe-timeout': 3}[k]
+        _run_probe.return_value = ProbeResult(
+            'deb-repo', False, 3, 'timed out after 3s')
+        self.assertEqual(
+            datamover_utils.fetch_failure_status('Failed', 'deb-repo'),
+            'Failed: deb-repo timed out after 3s')
+        self.assertEqual(_run_probe.call_args[0][0].port, 8085)
+        _run_probe.return_value = ProbeResult(
+            'packages', True, 0.1, 'HTTP 200')
+        self.assertEqual(
+            datamover_utils.fetch_failure_status('Failed', 'packages'),
+            'Failed')
 
     def test_validate_ip_invalid_ipv4(self):
         self.assertFalse(datamover_utils.validate_ip('1.2.3.X'))
+
+    def test_installed_virtenv_version(self):
+        with patch('builtins.open', mock_open(
+                read_data='{"version": "3.1.25", "sha256": "abc"}')):
+            self.assertEqual(
+                datamover_utils.installed_virtenv_version(), '3.1.25')
+
+    @patch('builtins.open')
+    def test_installed_virtenv_version_missing(self, _open):
+        _open.side_effect = IOError
+        self.assertIsNone(datamover_utils.installed_virtenv_version())
+
+    def test_render_conf(self):
+        self.config.side_effect = lambda k: {
+            'nfs-shares': '10.0.0.1:/share',
+            'nfs-options': 'nolock',
+            'max-uploads-pending': '3',
+            'max-commit-pending': '3',
+            'qemu-agent-ping-timeout': '600'}[k]
+        rendered = datamover_utils.render_conf()
+        self.assertIn('vault_storage_nfs_export = 10.0.0.1:/share', rendered)
+        self.assertIn('vault_storage_nfs_options = nolock', rendered)
+        self.assertIn('max_uploads_pending = 3', rendered)
+
+    @patch.object(datamover_utils, 'get_host_facts')
+    def test_datamover_settings_auto(self, _get_host_facts):
+        self.config.side_effect = lambda k: {
+            'max-uploads-pending': 'auto',
+            'max-commit-pending': '2',
+            'qemu-agent-ping-timeout': 'bogus'}[k]
+        _get_host_facts.return_value = {
+            'cpus': 64, 'mem_mb': 256 * 1024, 'nic_mbps': 25000,
+            'latency_ms': 30}
+        self.assertEqual(datamover_utils.datamover_settings(), {
+            'max_uploads_pending': 8,
+            'max_commit_pending': 2,
+            'qemu_agent_ping_timeout': 900})
+
+    @patch.object(datamover_utils, 'unitdata')
+    @patch.object(datamover_utils, '_nfs_tuning', None)
+    def test_effective_nfs_options(self, _unitdata):
+        kv = {}
+        _unitdata.kv.return_value.get.side_effect = kv.get
+        self.config.side_effect = lambda k: {
+            'nfs-options': 'nolock,soft'}[k]
+        self.assertEqual(datamover_utils.effective_nfs_options(),
+                         'nolock,soft')
+        # The tuning persisted by an earlier hook is loaded on first use
+        kv[datamover_utils.NFS_TUNING_KEY] = {
+            'base': 'nolock,soft', 'options': 'nolock,soft,vers=4.1'}
+        self.assertEqual(datamover_utils.effective_nfs_options(),
+                         'nolock,soft,vers=4.1')
+        datamover_utils._nfs_tuning = {
+            'base': 'nolock,soft', 'options': 'nolock,soft,nconnect=4'}
+        self.assertEqual(datamover_utils.effective_nfs_options(),
+                         'nolock,soft,nconnect=4')
+        # Tuned options are dropped once nfs-options changes
+        datamover_utils._nfs_tuning['base'] = 'nolock'
+        self.assertEqual(datamover_utils.effective_nfs_options(),
+                         'nolock,soft')
+
+    @patch.object(datamover_utils, 'file_sha256')
+    def test_conf_differs(self, _file_sha256):
+        _file_sha256.return_value = (
+            '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824')
+        self.assertFalse(datamover_utils.conf_differs('hello'))
+        self.assertTrue(datamover_utils.conf_differs('hello world'))
+        _file_sha256.side_effect = IOError
+        self.assertTrue(datamover_utils.conf_differs('hello'))
+
+    @patch.object(datamover_utils, 'file_sha256')
+    def test_service_file_differs(self, _file_sha256):
+        _file_sha256.return_value = (
+            '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824')
+        self.assertFalse(datamover_utils.service_file_differs('hello'))
+        _file_sha256.assert_called_once_with(datamover_utils.DATAMOVER_SERVICE)
+        self.assertTrue(datamover_utils.service_file_differs('hello world'))
+        _file_sha256.side_effect = IOError
+        self.assertTrue(datamover_utils.service_file_differs('hello'))
+
+    def test_changed_config_keys(self):
+        self.config.return_value.changed.side_effect = \
+            lambda k: k == 'nfs-options'
+        self.assertEqual(
+            datamover_utils.changed_config_keys(), ['nfs-options'])
+
+    def test_parse_nfs_shares(self):
+        self.assertEqual(
+            datamover_utils.parse_nfs_shares(
+                '10.0.0.1:/a, 10.0.0.2:/b\n10.0.0.3:/c'),
+            ['10.0.0.1:/a', '10.0.0.2:/b', '10.0.0.3:/c'])
+        self.assertEqual(datamover_utils.parse_nfs_shares(None), [])
+
+    @patch.object(datamover_utils, 'mkdir')
+    @patch.object(datamover_utils, 'filter_missing_packages')
+    @patch.object(datamover_utils, 'validate_nfs_share')
+    def test_validate_nfs_multiple(self, _validate_nfs_share,
+                                   _filter_missing_packages, _mkdir):
+        self.config.side_effect = lambda k: {
+            'nfs-shares': '10.0.0.1:/a,10.0.0.2:/b',
+            'nfs-mount-timeout': 10}[k]
+        _filter_missing_packages.return_value = []
+        _validate_nfs_share.side_effect = lambda share, timeout: \
+            share == '10.0.0.1:/a'
+        self.assertFalse(datamover_utils.validate_nfs())
+        _validate_nfs_share.assert_any_call('10.0.0.1:/a', 10)
+        _validate_nfs_share.assert_any_call('10.0.0.2:/b', 10)
+        self.status_set.assert_called_once_with(
+            'blocked',
+            'Failed while validating NFS mount, please recheck configuration')
+
+    @patch.object(datamover_utils, 'filter_missing_packages')
+    def test_validate_nfs_empty(self, _filter_missing_packages):
+        self.config.return_value = ''
+        _filter_missing_packages.return_value = []
+        self.assertFalse(datamover_utils.validate_nfs())
+        self.status_set.assert_called_once_with(
+            'blocked',
+            'No valid nfs-shares configuration found, please recheck')
+
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'filter_missing_packages')
+    def test_validate_nfs_installs_nfs_common(self, _filter_missing_packages,
+                                              _apt_install):
+        self.config.return_value = ''
+        _filter_missing_packages.return_value = ['nfs-common']
+        datamover_utils.validate_nfs()
+        _filter_missing_packages.assert_called_once_with(['nfs-common'])
+        _apt_install.assert_called_once_with(['nfs-common'], fatal=True)
+        # Nothing is installed if it is there already
+        _apt_install.reset_mock()
+        _filter_missing_packages.return_value = []
+        datamover_utils.validate_nfs()
+        _apt_install.assert_not_called()
+
+    @patch.object(datamover_utils, 'legacy_nova_config_args')
+    @patch.object(datamover_utils, 'fingerprint')
+    @patch.object(datamover_utils, 'resolve_nova_conf')
+    @patch.object(datamover_utils, '_nova_conf', None)
+    def test_get_nova_config_args(self, _resolve_nova_conf, _fingerprint,
+                                  _legacy_nova_config_args):
+        _resolve_nova_conf.return_value = (
+            ['--config-file=/etc/nova/nova.conf'], ['/etc/nova/nova.conf'])
+        _fingerprint.return_value = {'/etc/nova/nova.conf': 1.0}
+        _legacy_nova_config_args.return_value = [
+            '--config-file=/etc/nova/nova.conf']
+        for _ in range(2):
+            self.assertEqual(datamover_utils.get_nova_config_args(),
+                             ['--config-file=/etc/nova/nova.conf'])
+        _resolve_nova_conf.assert_called_once_with()
+        # The first result is checked against nova once
+        _legacy_nova_config_args.assert_called_once_with()
+        _fingerprint.return_value = {'/etc/nova/nova.conf': 1.5}
+        datamover_utils.get_nova_config_args()
+        _legacy_nova_config_args.assert_called_once_with()
+        # Changed files are resolved again, nova is asked as a last resort
+        _fingerprint.return_value = {'/etc/nova/nova.conf': 2.0}
+        _resolve_nova_conf.return_value = (None, ['/etc/nova/nova.conf'])
+        _legacy_nova_config_args.return_value = ['--config-file=/x.conf']
+        self.assertEqual(datamover_utils.get_nova_config_args(),
+                         ['--config-file=/x.conf'])
+
+    @patch.object(datamover_utils, 'legacy_nova_config_args')
+    @patch.object(datamover_utils, 'fingerprint')
+    @patch.object(datamover_utils, 'resolve_nova_conf')
+    @patch.object(datamover_utils, '_nova_conf', None)
+    def test_get_nova_config_args_mismatch(self, _resolve_nova_conf,
+                                           _fingerprint,
+                                           _legacy_nova_config_args):
+        _resolve_nova_conf.return_value = (
+            ['--config-file=/etc/nova/nova-compute.conf',
+             '--config-dir=/etc/nova/nova.conf.d'], ['/etc/nova/nova.conf'])
+        _fingerprint.return_value = {'/etc/nova/nova.conf': 1.0}
+        _legacy_nova_config_args.return_value = [
+            '--config-file=/etc/nova/nova.conf',
+            '--config-file=/etc/nova/nova-compute.conf']
+        self.assertEqual(datamover_utils.get_nova_config_args(),
+                         ['--config-file=/etc/nova/nova.conf',
+                          '--config-file=/etc/nova/nova-compute.conf',
+                          '--config-dir=/etc/nova/nova.conf.d'])
+        self.assertFalse(datamover_utils._nova_conf['verified'])
+        # Without nova to ask the resolved arguments are used
+        datamover_utils._nova_conf = None
+        _legacy_nova_config_args.side_effect = OSError('no virtual env')
+        self.assertEqual(datamover_utils.get_nova_config_args(),
+                         ['--config-file=/etc/nova/nova-compute.conf',
+                          '--config-dir=/etc/nova/nova.conf.d'])
+
+    @patch.object(datamover_utils, 'legacy_python_libraries')
+    @patch.object(datamover_utils, 'resolve_libraries')
+    @patch.object(datamover_utils, 'interpreter_search_path')
+    @patch.object(datamover_utils, 'interpreter_id')
+    @patch.object(datamover_utils, '_python_libraries', None)
+    def test_get_python_libraries(self, _interpreter_id,
+                                  _interpreter_search_path,
+                                  _resolve_libraries,
+                                  _legacy_python_libraries):
+        _interpreter_id.return_value = '/usr/bin/python2.7:1:1'
+        _interpreter_search_path.return_value = ('/usr/lib/python2.7',)
+        _resolve_libraries.return_value = {'cffi': '/'}
+        for _ in range(2):
+            self.assertEqual(datamover_utils.get_python_libraries(),
+                             {'cffi': '/'})
+        _interpreter_search_path.assert_called_once_with('/usr/bin/python')
+        _resolve_libraries.assert_called_once_with(
+            search_path=('/usr/lib/python2.7',))
+        # A new interpreter build resolves again, importing as a last resort
+        _interpreter_id.return_value = '/usr/bin/python2.7:2:2'
+        _resolve_libraries.side_effect = LookupError('cffi')
+        _legacy_python_libraries.return_value = {'cffi': '/x'}
+        self.assertEqual(datamover_utils.get_python_libraries(),
+                         {'cffi': '/x'})
+        _legacy_python_libraries.assert_called_once_with('/usr/bin/python')
+        # So does an interpreter whose path can not be derived
+        _legacy_python_libraries.reset_mock()
+        _interpreter_id.return_value = '/opt/python:3:3'
+        _interpreter_search_path.return_value = None
+        datamover_utils.get_python_libraries('/opt/python')
+        _legacy_python_libraries.assert_called_once_with('/opt/python')
+
+    @patch.object(datamover_utils, 'nova_pinned_cpus')
+    @patch.object(datamover_utils, 'online_cpus')
+    @patch.object(datamover_utils, 'check_presence')
+    @patch.object(datamover_utils, 'get_nova_config_args')
+    def test_create_service_file(self, _get_nova_config_args,
+                                 _check_presence, _online_cpus,
+                                 _nova_pinned_cpus):
+        settings = {key: '' for key in datamover_utils.SERVICE_CONFIG_KEYS}
+        settings.update({
+            'service-cpu-affinity': 'auto',
+            'service-nice': 10,
+            'service-io-scheduling-class': 'idle',
+        })
+        self.config.side_effect = lambda k: settings[k]
+        _get_nova_config_args.return_value = [
+            '--config-file=/etc/nova/nova.conf']
+        _check_presence.return_value = False
+        _online_cpus.return_value = set(range(8))
+        _nova_pinned_cpus.return_value = {2, 3, 4, 5, 6, 7}
+        with patch('builtins.open', mock_open()) as _open:
+            self.assertTrue(datamover_utils.create_service_file())
+        written = ''.join(c[0][0] for c in _open().write.call_args_list)
+        self.assertIn('CPUAffinity = 0-1\n', written)
+        self.assertIn('Nice = 10\n', written)
+        self.assertIn('IOSchedulingClass = idle\n', written)
+        self.assertNotIn('CPUQuota', written)
+
+        settings['service-io-scheduling-class'] = 'lazy'
+        with patch('builtins.open', mock_open()) as _open:
+            self.assertFalse(datamover_utils.create_service_file())
+        _open.assert_not_called()
+        self.status_set.assert_called_once_with(
+            'blocked', 'Invalid service resource settings: '
+            'io-scheduling-class must be one of realtime, best-effort, idle')
+
+    @patch.object(datamover_utils, 'write_textfile')
+    @patch.object(datamover_utils, 'save_metrics')
+    @patch.object(datamover_utils, 'update_metrics')
+    @patch.object(datamover_utils, 'load_metrics')
+    def test_export_log_metrics(self, _load_metrics, _update_metrics,
+                                _save_metrics, _write_textfile):
+        state = _load_metrics.return_value = new_state()
+        finished = {'snapshot': 'f0e1', 'status': 'completed',
+                    'started': 10.0, 'ended': 40.0, 'bytes': 1024,
+                    'seconds': 25.0, 'errors': 0, 'disks': {}}
+
+        def update_metrics(state):
+            state['recent'].append(finished)
+            return state
+        _update_metrics.side_effect = update_metrics
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.config.return_value = tmp
+        self.assertEqual(datamover_utils.export_log_metrics(), state)
+        _update_metrics.assert_called_once_with(state)
+        _save_metrics.assert_called_once_with(state)
+        self.assertEqual(_write_textfile.call_args[0][1], tmp)
+        # Newly finished snapshots are logged with their id
+        self.log.assert_called_once_with(
+            'Snapshot f0e1 completed: 1024 bytes uploaded in 30s, 0 errors')
+        # Without a textfile collector nothing is written
+        _write_textfile.reset_mock()
+        _update_metrics.side_effect = None
+        _update_metrics.return_value = state
+        self.log.reset_mock()
+        self.config.return_value = os.path.join(tmp, 'missing')
+        datamover_utils.export_log_metrics()
+        _write_textfile.assert_not_called()
+        self.log.assert_not_called()
+
+    @patch.object(datamover_utils, 'status_get')
+    @patch.object(datamover_utils, 'write_textfile')
+    @patch.object(datamover_utils.trilio_mountstats, 'sample')
+    def test_collect_nfs_stats(self, _sample, _write_textfile,
+                               _status_get):
+        stats = MountStats(
+            mountpoint='/var/triliovault-mounts/MTAuMC4', device='nfs:/x',
+            seconds=300.0, read_bytes=0, write_bytes=8000,
+            ops={'WRITE': OpStats(50, 0, 0, 250.0, 260.0)})
+        _sample.return_value = [stats]
+        self.config.side_effect = lambda k: {
+            'metrics-textfile-dir': '',
+            'nfs-latency-threshold-ms': 100}[k]
+        _status_get.return_value = ('active', 'Unit is ready')
+        self.assertEqual(datamover_utils.collect_nfs_stats(now=1.0),
+                         [(stats.mountpoint, 'WRITE', 250.0)])
+        _sample.assert_called_once_with('/var/triliovault-mounts', 1.0)
+        _write_textfile.assert_not_called()
+        self.status_set.assert_called_once_with(
+            'active', 'NFS latency high: MTAuMC4 WRITE 250ms')
+        # Blocked units keep their status
+        self.status_set.reset_mock()
+        _status_get.return_value = ('blocked', 'Invalid NFS share')
+        datamover_utils.collect_nfs_stats(now=2.0)
+        self.status_set.assert_not_called()
+        # Back to ready once the latency recovered
+        _sample.return_value = [stats._replace(ops={})]
+        _status_get.return_value = ('active',
+                                    'NFS latency high: MTAuMC4 WRITE 250ms')
+        self.assertEqual(datamover_utils.collect_nfs_stats(now=3.0), [])
+        self.status_set.assert_called_once_with('active', 'Unit is ready')
+
+    @patch.object(datamover_utils, 'mounts')
+    def test_health_probes(self, _mounts):
+        self.config.side_effect = lambda k: {
+            'triliovault-ip': '10.0.0.2',
+            'nfs-shares': 'nfs:/a,nfs:/b'}[k]
+        _mounts.return_value = [
+            ['/', '/dev/sda1'],
+            ['/var/triliovault-mounts/bmZzOi9h', 'nfs:/a']]
+        probes, results = datamover_utils.health_probes(2)
+        self.assertEqual(
+            [p.name for p in probes],
+            ['api', 'packages', 'deb-repo', 'tvault-contego', 'nfs:/a'])
+        self.assertEqual(probes[-1].path, '/var/triliovault-mounts/bmZzOi9h')
+        self.assertEqual(results, [
+            ProbeResult('nfs:/b', False, 0.0, 'not mounted')])
+
+    @patch.object(datamover_utils, 'status_get')
+    @patch.object(datamover_utils, 'run_probes')
+    @patch.object(datamover_utils, 'health_probes')
+    @patch.object(datamover_utils, 'unitdata')
+    def test_check_health(self, _unitdata, _health_probes, _run_probes,
+                          _status_get):
+        kv = {}
+        _unitdata.kv.return_value.get.side_effect = kv.get
+        _unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        self.config.side_effect = lambda k: {
+            'health-check-interval': 300,
+            'health-degraded-latency': 0.5,
+            'probe-timeout': 3}[k]
+        _health_probes.return_value = ([], [])
+        _run_probes.return_value = [
+            ProbeResult('api', False, 3.0, 'timed out after 3s')]
+        _status_get.return_value = ('active', 'Unit is ready')
+        self.assertEqual(datamover_utils.check_health(now=1000.0),
+                         ('down', 'api timed out after 3s'))
+        self.status_set.assert_called_once_with(
+            'blocked', 'Unhealthy: api timed out after 3s')
+        # Within the interval the cached results are reported
+        _run_probes.return_value = [
+            ProbeResult('api', True, 0.01, 'reachable')]
+        _status_get.return_value = ('blocked',
+                                    'Unhealthy: api timed out after 3s')
+        self.assertEqual(datamover_utils.check_health(now=1100.0)[0],
+                         'down')
+        _run_probes.assert_called_once_with([])
+        # The failure stays in the window once the appliance is back
+        self.status_set.reset_mock()
+        self.assertEqual(datamover_utils.check_health(now=1300.0),
+                         ('degraded', 'api failed 1/2'))
+        self.status_set.assert_called_once_with(
+            'active', 'Unit is ready, degraded: api failed 1/2')
+        # Statuses not set by the health check are left alone
+        self.status_set.reset_mock()
+        _status_get.return_value = ('blocked', 'Invalid NFS share')
+        datamover_utils.check_health(now=1700.0)
+        self.status_set.assert_not_called()
+        # A forced check probes within the interval
+        _run_probes.reset_mock()
+        datamover_utils.check_health(now=1710.0, force=True)
+        _run_probes.assert_called_once_with([])
+
+    @patch.object(datamover_utils, 'service_start')
+    @patch.object(datamover_utils, 'service_stop')
+    @patch.object(datamover_utils, 'create_conf')
+    @patch.object(datamover_utils, 'validate_nfs')
+    @patch.object(datamover_utils, 'get_nfs_shares')
+    @patch.object(datamover_utils, 'conf_differs')
+    @patch.object(datamover_utils, 'save_unit_state')
+    @patch.object(datamover_utils, 'render_conf')
+    def test_restart_service(self, _render_conf, _save_unit_state,
+                             _conf_differs, _get_nfs_shares, _validate_nfs,
+                             _create_conf, _service_stop, _service_start):
+        _render_conf.return_value = 'conf'
+        _conf_differs.return_value = True
+        _get_nfs_shares.return_value = ['nfs:/a', 'nfs:/b']
+        _validate_nfs.return_value = False
+        # Shares which are no longer configured are not validated
+        self.assertFalse(datamover_utils.restart_service(
+            validate=['nfs:/b', 'nfs:/gone']))
+        _validate_nfs.assert_called_once_with(shares=['nfs:/b'])
+        _create_conf.assert_not_called()
+        _service_stop.assert_called_once_with('tvault-contego')
+        _service_start.assert_called_once_with('tvault-contego')
+        self.assertTrue(datamover_utils.restart_service())
+        _create_conf.assert_called_once_with('conf')
+        self.status_set.assert_called_once_with('active', 'Unit is ready')
+
+    @patch.object(datamover_utils, 'request_restart')
+    @patch.object(datamover_utils, 'restart_service')
+    @patch.object(datamover_utils, 'restarts_coordinated')
+    @patch.object(datamover_utils, 'conf_differs')
+    @patch.object(datamover_utils, 'render_conf')
+    def test_restart_if_conf_changed(self, _render_conf, _conf_differs,
+                                     _restarts_coordinated, _restart_service,
+                                     _request_restart):
+        _conf_differs.return_value = False
+        self.assertIsNone(datamover_utils.restart_if_conf_changed())
+        _conf_differs.return_value = True
+        _restarts_coordinated.return_value = True
+        self.assertEqual(datamover_utils.restart_if_conf_changed(),
+                         'requested')
+        _request_restart.assert_called_once_with()
+        _restart_service.assert_not_called()
+        _restarts_coordinated.return_value = False
+        self.assertEqual(datamover_utils.restart_if_conf_changed(),
+                         'restarted')
+        _restart_service.assert_called_once_with()
+
+    @patch.object(datamover_utils, 'local_unit')
+    @patch.object(datamover_utils, 'check_health')
+    @patch.object(datamover_utils, 'restart_service')
+    @patch.object(datamover_utils, 'update_restart_batch')
+    @patch.object(datamover_utils, 'publish_restart')
+    @patch.object(datamover_utils, 'peer_units')
+    @patch.object(datamover_utils, 'unitdata')
+    def test_rolling_restart(self, _unitdata, _peer_units, _publish_restart,
+                             _update_restart_batch, _restart_service,
+                             _check_health, _local_unit):
+        kv = {}
+        _unitdata.kv.return_value.get.side_effect = kv.get
+        _unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        _unitdata.kv.return_value.unset.side_effect = kv.pop
+        self.config.return_value = 2
+        _peer_units.return_value = ['dm/1']
+        _local_unit.return_value = 'dm/0'
+        self.assertTrue(datamover_utils.restarts_coordinated())
+        datamover_utils.request_restart(validate=['nfs:/b'])
+        datamover_utils.request_restart(validate=['nfs:/a'])
+        token = kv['trilio.restart-pending']['token']
+        _publish_restart.assert_called_with(requested=token)
+        self.status_set.assert_called_with(
+            'waiting', 'Waiting for its turn to restart')
+        # Not this unit's turn yet
+        _update_restart_batch.return_value = ['dm/1']
+        self.assertFalse(datamover_utils.rolling_restart())
+        _restart_service.assert_not_called()
+        _update_restart_batch.return_value = ['dm/0', 'dm/1']
+        _check_health.return_value = ('healthy', '')
+        self.assertTrue(datamover_utils.rolling_restart())
+        _restart_service.assert_called_once_with(
+            validate=['nfs:/a', 'nfs:/b'])
+        _check_health.assert_called_once_with(force=True)
+        _publish_restart.assert_called_with(done=token, health='healthy')
+        self.assertEqual(kv, {})
+        self.assertTrue(datamover_utils.rolling_restart())
+        _restart_service.assert_called_once_with(
+            validate=['nfs:/a', 'nfs:/b'])
+
+    @patch.object(datamover_utils, 'restart_service')
+    @patch.object(datamover_utils, 'update_restart_batch')
+    @patch.object(datamover_utils, 'peer_units')
+    @patch.object(datamover_utils, 'unitdata')
+    def test_rolling_restart_uncoordinated(self, _unitdata, _peer_units,
+                                           _update_restart_batch,
+                                           _restart_service):
+        # restart-batch-size was set back to 0 while waiting
+        kv = {'trilio.restart-pending': {'token': '1.0', 'validate': []}}
+        _unitdata.kv.return_value.get.side_effect = kv.get
+        _unitdata.kv.return_value.unset.side_effect = kv.pop
+        self.config.return_value = 0
+        _peer_units.return_value = ['dm/1']
+        self.assertTrue(datamover_utils.rolling_restart())
+        _restart_service.assert_called_once_with(validate=[])
+        _update_restart_batch.assert_not_called()
+        self.assertEqual(kv, {})
+
+    def test_get_resource(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        placeholder = os.path.join(tmp, 'empty.tar.gz')
+        open(placeholder, 'w').close()
+        deb = os.path.join(tmp, 'tvault-contego.deb')
+        with open(deb, 'wb') as f:
+            f.write(b'deb')
+        sha256 = datamover_utils.file_sha256(deb)
+        self.resource_get.side_effect = lambda name: {
+            'tvault-contego-virtenv': placeholder,
+            'tvault-contego-deb': deb}[name]
+        self.config.return_value = ''
+        self.assertIsNone(
+            datamover_utils.get_resource('tvault-contego-virtenv'))
+        self.assertEqual(datamover_utils.get_resource('tvault-contego-deb'),
+                         (deb, sha256))
+        self.config.return_value = sha256.upper()
+        self.assertEqual(datamover_utils.get_resource('tvault-contego-deb'),
+                         (deb, sha256))
+        self.config.assert_called_with('tvault-contego-deb-sha256')
+        self.config.return_value = '0' * 64
+        self.assertRaises(ValueError, datamover_utils.get_resource,
+                          'tvault-contego-deb')
+        self.assertEqual(datamover_utils.get_resource('tvault-contego-deb',
+                                                      verify=False),
+                         (deb, sha256))
+        # resource-get only runs once per hook
+        self.assertEqual(self.resource_get.call_count, 2)
+
+    @patch.object(datamover_utils, 'deb_version')
+    @patch.object(datamover_utils, 'get_package_index')
+    @patch.object(datamover_utils, 'get_resource')
+    def test_get_new_version(self, _get_resource, _get_package_index,
+                             _deb_version):
+        _get_resource.return_value = None
+        _get_package_index.return_value.version.return_value = '3.1.25'
+        self.assertEqual(datamover_utils.get_new_version('tvault-contego'),
+                         '3.1.25')
+        _get_resource.return_value = ('/r/tvault-contego.deb', 'abc')
+        _deb_version.return_value = '3.2.1'
+        self.assertEqual(datamover_utils.get_new_version('tvault-contego'),
+                         '3.2.1')
+        _deb_version.assert_called_once_with('/r/tvault-contego.deb')
+        _get_resource.assert_called_with('tvault-contego-deb', verify=False)
+
+    @patch.object(datamover_utils, 'fetch_from_peers')
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'update_trilio_source')
+    @patch.object(datamover_utils, 'write_trilio_source')
+    @patch.object(datamover_utils, 'get_resource')
+    def test_install_plugin_resource(
+            self,
+            _get_resource,
+            _write_trilio_source,
+            _update_trilio_source,
+            _apt_install,
+            _get_artifact_cache,
+            _fetch_from_peers):
+        _get_resource.return_value = ('/r/tvault-contego.deb', 'abc')
+        self.assertTrue(datamover_utils.install_plugin('1.2.3.4', '3.2.1'))
+        _get_artifact_cache.return_value.get.assert_not_called()
+        _fetch_from_peers.assert_not_called()
+        _write_trilio_source.assert_not_called()
+        _update_trilio_source.assert_not_called()
+        _apt_install.assert_called_once_with(
+            ['nfs-common', '/r/tvault-contego.deb'],
+            options=['--allow-unauthenticated'], fatal=True)
+        # A resource not matching its checksum is not installed
+        _apt_install.reset_mock()
+        _get_resource.side_effect = ValueError('checksum mismatch')
+        self.assertFalse(datamover_utils.install_plugin('1.2.3.4', '3.2.1'))
+        _apt_install.assert_not_called()
+
+    @patch.object(datamover_utils, 'time')
+    @patch.object(datamover_utils, 'peer_offers')
+    @patch.object(datamover_utils, 'get_new_version')
+    @patch.object(datamover_utils, 'is_seeder')
+    @patch.object(datamover_utils, 'unitdata')
+    def test_peer_artifacts_ready(self, _unitdata, _is_seeder,
+                                  _get_new_version, _peer_offers, _time):
+        kv = {}
+        _unitdata.kv.return_value.get.side_effect = kv.get
+        _unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        _unitdata.kv.return_value.unset.side_effect = \
+            lambda k: kv.pop(k, None)
+        self.config.side_effect = lambda k: {
+            'artifact-seeders': 1, 'artifact-peer-wait': 1800,
+            'tvault-contego-virtenv-sha256': ''}[k]
+        _is_seeder.return_value = False
+        _get_new_version.return_value = '3.1.25'
+        _peer_offers.return_value = []
+        _time.time.return_value = 1000.0
+        self.assertFalse(datamover_utils.peer_artifacts_ready())
+        self.assertEqual(kv, {'trilio.peer-wait-since': 1000.0})
+        # The wait is over once a peer offers the artifacts
+        _peer_offers.return_value = [('http://10.0.0.1:8089/a', 'abc')]
+        self.assertTrue(datamover_utils.peer_artifacts_ready())
+        self.assertEqual(kv, {})
+
+    @patch.object(datamover_utils, 'charm_dir')
+    @patch.object(datamover_utils, 'unit_private_ip')
+    @patch.object(datamover_utils, 'network_get_primary_address')
+    def test_render_artifact_server_unit(self, _network_get_primary_address,
+                                         _unit_private_ip, _charm_dir):
+        self.config.side_effect = lambda k: {
+            'artifact-server-port': 8089,
+            'artifact-server-max-clients': 4}[k]
+        _charm_dir.return_value = '/charm'
+        _network_get_primary_address.return_value = '10.0.0.5'
+        address = datamover_utils.artifact_server_address()
+        _network_get_primary_address.assert_called_once_with(
+            'data-mover-peers')
+        self.assertIn(
+            '--address 10.0.0.5 --port 8089 --max-clients 4',
+            datamover_utils.render_artifact_server_unit(address))
+        # Without network spaces support the private address is used
+        _network_get_primary_address.side_effect = NotImplementedError
+        _unit_private_ip.return_value = '10.0.0.6'
+        self.assertEqual(datamover_utils.artifact_server_address(),
+                         '10.0.0.6')
+
+    def _virtenv_dirs(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        link = os.path.join(tmp, '.virtenv')
+        versions_dir = os.path.join(tmp, '.virtenv-versions')
+        os.mkdir(versions_dir)
+        self.patch_object(datamover_utils, 'TVAULT_HOME', new=tmp)
+        self.patch_object(datamover_utils, 'TVAULT_VIRTENV_PATH', new=link)
+        self.patch_object(datamover_utils, 'TVAULT_VIRTENV_VERSIONS',
+                          new=versions_dir)
+        return link, versions_dir
+
+    def _write_stamp(self, path, version, sha256):
+        os.makedirs(path)
+        with open(os.path.join(path, datamover_utils.VIRTENV_STAMP),
+                  'w') as f:
+            f.write('{{"version": "{}", "sha256": "{}"}}'.format(
+                version, sha256))
+
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    @patch.object(datamover_utils, 'get_new_version')
+    @patch.object(datamover_utils, 'mkdir')
+    def test_prepare_virt_env_adopts_installed(
+            self, _mkdir, _get_new_version, _get_artifact_cache):
+        link, versions_dir = self._virtenv_dirs()
+        # A virtual env installed in place by an older charm
+        self._write_stamp(link, '3.1.25', 'abcdef0123456789')
+        _get_new_version.return_value = '3.1.25'
+        self.assertEqual(datamover_utils.prepare_virt_env(),
+                         '3.1.25-abcdef012345')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(datamover_utils.installed_virtenv_version(),
+                         '3.1.25')
+        _get_artifact_cache.assert_not_called()
+
+    @patch.object(datamover_utils, 'service_restart')
+    @patch.object(datamover_utils, 'installed_package_version')
+    @patch.object(datamover_utils, 'activate_virt_env')
+    @patch.object(datamover_utils, 'install_packages')
+    @patch.object(datamover_utils, 'prepare_virt_env')
+    def test_upgrade_datamover(self, _prepare_virt_env, _install_packages,
+                               _activate_virt_env,
+                               _installed_package_version,
+                               _service_restart):
+        _prepare_virt_env.return_value = '3.2.0-abc'
+        _install_packages.return_value = True
+        _activate_virt_env.return_value = True
+        _installed_package_version.side_effect = ['3.1.25', '3.2.0']
+        self.assertTrue(datamover_utils.upgrade_datamover())
+        _activate_virt_env.assert_called_once_with('3.2.0-abc')
+        _service_restart.assert_called_once_with('tvault-contego')
+        # Nothing changed, nothing is restarted
+        _service_restart.reset_mock()
+        _activate_virt_env.return_value = False
+        _installed_package_version.side_effect = ['3.2.0', '3.2.0']
+        self.assertTrue(datamover_utils.upgrade_datamover())
+        _service_restart.assert_not_called()
+        # The old version stays active if the package install fails
+        _activate_virt_env.reset_mock()
+        _install_packages.return_value = False
+        _installed_package_version.side_effect = ['3.2.0']
+        self.assertFalse(datamover_utils.upgrade_datamover())
+        _activate_virt_env.assert_not_called()
+
+    @patch.object(datamover_utils, 'service_restart')
+    @patch.object(datamover_utils, 'installed_package_version')
+    @patch.object(datamover_utils, 'apt_install')
+    @patch.object(datamover_utils, 'get_artifact_cache')
+    def test_rollback_datamover(self, _get_artifact_cache, _apt_install,
+                                _installed_package_version,
+                                _service_restart):
+        link, versions_dir = self._virtenv_dirs()
+        with self.assertRaises(ValueError):
+            datamover_utils.rollback_datamover()
+        self._write_stamp(os.path.join(versions_dir, '3.1.25-aaa'),
+                          '3.1.25', 'aaa')
+        os.utime(os.path.join(versions_dir, '3.1.25-aaa'), (1000, 1000))
+        self._write_stamp(os.path.join(versions_dir, '3.2.0-bbb'),
+                          '3.2.0', 'bbb')
+        os.symlink(os.path.join(versions_dir, '3.2.0-bbb'), link)
+        _get_artifact_cache.return_value.get.return_value = '/c/3.1.25.deb'
+        _installed_package_version.return_value = '3.2.0'
+        self.assertEqual(datamover_utils.rollback_datamover(), '3.1.25-aaa')
+        self.assertEqual(datamover_utils.installed_virtenv_version(),
+                         '3.1.25')
+        _get_artifact_cache.return_value.get.assert_called_once_with(
+            'tvault-contego-deb', '3.1.25')
+        _apt_install.assert_called_once_with(
+            ['/c/3.1.25.deb'],
+            options=['--allow-unauthenticated', '--allow-downgrades'],
+            fatal=True)
+        _service_restart.assert_called_once_with('tvault-contego')
+        # Rolling back again returns to the newer version
+        self.assertEqual(datamover_utils.rollback_datamover(), '3.2.0-bbb')
+
+    @patch.object(datamover_utils, 'get_new_version')
+    @patch.object(datamover_utils, 'get_resource')
+    def test_install_inputs(self, _get_resource, _get_new_version):
+        self.config.side_effect = lambda k: {
+            'triliovault-ip': '10.0.0.2', 'nfs-shares': 'nfs:/a'}[k]
+        _get_new_version.return_value = '3.1.25'
+        _get_resource.return_value = None
+        self.assertEqual(datamover_utils.plugin_inputs(), {
+            'triliovault-ip': '10.0.0.2', 'version': '3.1.25',
+            'resource': None})
+        _get_resource.return_value = ('/r/virtenv.tar.gz', 'abc')
+        self.assertEqual(datamover_utils.virt_env_inputs(),
+                         {'version': '3.1.25', 'resource': 'abc'})
+        self.assertEqual(datamover_utils.config_inputs(['nfs-shares'])(),
+                         {'nfs-shares': 'nfs:/a'})
+
+    @patch.object(datamover_utils, 'unitdata')
+    @patch.object(datamover_utils, '_install_checkpoints', None)
+    def test_clear_install_checkpoints(self, _unitdata):
+        datamover_utils.install_checkpoints()['add_users'] = 'abc'
+        self.assertEqual(datamover_utils.install_checkpoints(),
+                         {'add_users': 'abc'})
+        datamover_utils.clear_install_checkpoints()
+        self.assertEqual(datamover_utils.install_checkpoints(), {})
+        _unitdata.kv.return_value.unset.assert_called_once_with(
+            'trilio.install-checkpoints')
+
+
+class ApplianceHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.test.appliance_body
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestArtifactSharing(unit_tests.test_utils.CharmTestCase):
+    """
+    Peer downloads against a local artifact server, with a plain HTTP
+    server standing in for the appliance.
+    """
+
+    def setUp(self):
+        super(TestArtifactSharing, self).setUp()
+        self.obj = datamover_utils
+        self.patches = ['log', 'peer_offers']
+        self.patch_all()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.body = os.urandom(50000)
+        self.seed_cache = ArtifactCache(os.path.join(self.tmp, 'seed'))
+        self.cache = ArtifactCache(os.path.join(self.tmp, 'cache'))
+        src = os.path.join(self.tmp, 'tvault-contego_1.0_all.deb')
+        with open(src, 'wb') as f:
+            f.write(self.body)
+        self.seed_cache.add('deb', '1.0', src, move=False)
+        self.sha256 = self.seed_cache.sha256('deb', '1.0')
+        self.seeder = self._serve(ArtifactServer(
+            ('127.0.0.1', 0), self.seed_cache.root))
+        self.appliance = self._serve(
+            http.server.HTTPServer(('127.0.0.1', 0), ApplianceHandler))
+        self.appliance_body = self.body
+
+    def _serve(self, server):
+        server.test = self
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    def test_fetch_from_peers(self):
+        good = '{}/artifacts/deb/1.0/tvault-contego_1.0_all.deb'.format(
+            self.seeder)
+        self.peer_offers.return_value = [(good, '0' * 64), (good, self.sha256)]
+        path = datamover_utils.fetch_from_peers(self.cache, 'deb', '1.0')
+        self.assertEqual(os.path.basename(path), 'tvault-contego_1.0_all.deb')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+
+    def test_fetch_from_peers_none(self):
+        self.peer_offers.return_value = [
+            ('{}/artifacts/deb/2.0/x.deb'.format(self.seeder), self.sha256)]
+        self.assertIsNone(
+            datamover_utils.fetch_from_peers(self.cache, 'deb', '2.0'))
+
+    def test_download_artifact_falls_back_to_appliance(self):
+        self.peer_offers.return_value = []
+        path = datamover_utils.download_artifact(
+            self.cache, 'deb', '1.0',
+            '{}/tvault-contego_1.0_all.deb'.format(self.appliance))
+        self.assertEqual(self.cache.sha256('deb', '1.0'), self.sha256)
+        self.assertTrue(os.path.exists(path))
+
+    def test_cached_artifacts(self):
+        self.assertEqual(datamover_utils.cached_artifacts(self.seed_cache), {
+            'deb': {'1.0': [self.sha256, 'tvault-contego_1.0_all.deb']}})
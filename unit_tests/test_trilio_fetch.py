@@ -0,0 +1,139 @@
+import hashlib
+import http.server
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from unittest.mock import patch
+
+import lib.trilio.trilio_fetch as trilio_fetch
+import unit_tests.test_utils
+
+
+def make_tarball():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for i in range(20):
+            data = os.urandom(64 * 1024)
+            info = tarfile.TarInfo('.virtenv/lib/file{}'.format(i))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class FlakyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves self.server.body, dropping the connection half way through the
+    first response. Supports single 'bytes=N-' ranges.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.body
+        start = 0
+        rng = self.headers.get('Range')
+        if rng and self.server.ranges:
+            start = int(rng.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.server.requests.append(rng)
+        if len(self.server.requests) == 1:
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+class TestTrilioFetch(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioFetch, self).setUp()
+        self.obj = trilio_fetch
+        self.patches = ['log']
+        self.patch_all()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.body = make_tarball()
+
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.body = self.body
+        self.server.ranges = True
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/venv.tar.gz'.format(
+            self.server.server_address[1])
+
+    def _shutdown_on_first_drop(self):
+        # Make the half written first response end early for the client
+        original = FlakyHandler.do_GET
+
+        def do_get(handler):
+            original(handler)
+            if len(handler.server.requests) == 1:
+                handler.connection.shutdown(2)
+        return patch.object(FlakyHandler, 'do_GET', do_get)
+
+    @patch.object(trilio_fetch.time, 'sleep')
+    def test_stream_extract_resumes(self, _sleep):
+        dest = os.path.join(self.tmp, 'dest')
+        os.mkdir(dest)
+        tee = io.BytesIO()
+        with self._shutdown_on_first_drop():
+            sha256 = trilio_fetch.stream_extract(self.url, dest, tee=tee)
+        self.assertEqual(sha256, hashlib.sha256(self.body).hexdigest())
+        self.assertEqual(tee.getvalue(), self.body)
+        self.assertEqual(len(os.listdir(
+            os.path.join(dest, '.virtenv', 'lib'))), 20)
+        self.assertEqual(self.server.requests[0], None)
+        self.assertTrue(self.server.requests[1].startswith('bytes='))
+
+    @patch.object(trilio_fetch.time, 'sleep')
+    def test_fetch_without_range_support(self, _sleep):
+        self.server.ranges = False
+        dest = os.path.join(self.tmp, 'venv.tar.gz')
+        with self._shutdown_on_first_drop():
+            trilio_fetch.fetch(self.url, dest)
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+
+    def test_fetch_checksum_mismatch(self):
+        self.server.requests.append('skip the dropped response')
+        with self.assertRaises(trilio_fetch.FetchError):
+            trilio_fetch.fetch(self.url, os.path.join(self.tmp, 'x'),
+                               sha256='0' * 64)
+
+    def test_extract_tarball_refuses_traversal(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+            info = tarfile.TarInfo('../escape')
+            info.size = 0
+            tar.addfile(info, io.BytesIO(b''))
+        buf.seek(0)
+        with self.assertRaises(trilio_fetch.FetchError):
+            trilio_fetch.extract_tarball(buf, self.tmp)
+
+    @unittest.skipUnless(os.geteuid() == 0, 'requires root')
+    @patch.object(trilio_fetch, 'resolve_owner')
+    def test_extract_tarball_owner(self, _resolve_owner):
+        _resolve_owner.return_value = (4242, 4343)
+        trilio_fetch.extract_tarball(io.BytesIO(make_tarball()), self.tmp,
+                                     owner=('nova', 'nova'))
+        st = os.lstat(os.path.join(self.tmp, '.virtenv/lib/file0'))
+        self.assertEqual((st.st_uid, st.st_gid), (4242, 4343))
@@ -0,0 +1,48 @@
+import lib.trilio.trilio_health as health
+from lib.trilio.trilio_probes import ProbeResult
+import unit_tests.test_utils
+
+
+def _results(api_ok=True, nfs_latency=0.01):
+    return [ProbeResult('api', api_ok, 0.002,
+                        'reachable' if api_ok else 'timed out after 3s'),
+            ProbeResult('nfs:/backups', True, nfs_latency, 'responding')]
+
+
+class TestTrilioHealth(unit_tests.test_utils.CharmTestCase):
+
+    def test_record(self):
+        state = health.new_state()
+        for now in range(5):
+            health.record(state, _results(), now, window=3)
+        self.assertEqual(state['time'], 4)
+        self.assertEqual(health.latest(state), _results())
+        self.assertEqual(state['history']['api'],
+                         [[2, True, 0.002], [3, True, 0.002],
+                          [4, True, 0.002]])
+        # Probes which are gone lose their history
+        health.record(state, _results()[:1], 5)
+        self.assertEqual(list(state['history']), ['api'])
+
+    def test_probe_stats(self):
+        stats = health.probe_stats('api', [
+            [0, True, 0.1], [1, False, 3.0], [2, True, 0.3],
+            [3, True, 0.2]])
+        self.assertEqual(stats, health.ProbeStats(
+            name='api', samples=4, failures=1, p50=0.2, p95=0.3))
+        self.assertIsNone(health.probe_stats('api', []).p50)
+
+    def test_assess(self):
+        state = health.new_state()
+        health.record(state, _results(), 0)
+        self.assertEqual(health.assess(state, 0.5), (health.HEALTHY, ''))
+        health.record(state, _results(api_ok=False), 1)
+        self.assertEqual(health.assess(state, 0.5),
+                         (health.DOWN, 'api timed out after 3s'))
+        # Recovered, but the failure is still within the window
+        health.record(state, _results(nfs_latency=0.9), 2)
+        health.record(state, _results(nfs_latency=0.8), 3)
+        self.assertEqual(health.assess(state, 0.5), (
+            health.DEGRADED, 'api failed 1/4, nfs:/backups p50 800ms'))
+        self.assertEqual(health.assess(state, 1.0),
+                         (health.DEGRADED, 'api failed 1/4'))
@@ -0,0 +1,52 @@
+import http.server
+import threading
+
+import lib.trilio.trilio_http as trilio_http
+import unit_tests.test_utils
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestConnectionPool(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.server = http.server.HTTPServer(
+            ('127.0.0.1', 0), KeepAliveHandler)
+        self.server.peers = set()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/packages/'.format(
+            self.server.server_address[1])
+
+    def test_request_reuses_connection(self):
+        pool = trilio_http.ConnectionPool()
+        self.addCleanup(pool.close)
+        for _ in range(3):
+            resp = pool.request('GET', self.url)
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.body, b'ok')
+            self.assertEqual(resp.headers['etag'], '"v1"')
+        self.assertEqual(len(self.server.peers), 1)
+
+    def test_request_path(self):
+        self.assertEqual(
+            trilio_http.request_path('http://h:1/a/b?c=d'), '/a/b?c=d')
+        self.assertEqual(trilio_http.request_path('http://h:1'), '/')
@@ -0,0 +1,161 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_log_metrics as log_metrics
+import unit_tests.test_utils
+
+
+SNAPSHOT = '5e2c1c3e-6f1d-4a43-9a76-3b6b1b1f2a10'
+LINES = [
+    '2020-01-01 10:00:00.100 4242 INFO contego.driver '
+    '[req-aaaa-1111 - - - - -] Starting snapshot {}'.format(SNAPSHOT),
+    '2020-01-01 10:00:30.000 4242 INFO contego.driver '
+    '[req-aaaa-1111 - - - - -] Uploaded disk vda: 2 GiB in 20.0 seconds',
+    '2020-01-01 10:01:00.000 4242 ERROR contego.driver '
+    '[req-aaaa-1111 - - - - -] Upload of disk vdb interrupted, retrying',
+    'Traceback (most recent call last):',
+    '2020-01-01 10:02:00.000 4242 INFO contego.driver '
+    '[req-aaaa-1111 - - - - -] Uploaded disk vdb: 1024 MiB in 30 s',
+    '2020-01-01 10:02:40.100 4242 INFO contego.driver '
+    '[req-aaaa-1111 - - - - -] Snapshot {} completed'.format(SNAPSHOT),
+]
+
+
+class TestTrilioLogMetrics(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioLogMetrics, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.log = os.path.join(self.tmp, 'tvault-contego.log')
+
+    def _append(self, text, path=None):
+        with open(path or self.log, 'ab') as f:
+            f.write(text.encode('utf-8'))
+
+    def test_read_new(self):
+        position = {'head': None, 'offset': 0}
+        self.assertEqual(log_metrics.read_new(self.log, position),
+                         (b'', position))
+        self._append('first\nsecond\nthi')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'first\nsecond\n')
+        self.assertEqual(position['offset'], 13)
+        # The partial line is read once it is complete
+        self._append('rd\n')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'third\n')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'')
+
+    def test_read_new_copytruncate(self):
+        self._append('first\nsecond\n')
+        data, position = log_metrics.read_new(
+            self.log, {'head': None, 'offset': 0})
+        self._append('third\n')
+        # copytruncate and compress, then more lines are logged
+        with open(self.log, 'rb') as src, \
+                gzip.open(self.log + '.1.gz', 'wb') as dst:
+            dst.write(src.read())
+        open(self.log, 'w').close()
+        self._append('fourth\n')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'third\nfourth\n')
+        self.assertEqual(position['offset'], 7)
+
+    def test_read_new_renamed(self):
+        self._append('first\n')
+        data, position = log_metrics.read_new(
+            self.log, {'head': None, 'offset': 0})
+        self._append('second\n')
+        os.rename(self.log, self.log + '.1')
+        # The new log has grown past the old offset already
+        self._append('a much longer first line\n')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'second\na much longer first line\n')
+
+    def test_read_new_max_bytes(self):
+        self._append('first\nsecond\n')
+        data, position = log_metrics.read_new(
+            self.log, {'head': None, 'offset': 0}, max_bytes=10)
+        self.assertEqual(data, b'first\n')
+        data, position = log_metrics.read_new(self.log, position)
+        self.assertEqual(data, b'second\n')
+
+    def test_parse_line(self):
+        entry = log_metrics.parse_line(LINES[1])
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['request'], 'req-aaaa-1111')
+        self.assertEqual(entry['message'],
+                         'Uploaded disk vda: 2 GiB in 20.0 seconds')
+        self.assertIsNone(log_metrics.parse_line(LINES[3]))
+
+    def test_update_metrics(self):
+        state = log_metrics.new_state()
+        self._append('\n'.join(LINES[:3]) + '\n')
+        log_metrics.update_metrics(state, self.log)
+        self.assertEqual(list(state['active']), [SNAPSHOT])
+        self.assertEqual(state['totals']['bytes'], 2 * 1024 ** 3)
+        self._append('\n'.join(LINES[3:]) + '\n')
+        log_metrics.update_metrics(state, self.log)
+        self.assertEqual(state['active'], {})
+        self.assertEqual(state['totals'], {
+            'bytes': 3 * 1024 ** 3, 'seconds': 50.0, 'transfers': 2,
+            'errors': 1, 'completed': 1, 'failed': 0})
+        record, = state['recent']
+        self.assertEqual(record['status'], 'completed')
+        self.assertAlmostEqual(record['ended'] - record['started'], 160.0)
+        self.assertEqual(record['disks'], {
+            'vda': {'bytes': 2 * 1024 ** 3, 'seconds': 20.0, 'errors': 0},
+            'vdb': {'bytes': 1024 ** 3, 'seconds': 30.0, 'errors': 1}})
+        self.assertEqual(state['requests'], {})
+
+    def test_failed_snapshot(self):
+        state = log_metrics.new_state()
+        failed = ('2020-01-01 10:05:00.000 4242 ERROR contego.driver '
+                  '[req-aaaa-1111 - - - - -] Snapshot {} failed: '
+                  'No space left on device'.format(SNAPSHOT))
+        self._append('\n'.join([LINES[0], failed]) + '\n')
+        log_metrics.update_metrics(state, self.log)
+        self.assertEqual(state['recent'][0]['status'], 'failed')
+        self.assertEqual(state['totals']['failed'], 1)
+
+    def test_format_textfile(self):
+        state = log_metrics.new_state()
+        self._append('\n'.join(LINES) + '\n')
+        log_metrics.update_metrics(state, self.log)
+        text = log_metrics.format_textfile(state)
+        self.assertIn('# TYPE trilio_datamover_transfer_bytes_total counter\n'
+                      'trilio_datamover_transfer_bytes_total 3221225472\n',
+                      text)
+        self.assertIn('trilio_datamover_snapshots_total{status="completed"}'
+                      ' 1\n', text)
+        self.assertIn('trilio_datamover_snapshot_bytes_total'
+                      '{status="completed"} 3221225472\n', text)
+        self.assertIn('trilio_datamover_snapshot_duration_seconds_total'
+                      '{status="completed"} 160.0\n', text)
+        self.assertIn('trilio_datamover_last_snapshot_throughput_bytes_per_'
+                      'second{{status="completed"}} {}\n'.format(
+                          3 * 1024 ** 3 / 50.0), text)
+        # Snapshot ids would make the number of series grow without bound
+        self.assertNotIn(SNAPSHOT, text)
+
+    def test_write_textfile(self):
+        log_metrics.write_textfile('metric 1\n', self.tmp)
+        log_metrics.write_textfile('metric 2\n', self.tmp)
+        self.assertEqual(os.listdir(self.tmp), ['trilio_datamover.prom'])
+        with open(os.path.join(self.tmp, 'trilio_datamover.prom')) as f:
+            self.assertEqual(f.read(), 'metric 2\n')
+
+    def test_format_metrics(self):
+        state = log_metrics.new_state()
+        self._append('\n'.join(LINES) + '\n')
+        log_metrics.update_metrics(state, self.log)
+        lines = log_metrics.format_metrics(state).splitlines()
+        self.assertEqual(lines[0], '3.0GiB uploaded in 2 transfers, '
+                         '61.4MB/s, 1 errors, 1 completed, 0 failed, '
+                         '0 active snapshots')
+        self.assertTrue(lines[1].startswith(SNAPSHOT + ' completed at '))
+        self.assertEqual(lines[2], '  vda          2.0GiB in 20s, 0 errors')
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_mountstats as mountstats
+import unit_tests.test_utils
+
+
+MOUNTSTATS = """\
+device sysfs mounted on /sys with fstype sysfs
+device 10.0.0.5:/backups mounted on /var/triliovault-mounts/MTAuMC4 \
+with fstype nfs4 statvers=1.1
+\topts:\trw,vers=4.1,rsize=1048576,wsize=1048576
+\tage:\t{age}
+\tbytes:\t{read} {write} 0 0 {read} {write} 0 0
+\tevents:\t1 2 3 4 5 6 7 8 9 10
+\txprt:\ttcp 0 1 2 0 0 10 10 0 10 0 2 0 0
+\tper-op statistics
+\t        NULL: 0 0 0 0 0 0 0 0
+\t        READ: {reads} {reads} 0 1000 {read} 0 {read_rtt} {read_exec} 0
+\t       WRITE: {writes} {wtrans} 1 {write} 1000 0 {write_rtt} {write_exec} 0
+\t     GETATTR: 5 5 0 500 500 0 5 6 0
+
+device 10.0.0.6:/other mounted on /mnt/other with fstype nfs
+\tbytes:\t1 2 3 4 5 6 7 8
+\tper-op statistics
+\t        READ: 9 9 0 0 0 0 9 9
+"""
+MOUNTPOINT = '/var/triliovault-mounts/MTAuMC4'
+
+
+def _mountstats(**kwargs):
+    values = dict(age=100, read=0, write=0, reads=0, read_rtt=0,
+                  read_exec=0, writes=0, wtrans=0, write_rtt=0,
+                  write_exec=0)
+    values.update(kwargs)
+    return MOUNTSTATS.format(**values).splitlines(True)
+
+
+class TestTrilioMountstats(unit_tests.test_utils.CharmTestCase):
+
+    def test_parse_mountstats(self):
+        mounts = mountstats.parse_mountstats(
+            _mountstats(read=4096, reads=2, read_rtt=10, read_exec=12),
+            '/var/triliovault-mounts')
+        self.assertEqual(mounts, {
+            MOUNTPOINT: {
+                'device': '10.0.0.5:/backups',
+                'bytes': [4096, 0],
+                'ops': {
+                    'READ': [2, 2, 0, 1000, 4096, 0, 10, 12],
+                    'GETATTR': [5, 5, 0, 500, 500, 0, 5, 6],
+                },
+            },
+        })
+        self.assertEqual(
+            mountstats.parse_mountstats(_mountstats(), '/var/triliovault'),
+            {})
+
+    def test_compare(self):
+        before = mountstats.parse_mountstats(
+            _mountstats(read=1000, write=2000, reads=10, read_rtt=100,
+                        read_exec=150, writes=20, wtrans=20,
+                        write_rtt=200, write_exec=300),
+            '/var/triliovault-mounts')
+        after = mountstats.parse_mountstats(
+            _mountstats(read=5000, write=10000, reads=30, read_rtt=500,
+                        read_exec=650, writes=70, wtrans=75,
+                        write_rtt=10200, write_exec=12300),
+            '/var/triliovault-mounts')
+        stats, = mountstats.compare(before, after, 300.0)
+        self.assertEqual(stats.mountpoint, MOUNTPOINT)
+        self.assertEqual(stats.seconds, 300.0)
+        self.assertEqual((stats.read_bytes, stats.write_bytes), (4000, 8000))
+        self.assertEqual(sorted(stats.ops), ['READ', 'WRITE'])
+        self.assertEqual(stats.ops['READ'], mountstats.OpStats(
+            ops=20, retransmits=0, timeouts=0, rtt_ms=20.0, execute_ms=25.0))
+        self.assertEqual(stats.ops['WRITE'], mountstats.OpStats(
+            ops=50, retransmits=5, timeouts=0, rtt_ms=200.0,
+            execute_ms=240.0))
+        self.assertEqual(mountstats.slow_ops([stats], 100),
+                         [(MOUNTPOINT, 'WRITE', 200.0)])
+        self.assertEqual(mountstats.slow_ops([stats], 100, min_ops=60), [])
+        # A remount starts the counters over
+        self.assertEqual(mountstats.compare(after, before, 300.0), [])
+
+    def test_sample(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'mountstats')
+        kv = {}
+        self.patch_object(mountstats, 'unitdata')
+        self.unitdata.kv.return_value.get.side_effect = kv.get
+        self.unitdata.kv.return_value.set.side_effect = kv.__setitem__
+        with open(path, 'w') as f:
+            f.writelines(_mountstats(reads=1, read_rtt=1))
+        self.assertEqual(mountstats.sample('/var/triliovault-mounts', 10.0,
+                                           path=path), [])
+        with open(path, 'w') as f:
+            f.writelines(_mountstats(reads=11, read_rtt=51))
+        stats, = mountstats.sample('/var/triliovault-mounts', 70.0,
+                                   path=path)
+        self.assertEqual(stats.seconds, 60.0)
+        self.assertEqual(stats.ops['READ'].rtt_ms, 5.0)
+        self.assertEqual(kv[mountstats.MOUNTSTATS_KEY]['time'], 70.0)
+        self.assertEqual(mountstats.sample('/var/triliovault-mounts', 80.0,
+                                           path=path + '.missing'), [])
+
+    def test_format_textfile(self):
+        stats = [mountstats.MountStats(
+            mountpoint=MOUNTPOINT, device='10.0.0.5:/backups', seconds=300.0,
+            read_bytes=4000, write_bytes=8000,
+            ops={'WRITE': mountstats.OpStats(50, 5, 0, 200.0, 240.0)})]
+        text = mountstats.format_textfile(stats)
+        self.assertIn('# TYPE trilio_nfs_write_bytes gauge\n'
+                      'trilio_nfs_write_bytes{{mountpoint="{}"}} 8000\n'
+                      .format(MOUNTPOINT), text)
+        self.assertIn('trilio_nfs_rtt_milliseconds{{mountpoint="{}",'
+                      'op="WRITE"}} 200.0\n'.format(MOUNTPOINT), text)
+        self.assertIn('trilio_nfs_retransmits{{mountpoint="{}",'
+                      'op="WRITE"}} 5\n'.format(MOUNTPOINT), text)
+
+    def test_describe_slow(self):
+        self.assertEqual(mountstats.describe_slow([
+            (MOUNTPOINT, 'WRITE', 200.4), (MOUNTPOINT, 'COMMIT', 150.0)]),
+            'MTAuMC4 WRITE 200ms (+1 more)')
@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import lib.trilio.trilio_nfs as trilio_nfs
+import unit_tests.test_utils
+
+
+class TestTrilioNfs(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioNfs, self).setUp()
+        self.obj = trilio_nfs
+        self.patches = ['log', 'subprocess']
+        self.patch_all()
+        self.subprocess.CalledProcessError = subprocess.CalledProcessError
+        self.subprocess.TimeoutExpired = subprocess.TimeoutExpired
+        self.subprocess.STDOUT = subprocess.STDOUT
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_mount_nfs(self):
+        trilio_nfs.mount_nfs('nfs:/export', '/mnt', options='nolock',
+                             timeout=5)
+        self.subprocess.check_output.assert_called_once_with(
+            ['mount', '-t', 'nfs', '-o', 'nolock', 'nfs:/export', '/mnt'],
+            stderr=subprocess.STDOUT, timeout=5)
+
+    def test_mount_nfs_timeout(self):
+        self.subprocess.check_output.side_effect = \
+            subprocess.TimeoutExpired('mount', 5)
+        with self.assertRaises(trilio_nfs.MountError):
+            trilio_nfs.mount_nfs('nfs:/export', '/mnt', timeout=5)
+        self.subprocess.call.assert_called_once_with(['umount', '-l', '/mnt'])
+
+    def test_umount_nfs_lazy_fallback(self):
+        self.subprocess.check_output.side_effect = \
+            subprocess.CalledProcessError(32, 'umount', b'busy')
+        self.assertFalse(trilio_nfs.umount_nfs('/mnt'))
+        self.subprocess.call.assert_called_once_with(['umount', '-l', '/mnt'])
+
+    def test_temp_mount(self):
+        with trilio_nfs.temp_mount('nfs:/export', self.tmp) as mountpoint:
+            self.assertTrue(os.path.isdir(mountpoint))
+            self.assertEqual(os.path.dirname(mountpoint), self.tmp)
+        self.assertFalse(os.path.exists(mountpoint))
+        self.assertEqual(self.subprocess.check_output.call_count, 2)
+
+    def test_temp_mount_failure(self):
+        self.subprocess.check_output.side_effect = \
+            subprocess.CalledProcessError(32, 'mount', b'access denied')
+        with self.assertRaises(trilio_nfs.MountError):
+            with trilio_nfs.temp_mount('nfs:/export', self.tmp):
+                pass
+        self.assertEqual(os.listdir(self.tmp), [])
+
+    def test_umount_all(self):
+        def check_output(cmd, **kwargs):
+            if cmd[-1] == '/mnt/b':
+                raise subprocess.TimeoutExpired(cmd, 5)
+        self.subprocess.check_output.side_effect = check_output
+        lazy = trilio_nfs.umount_all(['/mnt/a', '/mnt/b', '/mnt/a/nested'],
+                                     timeout=5)
+        self.assertEqual(lazy, ['/mnt/b'])
+        unmounted = [c[0][0][-1]
+                     for c in self.subprocess.check_output.call_args_list]
+        self.assertEqual(unmounted[0], '/mnt/a/nested')
+        self.assertEqual(sorted(unmounted[1:]), ['/mnt/a', '/mnt/b'])
+        self.subprocess.call.assert_called_once_with(
+            ['umount', '-l', '/mnt/b'])
+        self.assertEqual(trilio_nfs.umount_all([]), [])
@@ -0,0 +1,81 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+import lib.trilio.trilio_nfs_tune as nfs_tune
+import unit_tests.test_utils
+
+
+class TestTrilioNfsTune(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioNfsTune, self).setUp()
+        self.obj = nfs_tune
+        self.patches = ['log']
+        self.patch_all()
+
+    def test_parse_format_options(self):
+        parsed = nfs_tune.parse_options(' nolock, soft,timeo=180,,')
+        self.assertEqual(list(parsed.items()),
+                         [('nolock', None), ('soft', None), ('timeo', '180')])
+        self.assertEqual(nfs_tune.format_options(parsed),
+                         'nolock,soft,timeo=180')
+        self.assertEqual(nfs_tune.parse_options(None), {})
+
+    def test_candidate_options(self):
+        candidates = nfs_tune.candidate_options('nolock,nfsvers=3')
+        self.assertEqual(len(candidates), 16)
+        self.assertEqual(candidates[0], 'nolock,nfsvers=3')
+        self.assertIn('nolock,rsize=1048576,wsize=1048576,nconnect=4,'
+                      'vers=4.1,actimeo=60', candidates)
+        # vers replaces nfsvers instead of conflicting with it
+        self.assertFalse([c for c in candidates
+                          if 'vers=4.1' in c and 'nfsvers' in c])
+
+    def test_candidate_options_dedup(self):
+        candidates = nfs_tune.candidate_options(
+            'nconnect=4', dimensions={'nconnect': (None, '4')})
+        self.assertEqual(candidates, ['nconnect=4'])
+
+    def test_rank_results(self):
+        results = [
+            {'options': 'a', 'ok': True, 'write_mbps': 100.0,
+             'read_mbps': 200.0, 'meta_ms': 2.0},
+            {'options': 'b', 'ok': False, 'error': 'mount failed'},
+            {'options': 'c', 'ok': True, 'write_mbps': 150.0,
+             'read_mbps': 250.0, 'meta_ms': 3.0},
+            {'options': 'd', 'ok': True, 'write_mbps': 150.0,
+             'read_mbps': 250.0, 'meta_ms': 1.0},
+        ]
+        ranked = nfs_tune.rank_results(results)
+        self.assertEqual([r['options'] for r in ranked], ['d', 'c', 'a', 'b'])
+        table = nfs_tune.format_results(nfs_tune.rank_results(results))
+        self.assertIn('mount failed', table)
+        self.assertEqual(len(table.splitlines()), 5)
+
+    @patch.object(nfs_tune, 'benchmark_options')
+    def test_tune_share(self, _benchmark_options):
+        _benchmark_options.side_effect = lambda share, options, *a, **kw: {
+            'options': options, 'ok': True, 'write_mbps': len(options),
+            'read_mbps': 0, 'meta_ms': 1}
+        results = nfs_tune.tune_share('nfs:/export', 'nolock', '/tmp',
+                                      candidates=['nolock', 'nolock,vers=4.1'])
+        self.assertEqual(results[0]['options'], 'nolock,vers=4.1')
+        self.assertEqual(_benchmark_options.call_count, 2)
+
+    @patch.object(nfs_tune, '_read_file')
+    @patch.object(nfs_tune, 'temp_mount')
+    def test_benchmark_options_cleanup(self, _temp_mount, _read_file):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        _temp_mount.side_effect = lambda *a: contextlib.contextmanager(
+            lambda: (yield tmp))()
+        _read_file.side_effect = OSError('stale file handle')
+        result = nfs_tune.benchmark_options('nfs:/export', 'nolock', '/tmp',
+                                            size_mb=1, files=1)
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['error'], 'stale file handle')
+        self.assertEqual(os.listdir(tmp), [])
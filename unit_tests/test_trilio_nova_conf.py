@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_nova_conf as nova_conf
+import unit_tests.test_utils
+
+
+# As generated for nova-compute by openstack-pkg-tools on Ubuntu
+INIT_SCRIPT = '''#!/bin/sh
+DESC="OpenStack Compute"
+PROJECT_NAME=nova
+NAME=${PROJECT_NAME}-compute
+DAEMON_ARGS=""
+if [ -f '/etc/nova/nova-compute.conf' ] ; then
+\tDAEMON_ARGS="--config-file=/etc/nova/nova-compute.conf"
+fi
+CONFIG_FILE=/etc/${PROJECT_NAME}/${PROJECT_NAME}.conf
+[ -r /etc/default/openstack ] && . /etc/default/openstack
+[ -r /etc/default/$NAME ] && . /etc/default/$NAME
+if [ -z "${NO_OPENSTACK_CONFIG_FILE_DAEMON_ARG}" ] ; then
+\tDAEMON_ARGS="--config-file=${CONFIG_FILE} ${DAEMON_ARGS}"
+fi
+do_start() {
+\tstart-stop-daemon --start --quiet --background --exec $DAEMON \\
+\t\t-- $DAEMON_ARGS
+}
+'''
+
+
+class TestTrilioNovaConf(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioNovaConf, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.etc_units = os.path.join(self.tmp, 'etc')
+        self.lib_units = os.path.join(self.tmp, 'lib')
+        self.unit_dirs = (self.etc_units, self.lib_units)
+        self.config_dirs = (os.path.join(self.tmp, 'nova'),)
+
+    def _write(self, path, content):
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_config_args(self):
+        self.assertEqual(
+            nova_conf.config_args(
+                '/usr/bin/nova-compute --config-file /etc/nova/nova.conf '
+                '--config-dir=/etc/nova/conf.d --config-file=$X'),
+            ['--config-file=/etc/nova/nova.conf',
+             '--config-dir=/etc/nova/conf.d'])
+
+    def test_script_config_args(self):
+        self.assertEqual(nova_conf.script_variables(INIT_SCRIPT)['NAME'],
+                         'nova-compute')
+        self.assertEqual(nova_conf.script_config_args(INIT_SCRIPT),
+                         ['--config-file=/etc/nova/nova.conf',
+                          '--config-file=/etc/nova/nova-compute.conf'])
+        # Without DAEMON_ARGS the arguments are taken from anywhere in the
+        # expanded script, unknown variables are skipped
+        self.assertEqual(
+            nova_conf.script_config_args(
+                'CONF=/etc/nova/nova.conf\n'
+                'exec nova-compute --config-file=$CONF '
+                '--config-file=$EXTRA\n'),
+            ['--config-file=/etc/nova/nova.conf'])
+
+    def test_exec_start_drop_in(self):
+        unit = self._write('lib/nova-compute.service',
+                           '[Service]\nExecStart=/usr/bin/nova-compute \\\n'
+                           '  --config-file=/etc/nova/nova.conf\n')
+        self.assertEqual(
+            nova_conf.config_args(nova_conf.exec_start([unit])),
+            ['--config-file=/etc/nova/nova.conf'])
+        drop_in = self._write(
+            'etc/nova-compute.service.d/override.conf',
+            '[Service]\nExecStart=\nExecStart=-/usr/bin/nova-compute '
+            '--config-file=/etc/nova/other.conf\n')
+        paths = nova_conf.unit_paths(unit_dirs=self.unit_dirs)
+        self.assertEqual(paths, [unit, drop_in])
+        self.assertEqual(nova_conf.exec_start(paths),
+                         '/usr/bin/nova-compute '
+                         '--config-file=/etc/nova/other.conf')
+
+    def test_resolve_init_script(self):
+        script = self._write('init.d/nova-compute', INIT_SCRIPT)
+        self._write('lib/nova-compute.service',
+                    '[Service]\nExecStart={} systemd-start\n'.format(script))
+        # Only init scripts are followed
+        args, _ = nova_conf.resolve(self.unit_dirs, self.config_dirs)
+        self.assertIsNone(args)
+        args, paths = nova_conf.resolve(
+            self.unit_dirs, self.config_dirs,
+            init_dir=os.path.dirname(script))
+        self.assertEqual(args, ['--config-file=/etc/nova/nova.conf',
+                                '--config-file=/etc/nova/nova-compute.conf'])
+        self.assertIn(script, paths)
+
+    def test_resolve_defaults(self):
+        conf = self._write('nova/nova.conf', '[DEFAULT]\n')
+        args, paths = nova_conf.resolve(self.unit_dirs, self.config_dirs)
+        self.assertEqual(args, ['--config-file={}'.format(conf)])
+        self.assertIn(conf, paths)
+        # A new unit file invalidates the result
+        self.assertIn(os.path.join(self.etc_units, 'nova-compute.service'),
+                      paths)
+
+    def test_fingerprint(self):
+        conf = self._write('nova/nova.conf', '')
+        missing = os.path.join(self.tmp, 'missing')
+        before = nova_conf.fingerprint([conf, missing])
+        self.assertIsNone(before[missing])
+        self._write('missing', '')
+        self.assertNotEqual(nova_conf.fingerprint([conf, missing]), before)
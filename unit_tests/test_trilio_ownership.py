@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+import lib.trilio.trilio_ownership as ownership
+import unit_tests.test_utils
+
+
+class TestTrilioOwnership(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioOwnership, self).setUp()
+        self.obj = ownership
+        self.patches = ['resolve_owner']
+        self.patch_all()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        for d in ('a/b/c', 'd'):
+            os.makedirs(os.path.join(self.tmp, d))
+        for f in ('a/1', 'a/b/2', 'a/b/c/3', 'd/4'):
+            open(os.path.join(self.tmp, f), 'w').close()
+        # Links must not be followed out of the tree
+        self.outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.outside)
+        os.symlink(self.outside, os.path.join(self.tmp, 'link'))
+
+    def test_ensure_ownership_skips_owned(self):
+        self.resolve_owner.return_value = (os.getuid(), os.getgid())
+        with patch.object(ownership.os, 'chown') as _chown:
+            counts = ownership.ensure_ownership(self.tmp, 'nova', 'nova')
+        _chown.assert_not_called()
+        self.assertEqual(counts, {'scanned': 10, 'changed': 0})
+
+    @unittest.skipUnless(os.geteuid() == 0, 'requires root')
+    def test_ensure_ownership_changes(self):
+        self.resolve_owner.return_value = (4242, 4343)
+        os.chown(os.path.join(self.tmp, 'd/4'), 4242, 4343)
+        counts = ownership.ensure_ownership(self.tmp, 'nova', 'nova',
+                                            workers=2)
+        self.assertEqual(counts, {'scanned': 10, 'changed': 9})
+        for root, dirs, files in os.walk(self.tmp):
+            for name in [root] + [os.path.join(root, n) for n in dirs + files]:
+                st = os.lstat(name)
+                self.assertEqual((st.st_uid, st.st_gid), (4242, 4343))
+        self.assertEqual(os.stat(self.outside).st_uid, os.getuid())
+        # A second run finds nothing to do
+        self.assertEqual(
+            ownership.ensure_ownership(self.tmp, 'nova', 'nova')['changed'],
+            0)
+
+    def test_ensure_ownership_exclude(self):
+        self.resolve_owner.return_value = (os.getuid(), os.getgid())
+        counts = ownership.ensure_ownership(
+            self.tmp, 'nova', 'nova', exclude=[os.path.join(self.tmp, 'a')])
+        # a itself is checked, but nothing below it
+        self.assertEqual(counts['scanned'], 5)
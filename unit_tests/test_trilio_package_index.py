@@ -0,0 +1,72 @@
+import lib.trilio.trilio_package_index as package_index
+import unit_tests.test_utils
+
+from lib.trilio.trilio_http import Response
+
+
+LISTING = b'''<html><body>
+<a href="/packages/tvault-contego-virtenv.tar.gz">virtenv</a>
+<a href="/packages/tvault-contego-3.1.25.tar.gz">contego</a>
+<a href="/packages/tvault-contego-3.1.20.tar.gz">contego</a>
+<a href="/packages/python-workloadmgrclient-3.1.12.tar.gz">client</a>
+</body></html>'''
+
+
+class TestPackageIndex(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestPackageIndex, self).setUp()
+        self.obj = package_index
+        self.patches = ['log', 'POOL', 'time']
+        self.patch_all()
+        self.time.time.return_value = 1000
+
+    def test_parse_package_index(self):
+        self.assertEqual(
+            package_index.parse_package_index(LISTING.decode('utf-8')),
+            {'tvault-contego': '3.1.25',
+             'python-workloadmgrclient': '3.1.12'})
+
+    def test_version_fetches_once(self):
+        self.POOL.request.return_value = Response(
+            200, {'etag': '"abc"'}, LISTING)
+        index = package_index.PackageIndex('http://1.2.3.4:8081/packages/')
+        self.assertEqual(index.version('tvault-contego'), '3.1.25')
+        self.assertEqual(
+            index.version('python-workloadmgrclient'), '3.1.12')
+        self.POOL.request.assert_called_once_with(
+            'GET', 'http://1.2.3.4:8081/packages/', headers={})
+
+    def test_version_not_found(self):
+        self.POOL.request.return_value = Response(200, {}, LISTING)
+        index = package_index.PackageIndex('http://1.2.3.4:8081/packages/')
+        with self.assertRaises(package_index.PackageNotFound):
+            index.version('dmapi')
+
+    def test_revalidate_stale_state(self):
+        state = {
+            'url': 'http://1.2.3.4:8081/packages/',
+            'fetched': 0,
+            'etag': '"abc"',
+            'last-modified': None,
+            'versions': {'tvault-contego': '3.1.25'},
+        }
+        self.POOL.request.return_value = Response(304, {}, b'')
+        index = package_index.PackageIndex(
+            'http://1.2.3.4:8081/packages/', state=state)
+        self.assertEqual(index.version('tvault-contego'), '3.1.25')
+        self.POOL.request.assert_called_once_with(
+            'GET', 'http://1.2.3.4:8081/packages/',
+            headers={'If-None-Match': '"abc"'})
+        self.assertEqual(index.state['fetched'], 1000)
+
+    def test_fresh_state_no_request(self):
+        state = {
+            'url': 'http://1.2.3.4:8081/packages/',
+            'fetched': 900,
+            'versions': {'tvault-contego': '3.1.25'},
+        }
+        index = package_index.PackageIndex(
+            'http://1.2.3.4:8081/packages/', state=state)
+        self.assertEqual(index.version('tvault-contego'), '3.1.25')
+        self.POOL.request.assert_not_called()
@@ -0,0 +1,124 @@
+import json
+
+import lib.trilio.trilio_peers as peers
+import unit_tests.test_utils
+
+
+class TestTrilioPeers(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioPeers, self).setUp()
+        self.obj = peers
+        self.patches = ['is_leader', 'leader_get', 'leader_set',
+                        'local_unit', 'related_units', 'relation_get',
+                        'relation_ids', 'relation_set']
+        self.patch_all()
+        self.relation_ids.return_value = ['data-mover-peers:1']
+        self.local_unit.return_value = 'dm/0'
+
+    def test_choose_seeders(self):
+        units = ['dm/10', 'dm/2', 'dm/1']
+        self.assertEqual(peers.choose_seeders([], units, 'dm/0', 2),
+                         ['dm/0', 'dm/1'])
+        # Existing seeders are kept, departed ones replaced
+        self.assertEqual(
+            peers.choose_seeders(['dm/10', 'dm/5'], units, 'dm/0', 2),
+            ['dm/10', 'dm/0'])
+        self.assertEqual(peers.choose_seeders([], units, 'dm/0', 10),
+                         ['dm/0', 'dm/1', 'dm/2', 'dm/10'])
+
+    def test_elect_seeders(self):
+        self.is_leader.return_value = True
+        self.leader_get.return_value = None
+        self.related_units.return_value = ['dm/1', 'dm/2']
+        self.assertEqual(peers.elect_seeders(2), ['dm/0', 'dm/1'])
+        self.leader_set.assert_called_once_with(
+            {'artifact-seeders': json.dumps(['dm/0', 'dm/1'])})
+
+    def test_elect_seeders_not_leader(self):
+        self.is_leader.return_value = False
+        self.leader_get.return_value = '["dm/3"]'
+        self.assertEqual(peers.elect_seeders(2), ['dm/3'])
+        self.leader_set.assert_not_called()
+
+    def test_is_seeder(self):
+        self.leader_get.return_value = None
+        self.is_leader.return_value = True
+        self.assertTrue(peers.is_seeder())
+        self.leader_get.return_value = '["dm/3"]'
+        self.assertFalse(peers.is_seeder())
+
+    def test_peer_offers(self):
+        self.related_units.return_value = ['dm/1', 'dm/2', 'dm/3']
+        data = {
+            'dm/1': {'artifact-url': 'http://10.0.0.1:8089',
+                     'artifacts': json.dumps(
+                         {'virtenv': {'1.0': ['abc', 'venv.tar.gz']}})},
+            'dm/2': {'artifact-url': 'http://10.0.0.2:8089',
+                     'artifacts': json.dumps(
+                         {'virtenv': {'0.9': ['def', 'venv.tar.gz']}})},
+            'dm/3': {'artifacts': 'garbage'},
+        }
+        self.relation_get.side_effect = lambda rid, unit: data[unit]
+        self.assertEqual(peers.peer_offers('virtenv', '1.0'), [
+            ('http://10.0.0.1:8089/artifacts/virtenv/1.0/venv.tar.gz',
+             'abc')])
+
+    def test_advertise_artifacts(self):
+        peers.advertise_artifacts(None, None)
+        self.relation_set.assert_called_once_with(
+            relation_id='data-mover-peers:1',
+            relation_settings={'artifact-url': None, 'artifacts': None})
+
+    def test_next_restart_batch(self):
+        states = {
+            'dm/0': {'requested': 't1', 'done': 't1', 'health': 'healthy'},
+            'dm/1': {'requested': 't1', 'done': None, 'health': None},
+            'dm/2': {'requested': 't1', 'done': None, 'health': None},
+            'dm/10': {'requested': 't1', 'done': None, 'health': None},
+            'dm/3': {'requested': None, 'done': None, 'health': None},
+        }
+        self.assertEqual(peers.next_restart_batch([], states, 2),
+                         ['dm/1', 'dm/2'])
+        # The batch is kept until all of it restarted and is healthy
+        states['dm/1'].update(done='t1', health='degraded')
+        self.assertEqual(peers.next_restart_batch(['dm/1', 'dm/2'],
+                                                  states, 2),
+                         ['dm/1', 'dm/2'])
+        states['dm/2'].update(done='t1', health='down')
+        self.assertEqual(peers.next_restart_batch(['dm/1', 'dm/2'],
+                                                  states, 2),
+                         ['dm/1', 'dm/2'])
+        states['dm/2'].update(health='healthy')
+        self.assertEqual(peers.next_restart_batch(['dm/1', 'dm/2'],
+                                                  states, 2), ['dm/10'])
+        # Departed units are dropped
+        del states['dm/10']
+        self.assertEqual(peers.next_restart_batch(['dm/10'], states, 2), [])
+
+    def test_update_restart_batch(self):
+        self.is_leader.return_value = True
+        self.leader_get.return_value = '[]'
+        self.related_units.return_value = ['dm/1', 'dm/2']
+        data = {
+            'dm/0': {'restart-requested': 't1'},
+            'dm/1': {},
+            'dm/2': {'restart-requested': 't2', 'restart-done': 't1',
+                     'restart-health': 'healthy'},
+        }
+        self.relation_get.side_effect = lambda rid, unit: data[unit]
+        self.assertEqual(peers.update_restart_batch(1), ['dm/0'])
+        self.leader_set.assert_called_once_with(
+            {'restart-batch': json.dumps(['dm/0'])})
+        self.is_leader.return_value = False
+        self.leader_get.return_value = '["dm/2"]'
+        self.assertEqual(peers.update_restart_batch(1), ['dm/2'])
+        self.leader_set.assert_called_once_with(
+            {'restart-batch': json.dumps(['dm/0'])})
+
+    def test_publish_restart(self):
+        peers.publish_restart(done='t1', health='healthy')
+        self.relation_set.assert_called_once_with(
+            relation_id='data-mover-peers:1',
+            relation_settings={'restart-done': 't1',
+                               'restart-health': 'healthy'})
@@ -0,0 +1,123 @@
+import http.server
+import socket
+import tempfile
+import threading
+import time
+
+import lib.trilio.trilio_probes as probes
+import unit_tests.test_utils
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200 if self.path == '/packages/' else 404)
+        self.end_headers()
+
+
+class TestTrilioProbes(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioProbes, self).setUp()
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), StatusHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.port = self.server.server_address[1]
+
+    def _closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_run_probes(self):
+        with tempfile.NamedTemporaryFile() as f:
+            results = probes.run_probes([
+                probes.PathProbe(f.name, name='file'),
+                probes.PathProbe(f.name + '.missing', name='missing'),
+                probes.TCPProbe('127.0.0.1', self.port, name='tcp'),
+                probes.TCPProbe('127.0.0.1', self._closed_port(),
+                                name='closed'),
+                probes.HTTPProbe('http://127.0.0.1:{}/packages/'.format(
+                    self.port), name='http'),
+                probes.HTTPProbe('http://127.0.0.1:{}/other'.format(
+                    self.port), name='http404'),
+            ])
+        self.assertEqual(
+            [(r.name, r.ok) for r in results],
+            [('file', True), ('missing', False), ('tcp', True),
+             ('closed', False), ('http', True), ('http404', False)])
+        self.assertEqual(results[5].detail, 'HTTP 404')
+
+    def test_probe_timeout(self):
+        # A listening socket which never accepts answers no HTTP request
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        self.addCleanup(sock.close)
+        result = probes.run_probe(probes.HTTPProbe(
+            'http://127.0.0.1:{}/'.format(sock.getsockname()[1]),
+            timeout=0.2))
+        self.assertFalse(result.ok)
+        self.assertEqual(result.detail, 'timed out after 0.2s')
+
+    def test_statfs_and_service_probes(self):
+        self.patch_object(probes, 'service_running')
+        self.service_running.side_effect = lambda s: s == 'tvault-contego'
+        with tempfile.NamedTemporaryFile() as f:
+            results = probes.run_probes([
+                probes.StatfsProbe(f.name, name='statfs'),
+                probes.StatfsProbe(f.name + '.missing', name='gone'),
+                probes.ServiceProbe('tvault-contego'),
+                probes.ServiceProbe('tvault-object-store'),
+            ])
+        self.assertEqual(
+            [(r.name, r.ok, r.detail) for r in results[:1] + results[2:]],
+            [('statfs', True, 'responding'),
+             ('tvault-contego', True, 'running'),
+             ('tvault-object-store', False, 'not running')])
+        self.assertFalse(results[1].ok)
+        self.assertIn('No such file', results[1].detail)
+
+    def test_hung_path_probe(self):
+        class HungProbe(probes.StatfsProbe):
+            # Stands in for a statfs blocked on a hung NFS server
+            def command(self):
+                return ['sleep', '60']
+
+        threads = threading.active_count()
+        start = time.monotonic()
+        result = probes.run_probe(HungProbe('/hung', timeout=0.2))
+        self.assertFalse(result.ok)
+        self.assertEqual(result.detail, 'timed out after 0.2s')
+        # No worker thread is left waiting for the command
+        while threading.active_count() > threads and \
+                time.monotonic() - start < 5:
+            time.sleep(0.05)
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_run_command_timeout(self):
+        self.assertIsNone(probes.run_command(['sleep', '60'], 0.1))
+        self.assertEqual(probes.run_command(['true'], 5), (0, ''))
+
+    def test_run_probes_from_thread(self):
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(
+            probes.run_probes([probes.TCPProbe('127.0.0.1', self.port)])))
+        thread.start()
+        thread.join()
+        self.assertTrue(results[0].ok)
+
+    def test_describe_failures(self):
+        self.assertEqual(probes.describe_failures([
+            probes.ProbeResult('api', True, 0.1, 'reachable'),
+            probes.ProbeResult('deb-repo', False, 3, 'timed out after 3s'),
+        ]), 'deb-repo timed out after 3s')
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_pylibs as pylibs
+import unit_tests.test_utils
+
+
+class TestTrilioPylibs(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioPylibs, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.local = os.path.join(self.tmp, 'local')
+        self.dist = os.path.join(self.tmp, 'dist')
+        self.search_path = (self.local, self.dist)
+        for path in ('dist/cryptography/__init__.py',
+                     'dist/cffi/__init__.py',
+                     'dist/libvirtmod.x86_64-linux-gnu.so',
+                     'dist/_cffi_backend.so',
+                     # Not a package without __init__.py
+                     'local/cffi/api.py'):
+            self._touch(path)
+
+    def _touch(self, path):
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+        return path
+
+    def test_resolve_libraries(self):
+        self.assertEqual(
+            dict(pylibs.resolve_libraries(search_path=self.search_path)), {
+                'cryptography': os.path.join(self.dist, 'cryptography'),
+                'libvirtmod': os.path.join(
+                    self.dist, 'libvirtmod.x86_64-linux-gnu.so'),
+                'cffi': os.path.join(self.dist, 'cffi'),
+                '_cffi_backend': os.path.join(self.dist, '_cffi_backend.so'),
+            })
+
+    def test_find_library_order(self):
+        local = self._touch('local/_cffi_backend.py')
+        self.assertEqual(
+            pylibs.find_library('_cffi_backend', 'module',
+                                search_path=self.search_path), local)
+        self.assertIsNone(
+            pylibs.find_library('nova', 'package',
+                                search_path=self.search_path))
+
+    def test_resolve_libraries_missing(self):
+        os.remove(os.path.join(self.dist, '_cffi_backend.so'))
+        with self.assertRaises(LookupError):
+            pylibs.resolve_libraries(search_path=self.search_path)
+
+    def test_interpreter_id(self):
+        python = self._touch('python2.7')
+        link = os.path.join(self.tmp, 'python')
+        os.symlink(python, link)
+        self.assertTrue(pylibs.interpreter_id(link).startswith(python + ':'))
+
+    def test_interpreter_search_path(self):
+        python = self._touch('opt/bin/python2.7')
+        link = os.path.join(self.tmp, 'python')
+        os.symlink(python, link)
+        prefix = os.path.join(self.tmp, 'opt')
+        search_path = pylibs.interpreter_search_path(link)
+        self.assertEqual(search_path[0], prefix + '/lib/python2.7')
+        self.assertEqual(search_path[-1],
+                         prefix + '/lib/python2.7/dist-packages')
+        self.assertEqual(pylibs.interpreter_search_path('/usr/bin/python2.7'),
+                         pylibs.PYTHON2_PATH)
+        self.assertIsNone(pylibs.interpreter_search_path(
+            self._touch('opt/bin/python3.8')))
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_resources as resources
+import unit_tests.test_utils
+
+
+class TestTrilioResources(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioResources, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(resources.parse_cpu_list('0-3,8'), {0, 1, 2, 3, 8})
+        self.assertEqual(resources.parse_cpu_list('0-7, ^2-5,^7'),
+                         {0, 1, 6})
+        self.assertEqual(resources.parse_cpu_list('0-3\n'), {0, 1, 2, 3})
+        self.assertEqual(resources.parse_cpu_list(''), set())
+        for spec in ('3-1', 'a', '1-b'):
+            self.assertRaises(ValueError, resources.parse_cpu_list, spec)
+
+    def test_format_cpu_list(self):
+        self.assertEqual(resources.format_cpu_list({0, 1, 2, 5, 7, 8}),
+                         '0-2 5 7-8')
+        self.assertEqual(resources.format_cpu_list(set()), '')
+
+    def test_online_cpus(self):
+        path = self._write('online', '0-3,6\n')
+        self.assertEqual(resources.online_cpus(path), {0, 1, 2, 3, 6})
+        self.assertTrue(resources.online_cpus(
+            os.path.join(self.tmp, 'missing')))
+
+    def test_nova_config_files(self):
+        self._write('nova.conf.d/20-b.conf', '')
+        self._write('nova.conf.d/10-a.conf', '')
+        self._write('nova.conf.d/README', '')
+        conf_dir = os.path.join(self.tmp, 'nova.conf.d')
+        self.assertEqual(
+            resources.nova_config_files([
+                '--config-file=/etc/nova/nova.conf',
+                '--config-dir={}'.format(conf_dir)]),
+            ['/etc/nova/nova.conf',
+             os.path.join(conf_dir, '10-a.conf'),
+             os.path.join(conf_dir, '20-b.conf')])
+
+    def test_nova_pinned_cpus(self):
+        base = self._write('nova.conf',
+                           '[DEFAULT]\nvcpu_pin_set = 4-15\n'
+                           'my_ip = 10.0.0.1\n')
+        self.assertEqual(resources.nova_pinned_cpus([base]),
+                         set(range(4, 16)))
+        # cpu_dedicated_set wins, later files override earlier ones
+        first = self._write('a.conf', '[compute]\ncpu_dedicated_set = 2-3\n')
+        second = self._write('b.conf', '[compute]\ncpu_dedicated_set = 8\n')
+        self.assertEqual(resources.nova_pinned_cpus([base, first, second]),
+                         {8})
+        broken = self._write('broken.conf', 'no section\n')
+        missing = os.path.join(self.tmp, 'missing.conf')
+        self.assertEqual(resources.nova_pinned_cpus([broken, missing]),
+                         set())
+
+    def test_auto_cpu_affinity(self):
+        online = set(range(8))
+        self.assertEqual(resources.auto_cpu_affinity(online, {2, 3, 4, 5}),
+                         {0, 1, 6, 7})
+        self.assertIsNone(resources.auto_cpu_affinity(online, set()))
+        self.assertIsNone(resources.auto_cpu_affinity(online, online))
+
+    def test_resource_controls(self):
+        controls = resources.resource_controls({
+            'cpu-affinity': '0-3,^1',
+            'cpu-quota': '200%',
+            'cpu-weight': 50,
+            'nice': 5,
+            'io-scheduling-class': 'best-effort',
+            'io-weight': 20,
+            'memory-max': '8G',
+        })
+        self.assertEqual(list(controls.items()), [
+            ('CPUAffinity', '0 2-3'),
+            ('CPUQuota', '200%'),
+            ('CPUWeight', 50),
+            ('Nice', 5),
+            ('IOSchedulingClass', 'best-effort'),
+            ('IOWeight', 20),
+            ('MemoryMax', '8G'),
+        ])
+        self.assertEqual(resources.resource_controls({
+            'cpu-affinity': '', 'cpu-weight': 0, 'memory-max': None}), {})
+
+    def test_resource_controls_auto(self):
+        settings = {'cpu-affinity': 'auto'}
+        self.assertEqual(
+            resources.resource_controls(settings, online={0, 1, 2, 3},
+                                        pinned={1, 2}),
+            {'CPUAffinity': '0 3'})
+        self.assertEqual(
+            resources.resource_controls(settings, online={0, 1, 2, 3},
+                                        pinned=set()), {})
+
+    def test_resource_controls_invalid(self):
+        for settings in ({'cpu-affinity': 'all'},
+                         {'cpu-quota': '2'},
+                         {'cpu-weight': 20000},
+                         {'nice': 20},
+                         {'io-scheduling-class': 'fast'},
+                         {'io-weight': -1},
+                         {'memory-max': '8GB'}):
+            self.assertRaises(ValueError, resources.resource_controls,
+                              settings)
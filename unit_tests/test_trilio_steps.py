@@ -0,0 +1,174 @@
+import threading
+
+import lib.trilio.trilio_steps as steps
+import unit_tests.test_utils
+
+
+class TestTrilioSteps(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioSteps, self).setUp()
+        self.obj = steps
+        self.patches = ['hookenv', 'log']
+        self.patch_all()
+
+    def test_run_steps_respects_requires(self):
+        order = []
+
+        def record(name):
+            return lambda: order.append(name) or True
+
+        result = steps.run_steps([
+            steps.Step('c', record('c'), requires=['b']),
+            steps.Step('b', record('b'), requires=['a']),
+            steps.Step('a', record('a')),
+        ])
+        self.assertTrue(result)
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    def test_run_steps_concurrent(self):
+        # Both steps have to be running at the same time to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait():
+            barrier.wait()
+            return True
+
+        self.assertTrue(steps.run_steps([
+            steps.Step('a', wait),
+            steps.Step('b', wait),
+        ]))
+
+    def test_run_steps_first_failure_status(self):
+        first_done = threading.Event()
+
+        def fail_first():
+            steps.status_set('blocked', 'first')
+            first_done.set()
+            return False
+
+        def fail_second():
+            first_done.wait(5)
+            steps.status_set('blocked', 'second')
+            return False
+
+        ran = []
+        result = steps.run_steps([
+            steps.Step('a', fail_first),
+            steps.Step('b', fail_second),
+            steps.Step('c', lambda: ran.append('c'), requires=['a']),
+        ])
+        self.assertFalse(result)
+        self.assertEqual(ran, [])
+        self.hookenv.status_set.assert_called_once_with('blocked', 'first')
+
+    def test_run_steps_reraises(self):
+        def boom():
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError):
+            steps.run_steps([steps.Step('a', boom)])
+
+    def test_run_steps_cycle(self):
+        with self.assertRaises(ValueError):
+            steps.run_steps([
+                steps.Step('a', lambda: True, requires=['b']),
+                steps.Step('b', lambda: True, requires=['a']),
+            ])
+
+    def test_status_set_outside_steps(self):
+        steps.status_set('maintenance', 'Installing...')
+        self.hookenv.status_set.assert_called_once_with(
+            'maintenance', 'Installing...')
+
+    def _install_steps(self, ran, inputs, fail=()):
+        def record(name):
+            return lambda: ran.append(name) or name not in fail
+
+        return [
+            steps.Step('validate', record('validate')),
+            steps.Step('download', record('download'), requires=['validate'],
+                       inputs=lambda: {'version': inputs['version']}),
+            steps.Step('users', record('users'), inputs=dict),
+            steps.Step('check', record('check'), requires=['download']),
+            steps.Step('files', record('files'),
+                       requires=['download', 'users'], inputs=dict),
+            steps.Step('mount', record('mount'), requires=['check', 'files'],
+                       inputs=dict),
+        ]
+
+    def test_run_steps_checkpoints(self):
+        inputs = {'version': '1.0'}
+        checkpoints = {}
+        ran = []
+        self.assertFalse(steps.run_steps(
+            self._install_steps(ran, inputs, fail=['files']),
+            checkpoints=checkpoints))
+        self.assertEqual(sorted(checkpoints), ['download', 'users'])
+        # A retry resumes at the failed step, validations always run
+        ran = []
+        self.assertTrue(steps.run_steps(
+            self._install_steps(ran, inputs), checkpoints=checkpoints))
+        self.assertEqual(sorted(ran), ['check', 'files', 'mount', 'validate'])
+        self.assertEqual(sorted(checkpoints),
+                         ['download', 'files', 'mount', 'users'])
+        ran = []
+        steps.run_steps(self._install_steps(ran, inputs),
+                        checkpoints=checkpoints)
+        self.assertEqual(sorted(ran), ['check', 'validate'])
+        # Changed inputs run the step and the checkpointed steps after it
+        inputs['version'] = '2.0'
+        ran = []
+        steps.run_steps(self._install_steps(ran, inputs),
+                        checkpoints=checkpoints)
+        self.assertEqual(sorted(ran),
+                         ['check', 'download', 'files', 'mount', 'validate'])
+        # Without checkpoints everything runs
+        ran = []
+        steps.run_steps(self._install_steps(ran, inputs))
+        self.assertEqual(len(ran), 6)
+
+    def test_run_steps_checkpoints_failure_between_steps(self):
+        inputs = {'a': 1}
+        fail = set()
+        checkpoints = {}
+
+        def run():
+            ran = []
+
+            def record(name):
+                return lambda: ran.append(name) or name not in fail
+
+            steps.run_steps([
+                steps.Step('a', record('a'), inputs=lambda: dict(inputs)),
+                steps.Step('validate', record('validate')),
+                steps.Step('b', record('b'), requires=['a', 'validate'],
+                           inputs=dict),
+                steps.Step('c', record('c'), requires=['b'], inputs=dict),
+            ], checkpoints=checkpoints)
+            return sorted(ran)
+
+        self.assertEqual(run(), ['a', 'b', 'c', 'validate'])
+        self.assertEqual(sorted(checkpoints), ['a', 'b', 'c'])
+        # a runs with new inputs, the hook fails before b and c run
+        inputs['a'] = 2
+        fail.add('validate')
+        self.assertEqual(run(), ['a', 'validate'])
+        self.assertEqual(sorted(checkpoints), ['a'])
+        # b and c have not run against the new a yet
+        fail.clear()
+        self.assertEqual(run(), ['b', 'c', 'validate'])
+        self.assertEqual(sorted(checkpoints), ['a', 'b', 'c'])
+
+    def test_run_steps_checkpoint_inputs_fail(self):
+        def inputs():
+            raise IOError('appliance unreachable')
+
+        ran = []
+        checkpoints = {'a': steps.fingerprint(None)}
+        self.assertTrue(steps.run_steps(
+            [steps.Step('a', lambda: ran.append('a') or True,
+                        inputs=inputs)],
+            checkpoints=checkpoints))
+        self.assertEqual(ran, ['a'])
+        self.assertEqual(checkpoints, {})
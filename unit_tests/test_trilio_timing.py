@@ -0,0 +1,80 @@
+import subprocess
+import threading
+
+import lib.trilio.trilio_timing as timing
+import unit_tests.test_utils
+
+
+class TestTrilioTiming(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioTiming, self).setUp()
+        self.obj = timing
+        self.patches = ['log', 'unitdata']
+        self.patch_all()
+        self.kv = {}
+        self.unitdata.kv.return_value.get.side_effect = self.kv.get
+        self.unitdata.kv.return_value.set.side_effect = self.kv.__setitem__
+
+    def test_span_outside_profiled(self):
+        with timing.span('noop') as frame:
+            self.assertIsNone(frame)
+        self.unitdata.kv.assert_not_called()
+
+    def test_profiled_records_spans(self):
+        def handler():
+            with timing.profiled('install'):
+                with timing.span('download'):
+                    with timing.span('extract'):
+                        subprocess.check_call(['true'])
+                thread = threading.Thread(target=step)
+                thread.start()
+                thread.join()
+
+        @timing.timed()
+        def step():
+            subprocess.check_call(['true'])
+            subprocess.check_call(['true'])
+
+        handler()
+        self.assertIs(subprocess.Popen, timing._popen)
+        run = self.kv[timing.TIMING_HISTORY_KEY][0]
+        self.assertEqual(run['name'], 'install')
+        self.assertTrue(run['ok'])
+        self.assertEqual(run['subprocesses'], 3)
+        spans = dict((s['name'], s) for s in run['spans'])
+        self.assertEqual(
+            sorted(spans), ['download', 'download/extract', 'step'])
+        self.assertEqual(spans['download']['subprocesses'], 1)
+        self.assertEqual(spans['download/extract']['subprocesses'], 1)
+        self.assertEqual(spans['step']['subprocesses'], 2)
+
+    def test_profiled_failed_run(self):
+        @timing.profiled('install')
+        def handler():
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            handler()
+        self.assertFalse(self.kv[timing.TIMING_HISTORY_KEY][0]['ok'])
+
+    def test_history_bounded(self):
+        @timing.profiled('config-changed')
+        def handler():
+            pass
+
+        for _ in range(timing.TIMING_HISTORY_SIZE + 5):
+            handler()
+        self.assertEqual(len(self.kv[timing.TIMING_HISTORY_KEY]),
+                         timing.TIMING_HISTORY_SIZE)
+
+    def test_get_runs(self):
+        self.kv[timing.TIMING_HISTORY_KEY] = [
+            {'name': 'install', 'n': 1},
+            {'name': 'config-changed', 'n': 2},
+            {'name': 'install', 'n': 3},
+        ]
+        self.assertEqual([r['n'] for r in timing.get_runs()], [3, 2, 1])
+        self.assertEqual([r['n'] for r in timing.get_runs(1)], [3])
+        self.assertEqual(
+            [r['n'] for r in timing.get_runs(name='install')], [3, 1])
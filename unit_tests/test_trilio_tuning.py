@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_tuning as tuning
+import unit_tests.test_utils
+
+
+class TestTrilioTuning(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioTuning, self).setUp()
+        self.obj = tuning
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _write(self, path, content):
+        path = os.path.join(self.tmp, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_mem_total_mb(self):
+        meminfo = self._write(
+            'meminfo', 'MemTotal:       65830856 kB\nMemFree: 1 kB\n')
+        self.assertEqual(tuning.mem_total_mb(meminfo), 64287)
+        self.assertIsNone(tuning.mem_total_mb(meminfo + '.missing'))
+
+    def test_nic_speed_mbps(self):
+        net = os.path.join(self.tmp, 'net')
+        self._write('net/eno1/speed', '10000\n')
+        self._write('net/eno1/device', '')
+        self._write('net/eno2/speed', '-1\n')
+        self._write('net/eno2/device', '')
+        # Bridges report speed too but have no device
+        self._write('net/br0/speed', '100000\n')
+        self.assertEqual(tuning.nic_speed_mbps(net), 10000)
+
+    def test_derive_settings_small_host(self):
+        self.assertEqual(tuning.derive_settings({
+            'cpus': 16, 'mem_mb': 64 * 1024, 'nic_mbps': 10000,
+            'latency_ms': 0.5}), {
+                'max_uploads_pending': 2,
+                'max_commit_pending': 2,
+                'qemu_agent_ping_timeout': 600})
+
+    def test_derive_settings_large_host(self):
+        self.assertEqual(tuning.derive_settings({
+            'cpus': 128, 'mem_mb': 1024 * 1024, 'nic_mbps': 100000,
+            'latency_ms': None}), {
+                'max_uploads_pending': 16,
+                'max_commit_pending': 8,
+                'qemu_agent_ping_timeout': 600})
+
+    def test_derive_settings_slow_target(self):
+        self.assertEqual(tuning.derive_settings({
+            'cpus': 128, 'mem_mb': None, 'nic_mbps': None,
+            'latency_ms': 25}), {
+                'max_uploads_pending': 16,
+                'max_commit_pending': 3,
+                'qemu_agent_ping_timeout': 900})
@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+import tempfile
+
+import lib.trilio.trilio_virtenv as virtenv
+import unit_tests.test_utils
+
+
+class TestTrilioVirtenv(unit_tests.test_utils.CharmTestCase):
+
+    def setUp(self):
+        super(TestTrilioVirtenv, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.link = os.path.join(self.tmp, '.virtenv')
+        self.versions_dir = os.path.join(self.tmp, 'versions')
+        os.mkdir(self.versions_dir)
+
+    def _venv(self, path, version=None, sha256=None, mtime=None):
+        os.makedirs(os.path.join(path, 'bin'))
+        if version:
+            with open(os.path.join(path, virtenv.VIRTENV_STAMP), 'w') as f:
+                json.dump({'version': version, 'sha256': sha256}, f)
+        if mtime:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _version(self, name, version=None, mtime=None):
+        return self._venv(os.path.join(self.versions_dir, name),
+                          version=version, mtime=mtime)
+
+    def test_version_name(self):
+        self.assertEqual(virtenv.version_name('3.1.25', 'abcdef0123456789'),
+                         '3.1.25-abcdef012345')
+        self.assertEqual(virtenv.version_name('1:3.1/25'), '1_3.1_25')
+        self.assertEqual(virtenv.version_name(None), 'legacy')
+
+    def test_versions(self):
+        self._version('old', mtime=1000)
+        self._version('new', mtime=2000)
+        self._version('.staging-x', mtime=3000)
+        self.assertEqual(virtenv.versions(self.versions_dir), ['new', 'old'])
+        self.assertEqual(virtenv.versions(self.link), [])
+
+    def test_find_version(self):
+        self._version('3.1-aaa', version='3.1')
+        self.assertEqual(virtenv.find_version(self.versions_dir, '3.1'),
+                         '3.1-aaa')
+        self.assertIsNone(
+            virtenv.find_version(self.versions_dir, '3.1', 'bbb'))
+        self.assertIsNone(virtenv.find_version(self.versions_dir, '3.2'))
+
+    def test_adopt(self):
+        self._venv(self.link, version='3.1', sha256='a' * 64)
+        self.assertEqual(virtenv.adopt(self.link, self.versions_dir),
+                         '3.1-aaaaaaaaaaaa')
+        self.assertTrue(os.path.islink(self.link))
+        self.assertEqual(virtenv.active_version(self.link),
+                         '3.1-aaaaaaaaaaaa')
+        self.assertEqual(virtenv.read_stamp(self.link)['version'], '3.1')
+        # Only a directory is adopted, and only once
+        self.assertIsNone(virtenv.adopt(self.link, self.versions_dir))
+
+    def test_activate(self):
+        self.assertIsNone(virtenv.active_version(self.link))
+        self._version('old', mtime=1000)
+        self._version('new', mtime=2000)
+        self.assertTrue(virtenv.activate(
+            self.link, self.versions_dir, 'old'))
+        self.assertEqual(virtenv.active_version(self.link), 'old')
+        self.assertEqual(virtenv.versions(self.versions_dir), ['old', 'new'])
+        self.assertFalse(virtenv.activate(
+            self.link, self.versions_dir, 'old'))
+        self.assertTrue(virtenv.activate(
+            self.link, self.versions_dir, 'new'))
+        self.assertTrue(os.path.isdir(os.path.join(self.link, 'bin')))
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['.virtenv', 'versions'])
+        with self.assertRaises(ValueError):
+            virtenv.activate(self.link, self.versions_dir, 'missing')
+
+    def test_previous_version(self):
+        self._version('a', mtime=1000)
+        self._version('b', mtime=2000)
+        virtenv.activate(self.link, self.versions_dir, 'b')
+        self.assertEqual(virtenv.previous_version(
+            self.link, self.versions_dir), 'a')
+        virtenv.activate(self.link, self.versions_dir, 'a')
+        self.assertEqual(virtenv.previous_version(
+            self.link, self.versions_dir), 'b')
+
+    def test_prune(self):
+        for i, name in enumerate(['a', 'b', 'c', 'd']):
+            self._version(name, mtime=1000 * (i + 1))
+        os.symlink(os.path.join(self.versions_dir, 'a'), self.link)
+        self.assertEqual(
+            virtenv.prune(self.link, self.versions_dir, 2), ['b'])
+        # The active version is kept even if it is the oldest
+        self.assertEqual(virtenv.versions(self.versions_dir),
+                         ['d', 'c', 'a'])
+        self.assertEqual(
+            virtenv.prune(self.link, self.versions_dir, 0), ['c'])
+        self.assertEqual(virtenv.versions(self.versions_dir), ['d', 'a'])